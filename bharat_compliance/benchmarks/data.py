@@ -0,0 +1,359 @@
+"""Synthetic data for the TDS benchmarks, generated from a seed so that every run on an
+empty site produces the same suppliers, items and vouchers.
+
+All records are named or linked with the `_Bench` prefix. Seeding is additive: asking for
+more of a record than already exists only creates the difference, so the suite can grow
+the same data set from one scale to the next.
+"""
+
+import random
+
+import frappe
+from frappe.utils import add_days, cint, date_diff, getdate, today
+from erpnext.accounts.utils import get_fiscal_year
+
+from bharat_compliance.benchmarks.tds_docs_query import validate_site
+from bharat_compliance.income_tax_bharat.doctype.tax_withholding_setting.tax_withholding_setting import (
+	enable_item_wise_tds,
+)
+
+SUPPLIER_PREFIX = "_Bench Supplier"
+ITEM_PREFIX = "_Bench Item"
+TDS_ACCOUNT_NAME = "_Bench TDS"
+# (name, rate, single threshold, cumulative threshold, tax on excess amount)
+CATEGORIES = (
+	("_Bench 194C", 2, 30000, 100000, 0),
+	("_Bench 194J", 10, 0, 30000, 0),
+	("_Bench 194I", 10, 0, 240000, 1),
+	("_Bench 194Q", 0.1, 0, 5000000, 1),
+)
+ITEMS_PER_SUPPLIER = 8
+
+
+def get_volumes(invoices, suppliers_per_pan=3):
+	"""Volumes of every record for a scale given in Purchase Invoices"""
+	invoices = cint(invoices)
+	suppliers = max(10, invoices // 20)
+	return frappe._dict(
+		{
+			"suppliers": suppliers,
+			"suppliers_per_pan": suppliers_per_pan,
+			"items": max(20, invoices // 10),
+			"invoices": invoices,
+			"item_wise_ratio": 0.5,
+			"max_lines": 20,
+			"journal_entries": invoices // 10,
+			"payment_entries": invoices // 20,
+			"lower_deduction_certificates": max(1, suppliers // 20),
+		}
+	)
+
+
+def seed(company, volumes, seed=42):
+	"""Creates the records of `volumes` in `company` that do not exist yet"""
+	validate_site()
+	context = get_seed_context(company)
+	context.seed = seed
+
+	enable_item_wise_tds()
+	seed_categories(context)
+	suppliers = seed_suppliers(context, volumes)
+	supplier_items = seed_items(context, volumes, suppliers)
+	seed_purchase_invoices(context, volumes, suppliers, supplier_items)
+	seed_journal_entries(context, volumes, suppliers)
+	seed_payment_entries(context, volumes, suppliers)
+	seed_lower_deduction_certificates(context, volumes, suppliers)
+	frappe.db.commit()
+
+	return get_counts()
+
+
+def get_seed_context(company):
+	fiscal_year = get_fiscal_year(today(), company=company)
+	company_details = frappe.get_cached_value(
+		"Company",
+		company,
+		["default_expense_account", "default_payable_account", "cost_center", "default_cash_account", "abbr"],
+		as_dict=1,
+	)
+	return frappe._dict(
+		{
+			"company": company,
+			"fiscal_year": fiscal_year[0],
+			"from_date": getdate(fiscal_year[1]),
+			"to_date": min(getdate(fiscal_year[2]), getdate(today())),
+			"tds_account": get_tds_account(company, company_details.abbr),
+			**company_details,
+		}
+	)
+
+
+def get_tds_account(company, abbr):
+	name = f"{TDS_ACCOUNT_NAME} - {abbr}"
+	if not frappe.db.exists("Account", name):
+		parent = frappe.db.get_value(
+			"Account", {"company": company, "account_name": "Duties and Taxes", "is_group": 1}
+		) or frappe.db.get_value("Account", {"company": company, "root_type": "Liability", "is_group": 1})
+		frappe.get_doc(
+			{
+				"doctype": "Account",
+				"account_name": TDS_ACCOUNT_NAME,
+				"company": company,
+				"parent_account": parent,
+				"account_type": "Tax",
+			}
+		).insert()
+
+	return name
+
+
+def seed_categories(context):
+	for name, rate, single_threshold, cumulative_threshold, tax_on_excess_amount in CATEGORIES:
+		if frappe.db.exists("Tax Withholding Category", name):
+			category = frappe.get_doc("Tax Withholding Category", name)
+		else:
+			category = frappe.new_doc("Tax Withholding Category")
+			category.name = category.category_name = name
+			category.tax_on_excess_amount = tax_on_excess_amount
+
+		if not any(d.company == context.company for d in category.accounts):
+			category.append("accounts", {"company": context.company, "account": context.tds_account})
+		if not any(getdate(d.from_date) == context.from_date for d in category.rates):
+			fiscal_year = get_fiscal_year(context.from_date, company=context.company)
+			category.append(
+				"rates",
+				{
+					"from_date": fiscal_year[1],
+					"to_date": fiscal_year[2],
+					"tax_withholding_rate": rate,
+					"single_threshold": single_threshold,
+					"cumulative_threshold": cumulative_threshold,
+				},
+			)
+		category.save()
+
+
+def get_rng(context, *key):
+	"""Random numbers of one record, the same whichever records were seeded before it"""
+	return random.Random(":".join(str(d) for d in (context.seed, *key)))
+
+
+def seed_suppliers(context, volumes):
+	"""Returns the names of all bench suppliers. Every `suppliers_per_pan` consecutive suppliers share a PAN."""
+	has_pan = frappe.get_meta("Supplier").has_field("pan")
+	group = frappe.db.get_value("Supplier Group", {"is_group": 0})
+	suppliers = []
+	for i in range(volumes.suppliers):
+		name = f"{SUPPLIER_PREFIX} {i:05d}"
+		suppliers.append(name)
+		if frappe.db.exists("Supplier", name):
+			continue
+
+		supplier = frappe.get_doc(
+			{
+				"doctype": "Supplier",
+				"supplier_name": name,
+				"supplier_group": group,
+				"tax_withholding_category": get_rng(context, "supplier", i).choice(CATEGORIES)[0],
+			}
+		)
+		if has_pan:
+			supplier.pan = get_pan(i // volumes.suppliers_per_pan)
+		supplier.insert()
+
+	return suppliers
+
+
+def get_pan(i):
+	return f"BNCHP{i % 10000:04d}{chr(ord('A') + i // 10000 % 26)}"
+
+
+def seed_items(context, volumes, suppliers):
+	"""Returns {supplier: [item_code, ...]}. Each supplier buys a few items, each with a category for that supplier."""
+	item_codes = [f"{ITEM_PREFIX} {i:05d}" for i in range(volumes.items)]
+	supplier_items = {
+		supplier: get_rng(context, "supplier_items", supplier).sample(
+			item_codes, min(ITEMS_PER_SUPPLIER, len(item_codes))
+		)
+		for supplier in suppliers
+	}
+
+	item_suppliers = {}
+	for supplier, items in supplier_items.items():
+		for item_code in items:
+			item_suppliers.setdefault(item_code, []).append(supplier)
+
+	for item_code in item_codes:
+		if frappe.db.exists("Item", item_code):
+			item = frappe.get_doc("Item", item_code)
+		else:
+			item = frappe.get_doc(
+				{
+					"doctype": "Item",
+					"item_code": item_code,
+					"item_name": item_code,
+					"item_group": frappe.db.get_value("Item Group", {"is_group": 0}),
+					"stock_uom": "Nos",
+					"is_stock_item": 0,
+				}
+			)
+
+		existing = {d.supplier for d in item.get("supplier_items")}
+		missing = [d for d in item_suppliers.get(item_code, []) if d not in existing]
+		if not missing and not item.is_new():
+			continue
+
+		for supplier in missing:
+			item.append(
+				"supplier_items",
+				{
+					"supplier": supplier,
+					"tax_withholding_category": get_rng(context, item_code, supplier).choice(CATEGORIES)[0],
+				},
+			)
+		item.save()
+
+	return supplier_items
+
+
+def get_random_date(context, rng):
+	return add_days(context.from_date, rng.randint(0, max(0, date_diff(context.to_date, context.from_date))))
+
+
+def get_bench_count(doctype, party_field):
+	return frappe.db.count(doctype, {party_field: ("like", f"{SUPPLIER_PREFIX}%"), "docstatus": 1})
+
+
+def seed_purchase_invoices(context, volumes, suppliers, supplier_items):
+	for i in range(get_bench_count("Purchase Invoice", "supplier"), volumes.invoices):
+		rng = get_rng(context, "purchase_invoice", i)
+		supplier = rng.choice(suppliers)
+		item_wise = rng.random() < volumes.item_wise_ratio
+		posting_date = get_random_date(context, rng)
+		pi = frappe.get_doc(
+			{
+				"doctype": "Purchase Invoice",
+				"company": context.company,
+				"supplier": supplier,
+				"posting_date": posting_date,
+				"set_posting_time": 1,
+				"credit_to": context.default_payable_account,
+				"apply_tds": 0 if item_wise else 1,
+				"item_wise_tds": 1 if item_wise else 0,
+				"items": [
+					{
+						"item_code": rng.choice(supplier_items[supplier]),
+						"qty": rng.randint(1, 10),
+						"rate": rng.randint(100, 50000),
+						"expense_account": context.default_expense_account,
+						"cost_center": context.cost_center,
+					}
+					for line in range(rng.randint(1, volumes.max_lines))
+				],
+			}
+		)
+		pi.insert()
+		pi.submit()
+
+
+def seed_journal_entries(context, volumes, suppliers):
+	for i in range(get_bench_count_journal_entries(), volumes.journal_entries):
+		rng = get_rng(context, "journal_entry", i)
+		supplier = rng.choice(suppliers)
+		amount = rng.randint(1000, 200000)
+		je = frappe.get_doc(
+			{
+				"doctype": "Journal Entry",
+				"company": context.company,
+				"posting_date": get_random_date(context, rng),
+				"apply_tds": 1,
+				"tax_withholding_category": frappe.get_cached_value("Supplier", supplier, "tax_withholding_category"),
+				"accounts": [
+					{
+						"account": context.default_expense_account,
+						"debit_in_account_currency": amount,
+						"cost_center": context.cost_center,
+					},
+					{
+						"account": context.default_payable_account,
+						"party_type": "Supplier",
+						"party": supplier,
+						"credit_in_account_currency": amount,
+						"cost_center": context.cost_center,
+					},
+				],
+			}
+		)
+		je.insert()
+		je.submit()
+
+
+def get_bench_count_journal_entries():
+	return len(
+		frappe.get_all(
+			"Journal Entry Account",
+			filters={"party": ("like", f"{SUPPLIER_PREFIX}%"), "docstatus": 1},
+			pluck="parent",
+			distinct=True,
+		)
+	)
+
+
+def seed_payment_entries(context, volumes, suppliers):
+	for i in range(get_bench_count("Payment Entry", "party"), volumes.payment_entries):
+		rng = get_rng(context, "payment_entry", i)
+		supplier = rng.choice(suppliers)
+		amount = rng.randint(1000, 100000)
+		pe = frappe.get_doc(
+			{
+				"doctype": "Payment Entry",
+				"payment_type": "Pay",
+				"company": context.company,
+				"posting_date": get_random_date(context, rng),
+				"party_type": "Supplier",
+				"party": supplier,
+				"paid_from": context.default_cash_account,
+				"paid_to": context.default_payable_account,
+				"paid_amount": amount,
+				"received_amount": amount,
+				"apply_tax_withholding_amount": 1,
+				"tax_withholding_category": frappe.get_cached_value("Supplier", supplier, "tax_withholding_category"),
+			}
+		)
+		pe.insert()
+		pe.submit()
+
+
+def seed_lower_deduction_certificates(context, volumes, suppliers):
+	existing = frappe.db.count("Lower Deduction Certificate", {"supplier": ("like", f"{SUPPLIER_PREFIX}%")})
+	has_pan = frappe.get_meta("Supplier").has_field("pan")
+	for i in range(existing, min(volumes.lower_deduction_certificates, len(suppliers))):
+		supplier = suppliers[i * len(suppliers) // volumes.lower_deduction_certificates]
+		frappe.get_doc(
+			{
+				"doctype": "Lower Deduction Certificate",
+				"certificate_no": f"BENCH{i:05d}",
+				"company": context.company,
+				"fiscal_year": context.fiscal_year,
+				"supplier": supplier,
+				"pan_no": frappe.db.get_value("Supplier", supplier, "pan") if has_pan else get_pan(i),
+				"tax_withholding_category": frappe.get_cached_value("Supplier", supplier, "tax_withholding_category"),
+				"valid_from": context.from_date,
+				"valid_upto": get_fiscal_year(context.from_date, company=context.company)[2],
+				"rate": get_rng(context, "ldc", i).choice((0.5, 1, 2)),
+				"certificate_limit": get_rng(context, "ldc_limit", i).randint(1, 20) * 100000,
+			}
+		).insert()
+
+
+def get_counts():
+	return {
+		"suppliers": frappe.db.count("Supplier", {"name": ("like", f"{SUPPLIER_PREFIX}%")}),
+		"items": frappe.db.count("Item", {"name": ("like", f"{ITEM_PREFIX}%")}),
+		"purchase_invoices": get_bench_count("Purchase Invoice", "supplier"),
+		"journal_entries": get_bench_count_journal_entries(),
+		"payment_entries": get_bench_count("Payment Entry", "party"),
+		"lower_deduction_certificates": frappe.db.count(
+			"Lower Deduction Certificate", {"supplier": ("like", f"{SUPPLIER_PREFIX}%")}
+		),
+	}
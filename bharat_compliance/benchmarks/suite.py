@@ -0,0 +1,163 @@
+"""Benchmark suite of the TDS hot paths at several data volumes.
+
+Run on a local test site (seeds data, needs allow_tests or developer_mode):
+
+    bench --site test_site execute bharat_compliance.benchmarks.suite.run \
+        --kwargs "{'company': '_Test Company', 'scales': [100, 1000], 'output': '/tmp/tds.json'}"
+
+For every scale, given in submitted Purchase Invoices, the synthetic data set of
+bharat_compliance.benchmarks.data is grown to that scale and then these are timed:
+
+- validate of a draft item-wise Purchase Invoice of a supplier sharing its PAN
+- validate of a draft Purchase Invoice with 'Apply Tax Withholding Amount'
+- execute of TDS Report for Bharat over the fiscal year
+
+Prints the results as JSON, and writes them to `output` if given, so that two runs can be
+compared to catch regressions.
+"""
+
+import json
+import statistics
+import time
+
+import frappe
+from frappe.utils import cint, now
+
+from bharat_compliance.benchmarks.data import (
+	SUPPLIER_PREFIX,
+	get_counts,
+	get_seed_context,
+	get_volumes,
+	seed,
+)
+from bharat_compliance.benchmarks.tds_docs_query import validate_site
+from bharat_compliance.bharat_compliance.report.tds_report_for_bharat.tds_report_for_bharat import execute
+from bharat_compliance.utils.instrumentation import capture_sql
+
+DEFAULT_SCALES = (100, 1000, 5000)
+
+
+def run(company, scales=DEFAULT_SCALES, repeat=5, lines=50, output=None, seed_value=42):
+	validate_site()
+	results = {"company": company, "started": now(), "repeat": cint(repeat), "lines": cint(lines), "scales": []}
+	for scale in sorted(cint(d) for d in scales):
+		start = time.perf_counter()
+		seed(company, get_volumes(scale), seed=seed_value)
+		seed_seconds = time.perf_counter() - start
+
+		# looked up once per scale, so that only validate is timed
+		context = get_seed_context(company)
+		supplier = get_benchmark_supplier()
+		item_codes = get_supplier_items(supplier)
+		item_wise = make_draft_invoice(company, context, supplier, item_codes, lines, True)
+		whole_invoice = make_draft_invoice(company, context, supplier, item_codes, lines, False)
+		results["scales"].append(
+			{
+				"scale": scale,
+				"seed_seconds": seed_seconds,
+				"counts": get_counts(),
+				"validate_item_wise": benchmark(
+					lambda doc: doc.validate(), repeat, setup=lambda: frappe.copy_doc(item_wise)
+				),
+				"validate_whole_invoice": benchmark(
+					lambda doc: doc.validate(), repeat, setup=lambda: frappe.copy_doc(whole_invoice)
+				),
+				"report": benchmark(lambda: run_report(company, context), repeat),
+			}
+		)
+		frappe.db.rollback()
+
+	out = json.dumps(results, indent=1, default=str)
+	if output:
+		with open(output, "w") as f:
+			f.write(out)
+	print(out)
+
+	return results
+
+
+def benchmark(fn, repeat=5, setup=None):
+	"""Times `fn` `repeat` times, counting the queries of each call. If `setup` is given, it is
+	called before each timed call, untimed, and its result is passed to `fn`."""
+	timings, query_counts = [], []
+	for i in range(cint(repeat)):
+		if setup:
+			arg = setup()
+			query_count, seconds = count_queries(lambda: fn(arg))
+		else:
+			query_count, seconds = count_queries(fn)
+		timings.append(seconds)
+		query_counts.append(query_count)
+
+	return {
+		"best_seconds": min(timings),
+		"median_seconds": statistics.median(timings),
+		"queries": max(query_counts),
+		"timings": timings,
+	}
+
+
+def count_queries(fn):
+	queries = []
+	start = time.perf_counter()
+	with capture_sql(lambda query, values: queries.append(query)):
+		fn()
+	seconds = time.perf_counter() - start
+
+	return len(queries), seconds
+
+
+def get_benchmark_supplier():
+	"""The bench supplier with the most submitted invoices, so that the fiscal year scans have the most to read"""
+	return frappe.get_all(
+		"Purchase Invoice",
+		filters={"supplier": ("like", f"{SUPPLIER_PREFIX}%"), "docstatus": 1},
+		fields=["supplier", "count(name) as invoices"],
+		group_by="supplier",
+		order_by="invoices desc, supplier asc",
+		limit=1,
+	)[0].supplier
+
+
+def get_supplier_items(supplier):
+	return frappe.get_all(
+		"Item Supplier", filters={"supplier": supplier, "parenttype": "Item"}, pluck="parent", order_by="parent"
+	)
+
+
+def make_draft_invoice(company, context, supplier, item_codes, lines, item_wise):
+	return frappe.get_doc(
+		{
+			"doctype": "Purchase Invoice",
+			"company": company,
+			"supplier": supplier,
+			"posting_date": context.to_date,
+			"set_posting_time": 1,
+			"credit_to": context.default_payable_account,
+			"apply_tds": 0 if item_wise else 1,
+			"item_wise_tds": 1 if item_wise else 0,
+			"items": [
+				{
+					"item_code": item_codes[i % len(item_codes)],
+					"qty": 1,
+					"rate": 10000,
+					"expense_account": context.default_expense_account,
+					"cost_center": context.cost_center,
+				}
+				for i in range(cint(lines))
+			],
+		}
+	)
+
+
+def run_report(company, context):
+	return execute(
+		frappe._dict(
+			{
+				"company": company,
+				"party_type": "Supplier",
+				"from_date": context.from_date,
+				"to_date": context.to_date,
+			}
+		)
+	)
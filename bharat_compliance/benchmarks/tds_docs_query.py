@@ -0,0 +1,123 @@
+"""Benchmark of the GL Entry query of the TDS report against a large party table.
+
+Run on a local test site (seeds parties, needs allow_tests or developer_mode):
+
+    bench --site test_site execute bharat_compliance.benchmarks.tds_docs_query.run \
+        --kwargs "{'company': '_Test Company', 'parties': 60000}"
+
+Prints the timing, SQL size and EXPLAIN plan of the previous form of the query,
+which passed every party name in an IN list, and of the current one, as JSON.
+"""
+
+import json
+import time
+
+import frappe
+from frappe.utils import add_months, now, today
+
+from bharat_compliance.bharat_compliance.report.tds_report_for_bharat.tds_report_for_bharat import (
+	get_bank_accounts,
+	get_tds_accounts,
+	get_tds_docs_query,
+)
+
+PARTY_PREFIX = "_Bench Party"
+
+
+def run(company, parties=60000, party_type="Supplier", from_date=None, to_date=None, repeat=3):
+	validate_site()
+	seed_parties(party_type, parties)
+
+	filters = frappe._dict(
+		{
+			"company": company,
+			"party_type": party_type,
+			"from_date": from_date or add_months(today(), -12),
+			"to_date": to_date or today(),
+		}
+	)
+	bank_accounts = get_bank_accounts()
+	tds_accounts = list(get_tds_accounts(filters).keys())
+
+	results = {
+		"parties": frappe.db.count(party_type),
+		"in_list": benchmark_query(get_in_list_tds_docs_query(filters, bank_accounts, tds_accounts), repeat),
+		"join": benchmark_query(get_tds_docs_query(filters, bank_accounts, tds_accounts), repeat),
+	}
+	print(json.dumps(results, indent=1, default=str))
+	return results
+
+
+def validate_site():
+	if not (frappe.conf.allow_tests or frappe.conf.developer_mode):
+		frappe.throw("Benchmarks seed data, run them only on a local site with allow_tests or developer_mode")
+
+
+def seed_parties(party_type, count):
+	"""Inserts parties named '_Bench Party <n>' until there are `count` of them"""
+	existing = frappe.db.count(party_type, {"name": ("like", f"{PARTY_PREFIX}%")})
+	if existing >= count:
+		return
+
+	group_field, group = (
+		("supplier_group", frappe.db.get_value("Supplier Group", {"is_group": 0}))
+		if party_type == "Supplier"
+		else ("customer_group", frappe.db.get_value("Customer Group", {"is_group": 0}))
+	)
+	name_field = frappe.scrub(party_type) + "_name"
+	timestamp = now()
+	values = [
+		(f"{PARTY_PREFIX} {i}", f"{PARTY_PREFIX} {i}", group, timestamp, timestamp, "Administrator", "Administrator")
+		for i in range(existing, count)
+	]
+	frappe.db.bulk_insert(
+		party_type,
+		fields=["name", name_field, group_field, "creation", "modified", "owner", "modified_by"],
+		values=values,
+		ignore_duplicates=True,
+	)
+	frappe.db.commit()
+
+
+def cleanup(party_type="Supplier"):
+	validate_site()
+	frappe.db.delete(party_type, {"name": ("like", f"{PARTY_PREFIX}%")})
+	frappe.db.commit()
+
+
+def get_in_list_tds_docs_query(filters, bank_accounts, tds_accounts):
+	"""The query as it was before the party table join, for comparison"""
+	gle = frappe.qb.DocType("GL Entry")
+	query = (
+		frappe.qb.from_(gle)
+		.select("voucher_no", "voucher_type", "against", "party")
+		.where(gle.is_cancelled == 0)
+		.where(gle.posting_date >= filters.from_date)
+		.where(gle.posting_date <= filters.to_date)
+	)
+	if bank_accounts:
+		query = query.where(gle.against.notin(bank_accounts))
+
+	party = frappe.get_all(filters.party_type, pluck="name")
+	jv_condition = gle.against.isin(party) | (
+		(gle.voucher_type == "Journal Entry")
+		& ((gle.party_type == filters.party_type) | (gle.party_type == ""))
+	)
+	return query.where((gle.account.isin(tds_accounts) & jv_condition) | gle.party.isin(party))
+
+
+def benchmark_query(query, repeat=3):
+	sql = query.get_sql()
+	timings = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		rows = frappe.db.sql(sql)
+		timings.append(time.perf_counter() - start)
+
+	return {
+		"rows": len(rows),
+		"sql_bytes": len(sql.encode()),
+		"best_seconds": min(timings),
+		"timings": timings,
+		"plan": frappe.db.sql(f"EXPLAIN {sql}", as_dict=True),
+	}
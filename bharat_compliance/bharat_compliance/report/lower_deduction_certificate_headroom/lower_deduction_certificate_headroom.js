@@ -0,0 +1,40 @@
+// Copyright (c) 2025, pwctech technologies private limited and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Lower Deduction Certificate Headroom"] = {
+	"filters": [
+		{
+			fieldname: "company",
+			label: __("Company"),
+			fieldtype: "Link",
+			options: "Company",
+			default: frappe.defaults.get_user_default("Company"),
+			reqd: 1,
+		},
+		{
+			fieldname: "supplier",
+			label: __("Supplier"),
+			fieldtype: "Link",
+			options: "Supplier",
+		},
+		{
+			fieldname: "tax_withholding_category",
+			label: __("Tax Withholding Category"),
+			fieldtype: "Link",
+			options: "Tax Withholding Category",
+		},
+		{
+			fieldname: "active_on",
+			label: __("Active On"),
+			fieldtype: "Date",
+			default: frappe.datetime.get_today(),
+		},
+	],
+	formatter: function (value, row, column, data, default_formatter) {
+		value = default_formatter(value, row, column, data);
+		if (column.fieldname == "remaining_amount" && data && data.remaining_amount <= 0) {
+			value = `<span style="color: var(--red-500)">${value}</span>`;
+		}
+		return value;
+	},
+};
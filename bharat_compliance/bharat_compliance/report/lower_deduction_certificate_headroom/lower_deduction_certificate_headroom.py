@@ -0,0 +1,39 @@
+# Copyright (c) 2025, pwctech technologies private limited and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+
+from bharat_compliance.utils.lower_deduction_certificate import get_headroom
+
+
+def execute(filters=None):
+	filters = frappe._dict(filters or {})
+	return get_columns(), get_headroom(filters)
+
+def get_columns():
+	return [
+		{
+			"label": _("Certificate"),
+			"fieldname": "name",
+			"fieldtype": "Link",
+			"options": "Lower Deduction Certificate",
+			"width": 180,
+		},
+		{"label": _("Supplier"), "fieldname": "supplier", "fieldtype": "Link", "options": "Supplier", "width": 180},
+		{"label": _("PAN"), "fieldname": "pan_no", "fieldtype": "Data", "width": 110},
+		{
+			"label": _("Tax Withholding Category"),
+			"fieldname": "tax_withholding_category",
+			"fieldtype": "Link",
+			"options": "Tax Withholding Category",
+			"width": 180,
+		},
+		{"label": _("Valid From"), "fieldname": "valid_from", "fieldtype": "Date", "width": 100},
+		{"label": _("Valid Upto"), "fieldname": "valid_upto", "fieldtype": "Date", "width": 100},
+		{"label": _("Rate"), "fieldname": "rate", "fieldtype": "Percent", "width": 80},
+		{"label": _("Certificate Limit"), "fieldname": "certificate_limit", "fieldtype": "Currency", "width": 140},
+		{"label": _("Consumed Amount"), "fieldname": "consumed_amount", "fieldtype": "Currency", "width": 140},
+		{"label": _("Remaining Amount"), "fieldname": "remaining_amount", "fieldtype": "Currency", "width": 140},
+		{"label": _("Utilisation"), "fieldname": "utilisation", "fieldtype": "Percent", "width": 100},
+	]
@@ -0,0 +1,64 @@
+# Copyright (c) 2025, pwctech technologies private limited and contributors
+# For license information, please see license.txt
+
+import math
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, flt, getdate
+
+
+def execute(filters=None):
+	filters = frappe._dict(filters or {})
+	if getdate(filters.from_date) > getdate(filters.to_date):
+		frappe.throw(_("From Date must be before To Date"))
+
+	return get_columns(), get_data(filters)
+
+def get_data(filters):
+	step_wise_logs = {}
+	for d in frappe.get_all(
+		"TDS Performance Log",
+		filters={"creation": ("between", [getdate(filters.from_date), add_days(filters.to_date, 1)])},
+		fields=["step", "duration", "query_count"],
+		order_by="step asc",
+	):
+		step_wise_logs.setdefault(d.step, []).append(d)
+
+	data = []
+	for step, logs in step_wise_logs.items():
+		durations = sorted(flt(d.duration) for d in logs)
+		query_counts = sorted(d.query_count or 0 for d in logs)
+		data.append(
+			{
+				"step": step,
+				"count": len(logs),
+				"p50_duration": get_percentile(durations, 50),
+				"p95_duration": get_percentile(durations, 95),
+				"max_duration": durations[-1],
+				"p50_query_count": get_percentile(query_counts, 50),
+				"p95_query_count": get_percentile(query_counts, 95),
+				"max_query_count": query_counts[-1],
+			}
+		)
+
+	data.sort(key=lambda d: d["p95_duration"], reverse=True)
+	return data
+
+def get_percentile(sorted_values, percentile):
+	"""Nearest rank percentile of values sorted in ascending order"""
+	if not sorted_values:
+		return 0
+	return sorted_values[max(0, math.ceil(percentile / 100 * len(sorted_values)) - 1)]
+
+def get_columns():
+	return [
+		{"label": _("Step"), "fieldname": "step", "fieldtype": "Data", "width": 240},
+		{"label": _("Validates"), "fieldname": "count", "fieldtype": "Int", "width": 90},
+		{"label": _("p50 Duration (ms)"), "fieldname": "p50_duration", "fieldtype": "Float", "width": 130},
+		{"label": _("p95 Duration (ms)"), "fieldname": "p95_duration", "fieldtype": "Float", "width": 130},
+		{"label": _("Max Duration (ms)"), "fieldname": "max_duration", "fieldtype": "Float", "width": 130},
+		{"label": _("p50 Queries"), "fieldname": "p50_query_count", "fieldtype": "Int", "width": 100},
+		{"label": _("p95 Queries"), "fieldname": "p95_query_count", "fieldtype": "Int", "width": 100},
+		{"label": _("Max Queries"), "fieldname": "max_query_count", "fieldtype": "Int", "width": 100},
+	]
@@ -57,5 +57,36 @@ frappe.query_reports["TDS Report for Bharat"] = {
 			reqd: 1,
 			width: "60px",
 		},
+		{
+			fieldname: "use_snapshot",
+			label: __("Use Snapshot"),
+			fieldtype: "Check",
+			description: __("Read the rows from the TDS Register instead of the GL Entries"),
+		},
 	],
+	onload: function (report) {
+		report.page.add_inner_button(__("Export in Background"), function () {
+			frappe.prompt(
+				{
+					fieldname: "file_format",
+					label: __("File Format"),
+					fieldtype: "Select",
+					options: ["CSV", "Excel"],
+					default: "CSV",
+					reqd: 1,
+				},
+				(values) => {
+					frappe.call({
+						method: "bharat_compliance.bharat_compliance.report.tds_report_for_bharat.tds_report_for_bharat.enqueue_export",
+						args: {
+							filters: report.get_values(),
+							file_format: values.file_format,
+						},
+					});
+				},
+				__("Export in Background"),
+				__("Export")
+			);
+		});
+	},
 };
\ No newline at end of file
@@ -1,17 +1,29 @@
 # Copyright (c) 2025, pwctech technologies private limited and contributors
 # For license information, please see license.txt
 
+import csv
+import json
+import os
+from bisect import bisect_right
+
 import frappe
 from frappe import _
+from frappe.query_builder.functions import IfNull
+from frappe.utils import flt, getdate
 
-def execute(filters=None):
-	if filters.get("party_type") == "Customer":
-		party_naming_by = frappe.db.get_single_value("Selling Settings", "cust_master_name")
-	else:
-		party_naming_by = frappe.db.get_single_value("Buying Settings", "supp_master_name")
+from bharat_compliance.utils.cache import get_cached_value
+from bharat_compliance.utils.parallel import get_date_windows, run_in_parallel
 
-	filters["naming_series"] = party_naming_by
+def execute(filters=None):
+	set_party_naming_by(filters)
 	validate_filters(filters)
+	if filters.get("use_snapshot"):
+		from bharat_compliance.income_tax_bharat.doctype.tds_register.tds_register import (
+			get_snapshot_result,
+		)
+
+		return get_columns(filters), *get_snapshot_result(filters)
+
 	(
 		tds_docs,
 		tds_accounts,
@@ -26,6 +38,224 @@ def execute(filters=None):
 	)
 	return columns, data
 
+def set_party_naming_by(filters):
+	if filters.get("party_type") == "Customer":
+		party_naming_by = frappe.db.get_single_value("Selling Settings", "cust_master_name")
+	else:
+		party_naming_by = frappe.db.get_single_value("Buying Settings", "supp_master_name")
+
+	filters["naming_series"] = party_naming_by
+
+def iter_result(filters, chunk_size=1000):
+	"""Yields the report rows one chunk of vouchers at a time, in order of posting date.
+
+	Vouchers are paged by (posting_date, voucher_no) and every chunk is enriched with its own
+	bulk lookups, so memory stays bounded whatever the date range. Rows are not sorted by
+	section code as in `execute`."""
+	filters = frappe._dict(filters)
+	set_party_naming_by(filters)
+	validate_filters(filters)
+
+	tax_rate_index = get_tax_rate_index()
+	bank_accounts = get_bank_accounts()
+	tds_accounts = get_tds_accounts(filters)
+	category_account_map = get_category_account_map(filters)
+
+	for tds_docs in iter_tds_docs(filters, bank_accounts, list(tds_accounts.keys()), chunk_size):
+		yield from get_voucher_rows(filters, tds_docs, tds_accounts, tax_rate_index, category_account_map)
+
+def get_voucher_rows(filters, tds_docs, tds_accounts, tax_rate_index, category_account_map):
+	"""Returns the report rows of `tds_docs`, looking up only the parties of these vouchers"""
+	tds_documents, tax_category_map, journal_entry_party_map, net_total_map = get_voucher_info(tds_docs)
+	gle_map = get_gle_map(tds_documents)
+	parties = {
+		get_entry_party(entry, journal_entry_party_map) for details in gle_map.values() for entry in details
+	}
+	party_map = get_party_pan_map(filters.get("party_type"), list(filter(None, parties)))
+
+	return get_rows(
+		filters,
+		gle_map,
+		tds_accounts,
+		tax_category_map,
+		journal_entry_party_map,
+		net_total_map,
+		party_map,
+		tax_rate_index,
+		category_account_map,
+	)
+
+@frappe.whitelist()
+def enqueue_export(filters, file_format="CSV"):
+	"""Exports the report in background jobs, for date ranges too large to load in the browser.
+	The date range is split into windows that are exported in parallel and joined in order."""
+	if not frappe.get_doc("Report", "TDS Report for Bharat").is_permitted():
+		frappe.throw(_("Not permitted to export {0}").format(_("TDS Report for Bharat")), frappe.PermissionError)
+
+	if file_format not in ("CSV", "Excel"):
+		frappe.throw(_("File format must be CSV or Excel"))
+
+	filters = frappe._dict(frappe.parse_json(filters))
+	windows = get_date_windows(filters.from_date, filters.to_date)
+	if len(windows) == 1:
+		frappe.enqueue(
+			"bharat_compliance.bharat_compliance.report.tds_report_for_bharat.tds_report_for_bharat.export_report",
+			queue="long",
+			timeout=6000,
+			filters=filters,
+			file_format=file_format,
+			user=frappe.session.user,
+		)
+	else:
+		run_in_parallel(
+			"bharat_compliance.bharat_compliance.report.tds_report_for_bharat.tds_report_for_bharat.export_report_part",
+			windows,
+			"bharat_compliance.bharat_compliance.report.tds_report_for_bharat.tds_report_for_bharat.merge_export_parts",
+			filters=filters,
+			file_format=file_format,
+			user=frappe.session.user,
+			export_name=frappe.generate_hash(length=8),
+		)
+
+	frappe.msgprint(
+		_("The report is being exported in the background. You will be notified when the file is ready.")
+	)
+
+def export_report(filters, file_format, user):
+	"""Writes the rows of `iter_result` to a private file as they are generated"""
+	filters = frappe._dict(filters)
+	set_party_naming_by(filters)
+	write_export(filters, file_format, user, iter_result(filters))
+
+def export_report_part(window, filters, file_format, user, export_name):
+	"""Writes the rows of one date window to a part file as JSON lines, returns its path"""
+	filters = frappe._dict(filters, from_date=window["from_date"], to_date=window["to_date"])
+	file_path = frappe.get_site_path("private", "files", f"{export_name}.part{window['index']}")
+	with open(file_path, "w") as f:
+		for row in iter_result(filters):
+			f.write(json.dumps(row, default=str))
+			f.write("\n")
+
+	return file_path
+
+def merge_export_parts(results, filters, file_format, user, export_name):
+	"""Joins the part files in date order into the exported file"""
+	# read back from the paths of this export only, not the ones returned by the jobs
+	part_paths = [frappe.get_site_path("private", "files", f"{export_name}.part{i}") for i in range(len(results))]
+
+	def iter_parts():
+		for file_path in part_paths:
+			with open(file_path) as f:
+				for line in f:
+					yield frappe._dict(json.loads(line))
+
+	try:
+		if any(not isinstance(d, str) for d in results):
+			frappe.log_error(title=_("{0} export failed").format(_("TDS Report for Bharat")))
+			notify_export_failed(user)
+			return
+
+		filters = frappe._dict(filters)
+		set_party_naming_by(filters)
+		write_export(filters, file_format, user, iter_parts())
+	except Exception:
+		frappe.db.rollback()
+		frappe.log_error(title=_("{0} export failed").format(_("TDS Report for Bharat")))
+		notify_export_failed(user)
+	finally:
+		remove_files(part_paths)
+
+def notify_export_failed(user):
+	frappe.get_doc(
+		{
+			"doctype": "Notification Log",
+			"for_user": user,
+			"type": "Alert",
+			"subject": _("{0} export failed, see the Error Log").format(_("TDS Report for Bharat")),
+		}
+	).insert(ignore_permissions=True)
+
+def remove_files(file_paths):
+	for file_path in file_paths:
+		if os.path.exists(file_path):
+			os.remove(file_path)
+
+def write_export(filters, file_format, user, rows):
+	columns = get_columns(filters)
+	fieldnames = [d["fieldname"] for d in columns]
+
+	file_name = "{0}-{1}.{2}".format(
+		frappe.scrub("TDS Report for Bharat"), frappe.generate_hash(length=8), "csv" if file_format == "CSV" else "xlsx"
+	)
+	file_path = frappe.get_site_path("private", "files", file_name)
+
+	if file_format == "CSV":
+		with open(file_path, "w", newline="") as f:
+			writer = csv.writer(f)
+			writer.writerow([d["label"] for d in columns])
+			for row in rows:
+				writer.writerow([row.get(fieldname) for fieldname in fieldnames])
+	else:
+		from openpyxl import Workbook
+
+		workbook = Workbook(write_only=True)
+		sheet = workbook.create_sheet(_("TDS Report for Bharat")[:31])
+		sheet.append([d["label"] for d in columns])
+		for row in rows:
+			sheet.append([row.get(fieldname) for fieldname in fieldnames])
+		workbook.save(file_path)
+
+	_file = frappe.get_doc(
+		{
+			"doctype": "File",
+			"file_name": file_name,
+			"file_url": f"/private/files/{file_name}",
+			"is_private": 1,
+			"attached_to_doctype": "Report",
+			"attached_to_name": "TDS Report for Bharat",
+		}
+	).insert(ignore_permissions=True)
+
+	frappe.get_doc(
+		{
+			"doctype": "Notification Log",
+			"for_user": user,
+			"type": "Alert",
+			"document_type": "File",
+			"document_name": _file.name,
+			"subject": _("{0} export is ready: {1}").format(
+				_("TDS Report for Bharat"), f'<a href="{_file.file_url}">{file_name}</a>'
+			),
+		}
+	).insert(ignore_permissions=True)
+
+def iter_tds_docs(filters, bank_accounts, tds_accounts, chunk_size=1000):
+	"""Yields the vouchers of the report in chunks, using (posting_date, voucher_no) as keyset"""
+	gle = frappe.qb.DocType("GL Entry")
+	last = None
+	while True:
+		query = add_tds_docs_conditions(
+			frappe.qb.from_(gle).select(gle.posting_date, gle.voucher_type, gle.voucher_no).distinct(),
+			gle,
+			filters,
+			bank_accounts,
+			tds_accounts,
+		)
+		query = query.orderby(gle.posting_date).orderby(gle.voucher_no).limit(chunk_size)
+		if last:
+			query = query.where(
+				(gle.posting_date > last.posting_date)
+				| ((gle.posting_date == last.posting_date) & (gle.voucher_no > last.voucher_no))
+			)
+
+		tds_docs = query.run(as_dict=True)
+		if tds_docs:
+			yield tds_docs
+		if len(tds_docs) < chunk_size:
+			return
+
+		last = tds_docs[-1]
+
 def validate_filters(filters):
 	"""Validate if dates are properly set"""
 	if filters.from_date > filters.to_date:
@@ -33,24 +263,51 @@ def validate_filters(filters):
 
 def get_result(filters, tds_docs, tds_accounts, tax_category_map, journal_entry_party_map, net_total_map):
 	party_map = get_party_pan_map(filters.get("party_type"))
-	tax_rate_map = get_tax_rate_map(filters)
+	tax_rate_index = get_tax_rate_index()
+	category_account_map = get_category_account_map(filters)
 	gle_map = get_gle_map(tds_docs)
 
+	out = get_rows(
+		filters,
+		gle_map,
+		tds_accounts,
+		tax_category_map,
+		journal_entry_party_map,
+		net_total_map,
+		party_map,
+		tax_rate_index,
+		category_account_map,
+	)
+	out.sort(key=lambda x: x["section_code"])
+
+	return out
+
+def get_rows(
+	filters,
+	gle_map,
+	tds_accounts,
+	tax_category_map,
+	journal_entry_party_map,
+	net_total_map,
+	party_map,
+	tax_rate_index,
+	category_account_map,
+):
+	voucher_address_map, party_address_map, address_map = get_address_maps(
+		filters, gle_map, journal_entry_party_map
+	)
+	purchase_invoice_tax_map = get_purchase_invoice_tax_map(net_total_map, category_account_map)
+	pan_field = "pan" if frappe.db.has_column(filters.party_type, "pan") else "tax_id"
+
 	out = []
 	for name, details in gle_map.items():
 		for entry in details:
 			tax_amount, total_amount = 0, 0
 			tax_withholding_category, rate = None, None
-			bill_no, bill_date = "", ""
-			party = entry.party or entry.against
+			party = get_entry_party(entry, journal_entry_party_map)
 			posting_date = entry.posting_date
 			voucher_type = entry.voucher_type
 
-			if voucher_type == "Journal Entry":
-				party_list = journal_entry_party_map.get(name)
-				if party_list:
-					party = party_list[0]
-
 			if entry.account in tds_accounts.keys():
 				tax_amount += entry.credit - entry.debit
 				# infer tax withholding category from the account if it's the single account for this category
@@ -62,137 +319,202 @@ def get_result(filters, tds_docs, tds_accounts, tax_category_map, journal_entry_
 				if not tax_withholding_category:
 					tax_withholding_category = party_map.get(party, {}).get("tax_withholding_category")
 
-				rate = tax_rate_map.get(tax_withholding_category)
+				rate = get_tax_rate(tax_rate_index, tax_withholding_category, posting_date)
+
+			if not tax_amount:
+				continue
+
+			# (section code, total amount, tax amount, bill no, bill date) of each row for this entry
+			tax_rows = None
 			if net_total_map.get((voucher_type, name)):
-				if voucher_type == "Journal Entry" and tax_amount and rate:
+				if voucher_type == "Journal Entry" and rate:
 					# back calcalute total amount from rate and tax_amount
 					total_amount = min(tax_amount / (rate / 100), net_total_map.get((voucher_type, name))[0])
 				elif voucher_type == "Purchase Invoice":
-					for v in net_total_map.get((voucher_type, name)):
-						if v[2] == tax_amount:
-							tax_withholding_category = v[0]
-							rate = tax_rate_map.get(tax_withholding_category)
-							total_amount, bill_no, bill_date = v[1], v[3], v[4]
+					tax_rows = get_purchase_invoice_tax_rows(
+						purchase_invoice_tax_map,
+						net_total_map[(voucher_type, name)],
+						name,
+						entry.account,
+						tax_withholding_category,
+						tax_amount,
+					)
 				else:
 					total_amount = net_total_map.get((voucher_type, name))
 			else:
 				total_amount += entry.credit
 
-			if tax_amount:
-				if party_map.get(party, {}).get("party_type") == "Supplier":
-					party_name = "supplier_name"
-					party_type = "supplier_type"
-				else:
-					party_name = "customer_name"
-					party_type = "customer_type"
-
-				row = {
-					"pan" if frappe.db.has_column(filters.party_type, "pan") else "tax_id": party_map.get(
-						party, {}
-					).get("pan"),
-					"party": party_map.get(party, {}).get("name"),
+			if not tax_rows:
+				tax_rows = [(tax_withholding_category, total_amount, tax_amount, "", "")]
+
+			party_details = party_map.get(party, {})
+			if party_details.get("party_type") == "Supplier":
+				party_name = "supplier_name"
+				party_type = "supplier_type"
+			else:
+				party_name = "customer_name"
+				party_type = "customer_type"
+
+			voucher_row = {
+				pan_field: party_details.get("pan"),
+				"party": party_details.get("name"),
+			}
+
+			if filters.naming_series == "Naming Series":
+				voucher_row["party_name"] = party_details.get(party_name)
+
+			voucher_row.update(
+				{
+					"entity_type": party_details.get(party_type),
+					"transaction_date": posting_date,
+					"transaction_type": voucher_type,
+					"ref_no": name,
 				}
+			)
 
-				if filters.naming_series == "Naming Series":
-					row["party_name"] = party_map.get(party, {}).get(party_name)
+			# address of the voucher, or else the first address linked to the party
+			address_name = voucher_address_map.get((voucher_type, name)) or party_address_map.get(party)
+			if address_map.get(address_name):
+				voucher_row.update(address_map[address_name])
 
+			for section_code, row_total_amount, row_tax_amount, bill_no, bill_date in tax_rows:
+				row = voucher_row.copy()
 				row.update(
 					{
-						"section_code": tax_withholding_category or "",
-						"entity_type": party_map.get(party, {}).get(party_type),
-						"rate": rate,
-						"total_amount": total_amount,
-						"tax_amount": tax_amount,
-						"transaction_date": posting_date,
-						"transaction_type": voucher_type,
-						"ref_no": name,
+						"section_code": section_code or "",
+						"rate": get_tax_rate(tax_rate_index, section_code, posting_date)
+						if section_code != tax_withholding_category
+						else rate,
+						"total_amount": row_total_amount,
+						"tax_amount": row_tax_amount,
 						"supplier_invoice_no": bill_no,
 						"supplier_invoice_date": bill_date,
 					}
 				)
+				out.append(row)
 
-				if filters.get("party_type") == "Supplier":
-					address_field = "supplier_address"
-				else:
-					address_field =  "customer_address"
-				if frappe.db.has_column(voucher_type, address_field):
-					address_name = frappe.db.get_value(voucher_type, name, address_field)
-					if address_name:
-						csp = frappe.db.get_value("Address", address_name, ["address_line1", "address_line2", "city","state","pincode"], as_dict=1)
-						address = csp.address_line1
-						if csp.address_line2:
-							address += f", {csp.address_line2}"
-						row.update({
-							"address": address,
-							"city": csp.city,
-							"state": csp.state,
-							"pincode": csp.pincode
-						})
-					else:
-						#update supplier address
-						add_qb = frappe.qb.DocType("Address")
-						dl_qb = frappe.qb.DocType("Dynamic Link")
-						address_name = (
-							frappe.qb.from_(add_qb)
-							.inner_join(dl_qb)
-							.on(dl_qb.parent == add_qb.name)
-							.select(
-								add_qb.name
-							)
-							.where(
-								(dl_qb.link_doctype == filters.get("party_type"))
-								& (dl_qb.link_name == party)
-							)
-						).run()
-						# address_name = frappe.db.get_value("Supplier", supplier, "supplier_primary_address")
-						if address_name:
-							csp = frappe.db.get_value("Address", address_name[0][0], ["address_line1", "address_line2", "city","state","pincode"], as_dict=1)
-							address = csp.address_line1
-							if csp.address_line2:
-								address += f", {csp.address_line2}"
-							row.update({
-								"address": address,
-								"city": csp.city,
-								"state": csp.state,
-								"pincode": csp.pincode
-							})
-				else:
-					#update supplier address
-					add_qb = frappe.qb.DocType("Address")
-					dl_qb = frappe.qb.DocType("Dynamic Link")
-					address_name = (
-						frappe.qb.from_(add_qb)
-						.inner_join(dl_qb)
-						.on(dl_qb.parent == add_qb.name)
-						.select(
-							add_qb.name
-						)
-						.where(
-							(dl_qb.link_doctype == filters.get("party_type"))
-							& (dl_qb.link_name == party)
-						)
-					).run()
-					# address_name = frappe.db.get_value("Supplier", supplier, "supplier_primary_address")
-					if address_name:
-						csp = frappe.db.get_value("Address", address_name[0][0], ["address_line1", "address_line2", "city","state","pincode"], as_dict=1)
-						address = csp.address_line1
-						if csp.address_line2:
-							address += f", {csp.address_line2}"
-						row.update({
-							"address": address,
-							"city": csp.city,
-							"state": csp.state,
-							"pincode": csp.pincode
-						})
+	return out
 
-				out.append(row)
+def get_purchase_invoice_tax_map(net_total_map, category_account_map):
+	"""Indexes the tax withholding rows of Purchase Invoices by (invoice, tax withholding account)"""
+	purchase_invoice_tax_map = {}
+	for (voucher_type, name), values in net_total_map.items():
+		if voucher_type != "Purchase Invoice":
+			continue
 
-	out.sort(key=lambda x: x["section_code"])
+		for v in values:
+			account = category_account_map.get(v[0])
+			purchase_invoice_tax_map.setdefault((name, account), []).append(v)
 
-	return out
+	return purchase_invoice_tax_map
 
-def get_party_pan_map(party_type):
+def get_purchase_invoice_tax_rows(
+	purchase_invoice_tax_map, values, name, account, tax_withholding_category, tax_amount
+):
+	"""Matches a TDS GL entry of a Purchase Invoice to its tax withholding rows through the account"""
+	matched = purchase_invoice_tax_map.get((name, account))
+	if not matched and len(values) == 1:
+		matched = values
+
+	if not matched:
+		return [(tax_withholding_category, 0, tax_amount, "", "")]
+
+	if len(matched) == 1:
+		v = matched[0]
+		return [(v[0], v[1], tax_amount, v[3], v[4])]
+
+	# categories sharing an account are posted as one GL entry, report them separately
+	return [(v[0], v[1], v[2], v[3], v[4]) for v in matched]
+
+def get_entry_party(entry, journal_entry_party_map):
+	party = entry.party or entry.against
+	if entry.voucher_type == "Journal Entry":
+		party_list = journal_entry_party_map.get(entry.voucher_no)
+		if party_list:
+			party = party_list[0]
+
+	return party
+
+def get_address_maps(filters, gle_map, journal_entry_party_map):
+	"""Resolves the addresses of all the vouchers and parties in the report with one query each.
+
+	Returns voucher_address_map {(voucher_type, voucher_no): address},
+	party_address_map {party: address} and address_map {address: address details}"""
+	address_field = "supplier_address" if filters.get("party_type") == "Supplier" else "customer_address"
+
+	vouchers_by_type = {}
+	parties = set()
+	for name, details in gle_map.items():
+		for entry in details:
+			vouchers_by_type.setdefault(entry.voucher_type, set()).add(name)
+			parties.add(get_entry_party(entry, journal_entry_party_map))
+
+	voucher_address_map = {}
+	for voucher_type, vouchers in vouchers_by_type.items():
+		if not frappe.db.has_column(voucher_type, address_field):
+			continue
+
+		for d in frappe.get_all(
+			voucher_type,
+			filters={"name": ("in", list(vouchers)), address_field: ("is", "set")},
+			fields=["name", address_field],
+		):
+			voucher_address_map[(voucher_type, d.name)] = d.get(address_field)
+
+	party_address_map = {}
+	parties.discard(None)
+	if parties:
+		add_qb = frappe.qb.DocType("Address")
+		dl_qb = frappe.qb.DocType("Dynamic Link")
+		party_addresses = (
+			frappe.qb.from_(add_qb)
+			.inner_join(dl_qb)
+			.on(dl_qb.parent == add_qb.name)
+			.select(dl_qb.link_name, add_qb.name)
+			.where(
+				(dl_qb.link_doctype == filters.get("party_type"))
+				& (dl_qb.link_name.isin(list(parties)))
+			)
+		).run()
+		for party, address_name in party_addresses:
+			party_address_map.setdefault(party, address_name)
+
+	address_map = {}
+	address_names = set(voucher_address_map.values()) | set(party_address_map.values())
+	if address_names:
+		for csp in frappe.get_all(
+			"Address",
+			filters={"name": ("in", list(address_names))},
+			fields=["name", "address_line1", "address_line2", "city", "state", "pincode"],
+		):
+			address = csp.address_line1
+			if csp.address_line2:
+				address += f", {csp.address_line2}"
+			address_map[csp.name] = {
+				"address": address,
+				"city": csp.city,
+				"state": csp.state,
+				"pincode": csp.pincode,
+			}
+
+	return voucher_address_map, party_address_map, address_map
+
+def get_party_pan_map(party_type, parties=None):
+	"""Returns the details of all parties of `party_type` from the shared cache,
+	or of only `parties` from the database"""
+	if parties is None:
+		return get_cached_value(
+			f"party_pan_map:{frappe.scrub(party_type)}",
+			[party_type],
+			lambda: build_party_pan_map(party_type),
+		)
+
+	return build_party_pan_map(party_type, parties)
+
+def build_party_pan_map(party_type, parties=None):
 	party_map = frappe._dict()
+	if parties is not None and not parties:
+		return party_map
 
 	fields = ["name", "tax_withholding_category"]
 	if party_type == "Supplier":
@@ -203,7 +525,9 @@ def get_party_pan_map(party_type):
 	if frappe.db.has_column(party_type, "pan"):
 		fields.append("pan")
 
-	party_details = frappe.db.get_all(party_type, fields=fields)
+	party_details = frappe.db.get_all(
+		party_type, filters={"name": ("in", parties)} if parties else None, fields=fields
+	)
 
 	for party in party_details:
 		party.party_type = party_type
@@ -318,19 +642,39 @@ def get_columns(filters):
 	return columns
 
 def get_tds_docs(filters):
-	tds_documents = []
-	purchase_invoices = []
-	sales_invoices = []
-	payment_entries = []
-	journal_entries = []
-	tax_category_map = frappe._dict()
-	net_total_map = frappe._dict()
-	journal_entry_party_map = frappe._dict()
-	bank_accounts = frappe.get_all("Account", {"is_group": 0, "account_type": "Bank"}, pluck="name")
+	bank_accounts = get_bank_accounts()
+	tds_accounts = get_tds_accounts(filters)
+
+	tds_docs = get_tds_docs_query(filters, bank_accounts, list(tds_accounts.keys())).run(as_dict=True)
+	tds_documents, tax_category_map, journal_entry_party_map, net_total_map = get_voucher_info(tds_docs)
+
+	return (
+		tds_documents,
+		tds_accounts,
+		tax_category_map,
+		journal_entry_party_map,
+		net_total_map,
+	)
+
+def get_bank_accounts():
+	return get_cached_value(
+		"bank_accounts",
+		["Account"],
+		lambda: frappe.get_all("Account", {"is_group": 0, "account_type": "Bank"}, pluck="name"),
+	)
+
+def get_tds_accounts(filters):
+	return get_cached_value(
+		"tds_accounts",
+		["Tax Withholding Category", "Account"],
+		lambda: build_tds_accounts(filters.get("company")),
+		company=filters.get("company"),
+	)
 
+def build_tds_accounts(company):
 	_tds_accounts = frappe.get_all(
 		"Tax Withholding Account",
-		{"company": filters.get("company")},
+		{"company": company},
 		["account", "parent"],
 	)
 	tds_accounts = {}
@@ -341,7 +685,32 @@ def get_tds_docs(filters):
 		else:
 			tds_accounts[tds_acc["account"]] = tds_acc["parent"]
 
-	tds_docs = get_tds_docs_query(filters, bank_accounts, list(tds_accounts.keys())).run(as_dict=True)
+	return tds_accounts
+
+def get_category_account_map(filters):
+	return get_cached_value(
+		"category_account_map",
+		["Tax Withholding Category", "Account"],
+		lambda: frappe._dict(
+			frappe.get_all(
+				"Tax Withholding Account",
+				{"company": filters.get("company")},
+				["parent", "account"],
+				as_list=1,
+			)
+		),
+		company=filters.get("company"),
+	)
+
+def get_voucher_info(tds_docs):
+	tds_documents = []
+	purchase_invoices = []
+	sales_invoices = []
+	payment_entries = []
+	journal_entries = []
+	tax_category_map = frappe._dict()
+	net_total_map = frappe._dict()
+	journal_entry_party_map = frappe._dict()
 
 	for d in tds_docs:
 		if d.voucher_type == "Purchase Invoice":
@@ -368,27 +737,21 @@ def get_tds_docs(filters):
 		journal_entry_party_map = get_journal_entry_party_map(journal_entries)
 		get_doc_info(journal_entries, "Journal Entry", tax_category_map, net_total_map)
 
-	return (
-		tds_documents,
-		tds_accounts,
-		tax_category_map,
-		journal_entry_party_map,
-		net_total_map,
-	)
+	return tds_documents, tax_category_map, journal_entry_party_map, net_total_map
 
 def get_tds_docs_query(filters, bank_accounts, tds_accounts):
+	gle = frappe.qb.DocType("GL Entry")
+	query = frappe.qb.from_(gle).select(gle.voucher_no, gle.voucher_type, gle.against, gle.party)
+	return add_tds_docs_conditions(query, gle, filters, bank_accounts, tds_accounts)
+
+def add_tds_docs_conditions(query, gle, filters, bank_accounts, tds_accounts):
 	if not tds_accounts:
 		frappe.throw(
 			_("No {0} Accounts found for this company.").format(frappe.bold(_("Tax Withholding"))),
 			title=_("Accounts Missing Error"),
 		)
-	gle = frappe.qb.DocType("GL Entry")
-	query = (
-		frappe.qb.from_(gle)
-		.select("voucher_no", "voucher_type", "against", "party")
-		.where(gle.is_cancelled == 0)
-	)
 
+	query = query.where(gle.is_cancelled == 0)
 	if filters.get("from_date"):
 		query = query.where(gle.posting_date >= filters.get("from_date"))
 	if filters.get("to_date"):
@@ -402,14 +765,19 @@ def get_tds_docs_query(filters, bank_accounts, tds_accounts):
 		jv_condition = gle.against.isin(party) | (
 			(gle.voucher_type == "Journal Entry") & (gle.party == filters.get("party"))
 		)
+		party_condition = gle.party.isin(party)
 	else:
-		party = frappe.get_all(filters.get("party_type"), pluck="name")
-		jv_condition = gle.against.isin(party) | (
+		# join the party table on against instead of passing every party name in an IN list,
+		# and match party rows on their party type
+		party_qb = frappe.qb.DocType(filters.get("party_type")).as_("against_party")
+		query = query.left_join(party_qb).on(party_qb.name == gle.against)
+		jv_condition = party_qb.name.isnotnull() | (
 			(gle.voucher_type == "Journal Entry")
 			& ((gle.party_type == filters.get("party_type")) | (gle.party_type == ""))
 		)
-	query = query.where((gle.account.isin(tds_accounts) & jv_condition) | gle.party.isin(party))
-	return query
+		party_condition = (gle.party_type == filters.get("party_type")) & (IfNull(gle.party, "") != "")
+
+	return query.where((gle.account.isin(tds_accounts) & jv_condition) | party_condition)
 
 def get_journal_entry_party_map(journal_entries):
 	journal_entry_party_map = {}
@@ -457,17 +825,23 @@ def get_doc_info(vouchers, doctype, tax_category_map, net_total_map=None):
 		doctype, filters={"name": ("in", vouchers)}, fields=common_fields + fields_dict[doctype]
 	)
 
+	item_wise_details = {}
+	if doctype == "Purchase Invoice":
+		item_wise_details = get_item_wise_tax_withholding_details(
+			[entry.name for entry in entries if entry.get("item_wise_tds")]
+		)
+
 	for entry in entries:
 		tax_category_map[(doctype, entry.name)] = entry.tax_withholding_category
 		if doctype == "Purchase Invoice":
 			value = []
 			if entry.get("item_wise_tds"):
-				purchase_invoice = frappe.get_doc("Purchase Invoice", entry.name)
-				for t in purchase_invoice.tax_withholding_details:
+				for t in item_wise_details.get(entry.name, []):
+					# net of the advance allocated, as in the GL entry
 					value.append([
 						t.tax_withholding_category,
 						t.net_amount,
-						t.tax_withheld,
+						flt(t.tax_withheld) - flt(t.get("advance_allocated")),
 						entry.bill_no,
 						entry.bill_date,
 					])
@@ -489,15 +863,52 @@ def get_doc_info(vouchers, doctype, tax_category_map, net_total_map=None):
 		net_total_map[(doctype, entry.name)] = value
 
 
-def get_tax_rate_map(filters):
-	rate_map = frappe.get_all(
-		"Tax Withholding Rate",
+def get_item_wise_tax_withholding_details(purchase_invoices):
+	"""Returns the Tax Withholding Detail rows of the invoices grouped by invoice"""
+	item_wise_details = {}
+	if not purchase_invoices:
+		return item_wise_details
+
+	for d in frappe.get_all(
+		"Tax Withholding Detail",
 		filters={
-			"from_date": ("<=", filters.get("from_date")),
-			"to_date": (">=", filters.get("to_date")),
+			"parenttype": "Purchase Invoice",
+			"parentfield": "tax_withholding_details",
+			"parent": ("in", purchase_invoices),
 		},
-		fields=["parent", "tax_withholding_rate"],
-		as_list=1,
-	)
+		fields=["parent", "tax_withholding_category", "net_amount", "tax_withheld", "advance_allocated"],
+		order_by="idx asc",
+	):
+		item_wise_details.setdefault(d.parent, []).append(d)
+
+	return item_wise_details
+
+
+def get_tax_rate_index():
+	"""Returns {tax_withholding_category: [(from_date, to_date, rate), ...]} ordered by from date"""
+	return get_cached_value("tax_rate_index", ["Tax Withholding Category"], build_tax_rate_index)
+
+def build_tax_rate_index():
+	tax_rate_index = {}
+	for d in frappe.get_all(
+		"Tax Withholding Rate",
+		filters={"parenttype": "Tax Withholding Category"},
+		fields=["parent", "from_date", "to_date", "tax_withholding_rate"],
+		order_by="parent asc, from_date asc",
+	):
+		tax_rate_index.setdefault(d.parent, []).append(
+			(getdate(d.from_date), getdate(d.to_date), flt(d.tax_withholding_rate))
+		)
+
+	return tax_rate_index
+
+def get_tax_rate(tax_rate_index, tax_withholding_category, transaction_date):
+	"""Returns the rate of the category in effect on `transaction_date`"""
+	periods = tax_rate_index.get(tax_withholding_category)
+	if not periods:
+		return None
 
-	return frappe._dict(rate_map)
\ No newline at end of file
+	transaction_date = getdate(transaction_date)
+	i = bisect_right(periods, transaction_date, key=lambda d: d[0]) - 1
+	if i >= 0 and transaction_date <= periods[i][1]:
+		return periods[i][2]
@@ -0,0 +1,59 @@
+# Copyright (c) 2025, pwctech technologies private limited and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from erpnext.accounts.doctype.tax_withholding_category.test_tax_withholding_category import create_records
+
+from bharat_compliance.bharat_compliance.report.tds_report_for_bharat.tds_report_for_bharat import (
+	get_doc_info,
+	get_purchase_invoice_tax_map,
+	get_purchase_invoice_tax_rows,
+)
+from bharat_compliance.income_tax_bharat.doctype.tax_withholding_setting.tax_withholding_setting import (
+	enable_item_wise_tds,
+)
+from bharat_compliance.overrides.test_purchase_invoice import (
+	create_item_with_category,
+	create_supplier,
+	create_tax_withholding_category,
+	make_item_wise_purchase_invoice,
+)
+
+
+class TestTDSReportForBharat(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		create_records()
+		enable_item_wise_tds()
+
+	def test_shared_account_rows_are_net_of_advances(self):
+		supplier = "_Test Report Shared Account Supplier"
+		categories = {"_Test Report Shared Account 10": 10, "_Test Report Shared Account 5": 5}
+		create_supplier(supplier)
+		for category, rate in categories.items():
+			create_tax_withholding_category(category, rate=rate, single_threshold=1000)
+			create_item_with_category(f"{category} Item", supplier, category)
+
+		pi = make_item_wise_purchase_invoice(supplier, [(f"{category} Item", 5000) for category in categories])
+		self.assertEqual([d.tax_withheld for d in pi.tax_withholding_details], [500, 250])
+		# an advance of 100 allocated against the first category, so 650 is posted to the account
+		frappe.db.set_value("Tax Withholding Detail", pi.tax_withholding_details[0].name, "advance_allocated", 100)
+
+		net_total_map = {}
+		get_doc_info([pi.name], "Purchase Invoice", {}, net_total_map)
+		tax_rows = get_purchase_invoice_tax_rows(
+			get_purchase_invoice_tax_map(net_total_map, {category: "TDS - _TC" for category in categories}),
+			net_total_map[("Purchase Invoice", pi.name)],
+			pi.name,
+			"TDS - _TC",
+			None,
+			650,
+		)
+
+		self.assertEqual(
+			[(d[0], d[2]) for d in tax_rows],
+			[("_Test Report Shared Account 10", 400), ("_Test Report Shared Account 5", 250)],
+		)
+		self.assertEqual(sum(d[2] for d in tax_rows), 650)
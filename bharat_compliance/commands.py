@@ -0,0 +1,169 @@
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("rebuild-tax-withholding-ledger")
+@click.option("--company", help="Rebuild only the entries of this company")
+@pass_context
+def rebuild_tax_withholding_ledger(context, company=None):
+	"Recreate the Tax Withholding Ledger from submitted vouchers"
+	from bharat_compliance.income_tax_bharat.doctype.tax_withholding_ledger.tax_withholding_ledger import (
+		rebuild_tax_withholding_ledger,
+	)
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		count = rebuild_tax_withholding_ledger(company)
+		frappe.db.commit()
+		click.echo(f"Rebuilt {count} Tax Withholding Ledger entries")
+	finally:
+		frappe.destroy()
+
+
+@click.command("check-tax-withholding-ledger")
+@click.option("--company", help="Check only the entries of this company")
+@pass_context
+def check_tax_withholding_ledger(context, company=None):
+	"Compare the Tax Withholding Ledger with the totals summed from the vouchers"
+	from bharat_compliance.income_tax_bharat.doctype.tax_withholding_ledger.tax_withholding_ledger import (
+		check_tax_withholding_ledger,
+	)
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		mismatches = check_tax_withholding_ledger(company)
+		for d in mismatches:
+			click.echo(f"{d.ledger}: {d.field} is {d.ledger_value}, expected {d.expected_value}")
+		click.echo(f"{len(mismatches)} mismatches found")
+		if mismatches:
+			raise SystemExit(1)
+	finally:
+		frappe.destroy()
+
+
+@click.command("rebuild-tds-register")
+@click.option("--company", help="Rebuild only the rows of this company")
+@pass_context
+def rebuild_tds_register(context, company=None):
+	"Recreate the TDS Register from the GL Entries"
+	from bharat_compliance.income_tax_bharat.doctype.tds_register.tds_register import rebuild_tds_register
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		count = rebuild_tds_register(company)
+		frappe.db.commit()
+		click.echo(f"Rebuilt {count} TDS Register rows")
+	finally:
+		frappe.destroy()
+
+
+@click.command("recompute-item-wise-tds")
+@click.option("--company", help="Recompute only the invoices of this company")
+@click.option("--supplier", help="Recompute only the invoices of this supplier")
+@click.option("--workers", type=int, help="Number of parts to split the invoices into, by supplier PAN")
+@click.option("--local", is_flag=True, default=False, help="Run the parts in a local process pool and wait")
+@pass_context
+def recompute_item_wise_tds(context, company=None, supplier=None, workers=None, local=False):
+	"Recompute item-wise Tax Withholding of draft Purchase Invoices"
+	from bharat_compliance.overrides.purchase_invoice import (
+		enqueue_item_wise_tds_recompute,
+		get_draft_item_wise_invoices,
+	)
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		filters = {key: value for key, value in {"company": company, "supplier": supplier}.items() if value}
+		invoices = get_draft_item_wise_invoices(filters=filters)
+		result = enqueue_item_wise_tds_recompute(invoices, local=local, partitions=workers)
+		frappe.db.commit()
+		if local:
+			click.echo(f"Recomputed {result.updated} of {len(invoices)} Purchase Invoices")
+			for name in result.failed:
+				click.echo(f"Failed: {name}")
+		else:
+			click.echo(f"Enqueued {len(invoices)} Purchase Invoices")
+	finally:
+		frappe.destroy()
+
+
+@click.command("apply-imported-item-wise-tds")
+@click.option("--company", help="Compute only the invoices of this company")
+@click.option("--supplier", help="Compute only the invoices of this supplier")
+@click.option("--submit", is_flag=True, default=False, help="Submit the invoices in the order of posting date")
+@pass_context
+def apply_imported_item_wise_tds(context, company=None, supplier=None, submit=False):
+	"Compute item-wise Tax Withholding of draft Purchase Invoices created by Data Import"
+	from bharat_compliance.utils.bulk_tds import apply_item_wise_tds
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		filters = {key: value for key, value in {"company": company, "supplier": supplier}.items() if value}
+		result = apply_item_wise_tds(filters=filters, submit=submit)
+		frappe.db.commit()
+		click.echo(f"{'Submitted' if submit else 'Computed'} {result.updated} Purchase Invoices")
+		for name in result.failed:
+			click.echo(f"Failed: {name}")
+	finally:
+		frappe.destroy()
+
+
+@click.command("rebuild-ldc-consumed-amount")
+@click.option("--company", help="Rebuild only the certificates of this company")
+@pass_context
+def rebuild_ldc_consumed_amount(context, company=None):
+	"Recount the consumed amount of Lower Deduction Certificates from submitted Purchase Invoices"
+	from bharat_compliance.utils.lower_deduction_certificate import rebuild_consumed_amounts
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		count = rebuild_consumed_amounts(company)
+		frappe.db.commit()
+		click.echo(f"Rebuilt the consumed amount of {count} Lower Deduction Certificates")
+	finally:
+		frappe.destroy()
+
+
+@click.command("tds-index-report")
+@click.option("--company", help="Company of the sample invoice and the report")
+@click.option("--supplier", help="Supplier of the sample invoice")
+@click.option("--create-missing", is_flag=True, default=False, help="Create the missing indexes")
+@pass_context
+def tds_index_report(context, company=None, supplier=None, create_missing=False):
+	"Print the missing tax withholding indexes and the EXPLAIN plans of the TDS queries as JSON"
+	import json
+
+	from bharat_compliance.utils.indexes import create_indexes, get_index_report
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		if create_missing:
+			create_indexes()
+		click.echo(json.dumps(get_index_report(company, supplier), indent=1, default=str))
+	finally:
+		frappe.destroy()
+
+
+commands = [
+	rebuild_tax_withholding_ledger,
+	check_tax_withholding_ledger,
+	rebuild_tds_register,
+	recompute_item_wise_tds,
+	apply_imported_item_wise_tds,
+	rebuild_ldc_consumed_amount,
+	tds_index_report,
+]
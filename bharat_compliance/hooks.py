@@ -30,6 +30,8 @@ app_license = "mit"
 # include js in doctype views
 # doctype_js = {"doctype" : "public/js/doctype.js"}
 # doctype_list_js = {"doctype" : "public/js/doctype_list.js"}
+doctype_js = {"Purchase Invoice": "public/js/purchase_invoice.js"}
+doctype_list_js = {"Purchase Invoice": "public/js/purchase_invoice_list.js"}
 # doctype_tree_js = {"doctype" : "public/js/doctype_tree.js"}
 # doctype_calendar_js = {"doctype" : "public/js/doctype_calendar.js"}
 
@@ -68,7 +70,8 @@ app_license = "mit"
 # ------------
 
 # before_install = "bharat_compliance.install.before_install"
-# after_install = "bharat_compliance.install.after_install"
+after_install = "bharat_compliance.install.after_install"
+after_migrate = "bharat_compliance.install.after_migrate"
 
 # Uninstallation
 # ------------
@@ -122,13 +125,49 @@ override_doctype_class = {
 # ---------------
 # Hook on document methods and events
 
-# doc_events = {
-# 	"*": {
-# 		"on_update": "method",
-# 		"on_cancel": "method",
-# 		"on_trash": "method"
-# 	}
-# }
+doc_events = {
+	"Purchase Invoice": {
+		"on_submit": [
+			"bharat_compliance.income_tax_bharat.doctype.tax_withholding_ledger.tax_withholding_ledger.update_tax_withholding_ledger",
+			"bharat_compliance.utils.lower_deduction_certificate.update_consumed_amount",
+		],
+		"on_cancel": [
+			"bharat_compliance.income_tax_bharat.doctype.tax_withholding_ledger.tax_withholding_ledger.update_tax_withholding_ledger",
+			"bharat_compliance.utils.lower_deduction_certificate.update_consumed_amount",
+		],
+	},
+	"Journal Entry": {
+		"on_submit": "bharat_compliance.income_tax_bharat.doctype.tax_withholding_ledger.tax_withholding_ledger.update_tax_withholding_ledger",
+		"on_cancel": "bharat_compliance.income_tax_bharat.doctype.tax_withholding_ledger.tax_withholding_ledger.update_tax_withholding_ledger",
+	},
+	"Tax Withholding Category": {
+		"on_update": "bharat_compliance.utils.cache.invalidate_cache",
+		"on_trash": "bharat_compliance.utils.cache.invalidate_cache",
+	},
+	"Supplier": {
+		"on_update": [
+			"bharat_compliance.utils.cache.invalidate_cache",
+			"bharat_compliance.income_tax_bharat.doctype.tax_withholding_ledger.tax_withholding_ledger.update_ledger_pan",
+		],
+		"on_trash": "bharat_compliance.utils.cache.invalidate_cache",
+		"after_rename": "bharat_compliance.utils.cache.invalidate_cache",
+	},
+	"Customer": {
+		"on_update": "bharat_compliance.utils.cache.invalidate_cache",
+		"on_trash": "bharat_compliance.utils.cache.invalidate_cache",
+		"after_rename": "bharat_compliance.utils.cache.invalidate_cache",
+	},
+	"Lower Deduction Certificate": {
+		"before_save": "bharat_compliance.utils.lower_deduction_certificate.set_consumed_amount",
+		"on_update": "bharat_compliance.utils.cache.invalidate_cache",
+		"on_trash": "bharat_compliance.utils.cache.invalidate_cache",
+	},
+	"Account": {
+		"on_update": "bharat_compliance.utils.cache.invalidate_cache",
+		"on_trash": "bharat_compliance.utils.cache.invalidate_cache",
+		"after_rename": "bharat_compliance.utils.cache.invalidate_cache",
+	},
+}
 
 # Scheduled Tasks
 # ---------------
@@ -151,6 +190,14 @@ override_doctype_class = {
 # 	],
 # }
 
+scheduler_events = {
+	"cron": {
+		"*/15 * * * *": [
+			"bharat_compliance.income_tax_bharat.doctype.tds_register.tds_register.refresh_tds_register",
+		],
+	},
+}
+
 # Testing
 # -------
 
@@ -227,3 +274,7 @@ override_doctype_class = {
 # 	"Logging DocType Name": 30  # days to retain logs
 # }
 
+
+default_log_clearing_doctypes = {
+	"TDS Performance Log": 30,
+}
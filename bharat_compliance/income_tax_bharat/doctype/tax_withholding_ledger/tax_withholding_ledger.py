@@ -0,0 +1,381 @@
+# Copyright (c) 2025, pwctech technologies private limited and contributors
+# For license information, please see license.txt
+
+import hashlib
+
+import frappe
+from frappe.model.document import Document
+from frappe.query_builder.functions import Count, IfNull, Sum
+from frappe.utils import cstr, flt, getdate, now_datetime
+
+LEDGER_AMOUNT_FIELDS = (
+	"net_total",
+	"voucher_net_total",
+	"voucher_grand_total",
+	"journal_credit_total",
+)
+REBUILD_TIMEOUT = 4 * 60 * 60
+
+
+class TaxWithholdingLedger(Document):
+	def autoname(self):
+		self.name = get_ledger_name(
+			self.company, self.party_type, self.pan, self.party, self.tax_withholding_category, self.from_date
+		)
+
+
+def get_ledger_name(company, party_type, pan, party, tax_withholding_category, from_date):
+	# one entry per key, so concurrent submits of the same key cannot create duplicates
+	key = "|".join(
+		cstr(d) for d in (company, party_type, pan, "" if pan else party, tax_withholding_category, getdate(from_date))
+	)
+	return "TWL-" + hashlib.sha256(key.encode()).hexdigest()[:20]
+
+
+def use_tax_withholding_ledger():
+	"""The ledger is read only once it is built from the vouchers submitted before it was enabled"""
+	settings = frappe.get_cached_doc("Tax Withholding Setting")
+	return bool(settings.get("use_tax_withholding_ledger") and settings.get("tax_withholding_ledger_built_on"))
+
+
+def enqueue_tax_withholding_ledger_rebuild():
+	frappe.enqueue(
+		"bharat_compliance.income_tax_bharat.doctype.tax_withholding_ledger.tax_withholding_ledger.rebuild_tax_withholding_ledger",
+		queue="long",
+		timeout=REBUILD_TIMEOUT,
+		job_id="tax_withholding_ledger_rebuild",
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+def get_ledger_totals(company, party_type, pan, party, tax_details):
+	"""Returns the running totals for the category period of `tax_details`, zeros if there are none yet"""
+	name = get_ledger_name(
+		company, party_type, pan, party, tax_details.get("tax_withholding_category"), tax_details.from_date
+	)
+	totals = frappe.db.get_value("Tax Withholding Ledger", name, LEDGER_AMOUNT_FIELDS, as_dict=1)
+
+	return frappe._dict({field: flt((totals or {}).get(field)) for field in LEDGER_AMOUNT_FIELDS})
+
+
+def update_tax_withholding_ledger(doc, method=None):
+	"""Adds the voucher to the ledger on submit and takes it out on cancel"""
+	sign = -1 if doc.docstatus == 2 else 1
+	if doc.doctype == "Purchase Invoice":
+		ledger_rows = get_purchase_invoice_ledger_rows(doc)
+	else:
+		ledger_rows = get_journal_entry_ledger_rows(doc)
+
+	pan_map = {}
+	period_map = {}
+	for key, amounts in ledger_rows.items():
+		company, party_type, party, tax_withholding_category, posting_date = key
+		if party not in pan_map:
+			pan_map[party] = get_party_pan(party_type, party)
+
+		period = get_tax_withholding_period(tax_withholding_category, posting_date, period_map)
+		if not period:
+			continue
+
+		add_to_ledger(
+			company,
+			party_type,
+			pan_map[party],
+			party,
+			tax_withholding_category,
+			period,
+			{field: sign * flt(value) for field, value in amounts.items()},
+		)
+
+
+def get_purchase_invoice_ledger_rows(doc):
+	ledger_rows = {}
+	if doc.is_opening == "Yes":
+		return ledger_rows
+
+	def add(tax_withholding_category, net_total):
+		ledger_rows[(doc.company, "Supplier", doc.supplier, tax_withholding_category, doc.posting_date)] = {
+			"net_total": net_total,
+			"voucher_net_total": doc.tax_withholding_net_total,
+			"voucher_grand_total": doc.grand_total,
+			"voucher_count": 1,
+		}
+
+	if doc.apply_tds and doc.tax_withholding_category:
+		add(doc.tax_withholding_category, doc.tax_withholding_net_total)
+
+	for d in doc.get("tax_withholding_details") or []:
+		# item-wise rows only count towards the cumulative credit of invoices with
+		# 'Apply Tax Withholding Amount', the same as in get_tds_amount
+		add(d.tax_withholding_category, d.net_amount if doc.apply_tds else 0)
+
+	return ledger_rows
+
+
+def get_journal_entry_ledger_rows(doc):
+	ledger_rows = {}
+	if not (doc.apply_tds and doc.tax_withholding_category) or doc.is_opening == "Yes":
+		return ledger_rows
+
+	for d in doc.accounts:
+		if d.party_type != "Supplier" or not d.party or d.reference_type == "Purchase Invoice":
+			continue
+
+		key = (doc.company, d.party_type, d.party, doc.tax_withholding_category, doc.posting_date)
+		ledger_rows.setdefault(key, {"journal_credit_total": 0, "voucher_count": 1})
+		ledger_rows[key]["journal_credit_total"] += flt(d.credit_in_account_currency) - flt(
+			d.debit_in_account_currency
+		)
+
+	return ledger_rows
+
+
+def add_to_ledger(company, party_type, pan, party, tax_withholding_category, period, amounts):
+	name = get_ledger_name(company, party_type, pan, party, tax_withholding_category, period.from_date)
+	if not frappe.db.exists("Tax Withholding Ledger", name):
+		try:
+			frappe.get_doc(
+				{
+					"doctype": "Tax Withholding Ledger",
+					"company": company,
+					"party_type": party_type,
+					"pan": pan,
+					"party": "" if pan else party,
+					"tax_withholding_category": tax_withholding_category,
+					"from_date": period.from_date,
+					"to_date": period.to_date,
+				}
+			).insert(ignore_permissions=True)
+		except frappe.DuplicateEntryError:
+			# created by a concurrent submit for the same key
+			pass
+
+	ledger = frappe.qb.DocType("Tax Withholding Ledger")
+	query = frappe.qb.update(ledger).set(ledger.modified, frappe.utils.now()).where(ledger.name == name)
+	for field, value in amounts.items():
+		query = query.set(ledger[field], ledger[field] + value)
+	query.run()
+
+
+def get_party_pan(party_type, party):
+	if frappe.get_meta(party_type).has_field("pan"):
+		return frappe.db.get_value(party_type, party, "pan") or ""
+	return ""
+
+
+def get_tax_withholding_period(tax_withholding_category, posting_date, period_map=None):
+	"""Returns the Tax Withholding Rate period of the category that contains `posting_date`"""
+	if period_map is None:
+		period_map = {}
+
+	if tax_withholding_category not in period_map:
+		period_map[tax_withholding_category] = frappe.get_all(
+			"Tax Withholding Rate",
+			filters={"parent": tax_withholding_category, "parenttype": "Tax Withholding Category"},
+			fields=["from_date", "to_date"],
+			order_by="from_date asc",
+		)
+
+	posting_date = getdate(posting_date)
+	for period in period_map[tax_withholding_category]:
+		if getdate(period.from_date) <= posting_date <= getdate(period.to_date):
+			return period
+
+
+def update_ledger_pan(doc, method=None):
+	"""doc_events hook of Supplier, moves the entries of the supplier to its new PAN when it changes"""
+	previous = doc.get_doc_before_save()
+	if not previous or cstr(previous.get("pan")) == cstr(doc.get("pan")):
+		return
+
+	pans = [d for d in (previous.get("pan"), doc.get("pan")) if d]
+	parties = {doc.name}
+	if pans:
+		parties.update(frappe.get_all("Supplier", filters={"pan": ("in", pans)}, pluck="name"))
+
+	rebuild_tax_withholding_ledger(parties=list(parties), pans=pans)
+
+
+def rebuild_tax_withholding_ledger(company=None, parties=None, pans=None):
+	"""Recreates the ledger from submitted Purchase Invoices and Journal Entries. With `parties`,
+	only the entries of `parties` and `pans` are recreated, which must be all the parties of those PANs."""
+	ledger = frappe.qb.DocType("Tax Withholding Ledger")
+	query = frappe.qb.from_(ledger)
+	if company:
+		query = query.where(ledger.company == company)
+	if parties is not None:
+		condition = ledger.party.isin(parties)
+		if pans:
+			condition = condition | ledger.pan.isin(pans)
+		query = query.where(condition)
+	query.delete().run()
+
+	pan_map = {}
+	if frappe.get_meta("Supplier").has_field("pan"):
+		pan_map = dict(frappe.get_all("Supplier", fields=["name", "pan"], as_list=1))
+
+	totals = {}
+	period_map = {}
+	for d in get_purchase_invoice_totals(company, parties) + get_journal_entry_totals(company, parties):
+		period = get_tax_withholding_period(d.tax_withholding_category, d.posting_date, period_map)
+		if not period:
+			continue
+
+		pan = pan_map.get(d.party) or ""
+		key = (d.company, pan, "" if pan else d.party, d.tax_withholding_category, getdate(period.from_date))
+		totals.setdefault(key, {"period": period, "amounts": {}})
+		for field in LEDGER_AMOUNT_FIELDS + ("voucher_count",):
+			totals[key]["amounts"].setdefault(field, 0)
+			totals[key]["amounts"][field] += flt(d.get(field))
+
+	for (_company, pan, party, tax_withholding_category, from_date), d in totals.items():
+		add_to_ledger(_company, "Supplier", pan, party, tax_withholding_category, d["period"], d["amounts"])
+
+	if not (company or parties is not None):
+		frappe.db.set_single_value("Tax Withholding Setting", "tax_withholding_ledger_built_on", now_datetime())
+		frappe.clear_document_cache("Tax Withholding Setting", "Tax Withholding Setting")
+
+	return len(totals)
+
+
+def get_purchase_invoice_totals(company=None, parties=None):
+	pi = frappe.qb.DocType("Purchase Invoice")
+	td = frappe.qb.DocType("Tax Withholding Detail")
+
+	def get_query():
+		query = (
+			frappe.qb.from_(pi)
+			.select(
+				pi.company,
+				pi.supplier.as_("party"),
+				pi.posting_date,
+				Sum(pi.tax_withholding_net_total).as_("voucher_net_total"),
+				Sum(pi.grand_total).as_("voucher_grand_total"),
+				Count(pi.name).as_("voucher_count"),
+			)
+			.where(pi.docstatus == 1)
+			.where(pi.is_opening == "No")
+			.groupby(pi.company, pi.supplier, pi.posting_date)
+		)
+		if company:
+			query = query.where(pi.company == company)
+		if parties is not None:
+			query = query.where(pi.supplier.isin(parties))
+		return query
+
+	invoice_totals = (
+		get_query()
+		.select(pi.tax_withholding_category, Sum(pi.tax_withholding_net_total).as_("net_total"))
+		.where(pi.apply_tds == 1)
+		.where(IfNull(pi.tax_withholding_category, "") != "")
+		.groupby(pi.tax_withholding_category)
+		.run(as_dict=True)
+	)
+	item_wise_totals = (
+		get_query()
+		.inner_join(td)
+		.on(td.parent == pi.name)
+		.select(td.tax_withholding_category, Sum(pi.apply_tds * td.net_amount).as_("net_total"))
+		.where(td.parenttype == "Purchase Invoice")
+		.groupby(td.tax_withholding_category)
+		.run(as_dict=True)
+	)
+
+	return invoice_totals + item_wise_totals
+
+
+def get_journal_entry_totals(company=None, parties=None):
+	je = frappe.qb.DocType("Journal Entry")
+	jea = frappe.qb.DocType("Journal Entry Account")
+	query = (
+		frappe.qb.from_(je)
+		.inner_join(jea)
+		.on(je.name == jea.parent)
+		.select(
+			je.company,
+			jea.party,
+			je.tax_withholding_category,
+			je.posting_date,
+			Sum(jea.credit_in_account_currency - jea.debit_in_account_currency).as_("journal_credit_total"),
+			Count(je.name).distinct().as_("voucher_count"),
+		)
+		.where(je.docstatus == 1)
+		.where(je.is_opening == "No")
+		.where(je.apply_tds == 1)
+		.where(IfNull(je.tax_withholding_category, "") != "")
+		.where(jea.party_type == "Supplier")
+		.where(IfNull(jea.party, "") != "")
+		.where(IfNull(jea.reference_type, "") != "Purchase Invoice")
+		.groupby(je.company, jea.party, je.tax_withholding_category, je.posting_date)
+	)
+	if company:
+		query = query.where(je.company == company)
+	if parties is not None:
+		query = query.where(jea.party.isin(parties))
+
+	return query.run(as_dict=True)
+
+
+def check_tax_withholding_ledger(company=None):
+	"""Compares every ledger entry with the totals of the fiscal year query path.
+	Returns the entries that do not match."""
+	from bharat_compliance.overrides.purchase_invoice import get_invoice_vouchers
+
+	mismatches = []
+	for entry in frappe.get_all(
+		"Tax Withholding Ledger",
+		filters={"company": company} if company else {},
+		fields=["name", "company", "party_type", "pan", "party", "tax_withholding_category", "from_date", "to_date"]
+		+ list(LEDGER_AMOUNT_FIELDS),
+	):
+		parties = [entry.party]
+		if entry.pan:
+			parties = frappe.get_all(entry.party_type, filters={"pan": entry.pan}, pluck="name")
+
+		tax_details = frappe._dict(
+			{
+				"tax_withholding_category": entry.tax_withholding_category,
+				"from_date": entry.from_date,
+				"to_date": entry.to_date,
+			}
+		)
+		vouchers = get_invoice_vouchers(
+			parties, tax_details, frappe._dict({"company": entry.company}), party_type=entry.party_type
+		)[0]
+		expected = get_query_path_totals(entry.tax_withholding_category, parties, vouchers)
+
+		for field in LEDGER_AMOUNT_FIELDS:
+			if flt(entry.get(field), 2) != flt(expected.get(field), 2):
+				mismatches.append(
+					frappe._dict(
+						{
+							"ledger": entry.name,
+							"field": field,
+							"ledger_value": flt(entry.get(field), 2),
+							"expected_value": flt(expected.get(field), 2),
+						}
+					)
+				)
+
+	return mismatches
+
+
+def get_query_path_totals(tax_withholding_category, parties, vouchers):
+	from bharat_compliance.overrides.purchase_invoice import get_invoice_credit_totals
+
+	totals = get_invoice_credit_totals(
+		frappe._dict({"tax_withholding_category": tax_withholding_category}), vouchers
+	)
+	totals.journal_credit_total = frappe.db.get_value(
+		"Journal Entry Account",
+		{
+			"parent": ("in", vouchers or [""]),
+			"docstatus": 1,
+			"party": ("in", parties),
+			"reference_type": ("!=", "Purchase Invoice"),
+		},
+		"sum(credit_in_account_currency - debit_in_account_currency)",
+	)
+
+	return totals
@@ -0,0 +1,99 @@
+# Copyright (c) 2025, pwctech technologies private limited and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase, change_settings
+from frappe.utils import flt, today
+from erpnext.accounts.doctype.tax_withholding_category.tax_withholding_category import (
+	get_tax_withholding_details,
+)
+from erpnext.accounts.doctype.tax_withholding_category.test_tax_withholding_category import (
+	create_purchase_invoice,
+	create_records,
+	create_tax_withholding_category_records,
+)
+
+from bharat_compliance.income_tax_bharat.doctype.tax_withholding_ledger.tax_withholding_ledger import (
+	check_tax_withholding_ledger,
+	get_ledger_totals,
+	get_party_pan,
+	rebuild_tax_withholding_ledger,
+	use_tax_withholding_ledger,
+)
+from bharat_compliance.overrides.test_purchase_invoice import create_supplier
+
+
+class TestTaxWithholdingLedger(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		create_records()
+		create_tax_withholding_category_records()
+
+	def get_totals(self, supplier):
+		tax_details = get_tax_withholding_details("Cumulative Threshold TDS", today(), "_Test Company")
+		return get_ledger_totals(
+			"_Test Company", "Supplier", get_party_pan("Supplier", supplier), supplier, tax_details
+		)
+
+	def test_ledger_follows_submit_and_cancel(self):
+		supplier = "Test TDS Supplier"
+		frappe.db.set_value("Supplier", supplier, "tax_withholding_category", "Cumulative Threshold TDS")
+		before = self.get_totals(supplier)
+
+		pi = create_purchase_invoice(supplier=supplier, rate=5000)
+		pi.submit()
+		after_submit = self.get_totals(supplier)
+		self.assertEqual(flt(after_submit.net_total - before.net_total), flt(pi.tax_withholding_net_total))
+		self.assertEqual(flt(after_submit.voucher_grand_total - before.voucher_grand_total), flt(pi.grand_total))
+
+		pi.cancel()
+		self.assertEqual(self.get_totals(supplier).net_total, before.net_total)
+
+	def test_rebuild_matches_query_path(self):
+		supplier = "Test TDS Supplier"
+		frappe.db.set_value("Supplier", supplier, "tax_withholding_category", "Cumulative Threshold TDS")
+		create_purchase_invoice(supplier=supplier, rate=5000).submit()
+
+		rebuild_tax_withholding_ledger("_Test Company")
+		self.assertEqual(check_tax_withholding_ledger("_Test Company"), [])
+
+	def test_enabled_ledger_counts_earlier_vouchers(self):
+		supplier = create_supplier("_Test Ledger Upgrade Supplier", "Cumulative Threshold TDS").name
+		for rate in (10000, 10000):
+			create_purchase_invoice(supplier=supplier, rate=rate).submit()
+		expected = get_tds_deducted(supplier, 15000)
+		self.assertTrue(expected)
+
+		# vouchers submitted before the upgrade are not in the ledger
+		frappe.db.delete("Tax Withholding Ledger")
+		with change_settings(
+			"Tax Withholding Setting", {"use_tax_withholding_ledger": 1, "tax_withholding_ledger_built_on": None}
+		):
+			self.assertFalse(use_tax_withholding_ledger())
+			self.assertEqual(get_tds_deducted(supplier, 15000), expected)
+
+			rebuild_tax_withholding_ledger()
+			self.assertTrue(use_tax_withholding_ledger())
+			self.assertEqual(get_tds_deducted(supplier, 15000), expected)
+
+	def test_pan_change_moves_entries(self):
+		if not frappe.get_meta("Supplier").has_field("pan"):
+			self.skipTest("Supplier has no PAN field")
+
+		supplier = create_supplier("_Test Ledger PAN Supplier", "Cumulative Threshold TDS")
+		supplier.pan = "ABCTL1234L"
+		supplier.save()
+		create_purchase_invoice(supplier=supplier.name, rate=5000).submit()
+		before = self.get_totals(supplier.name)
+
+		supplier.pan = "ABCTL5678L"
+		supplier.save()
+		self.assertEqual(self.get_totals(supplier.name), before)
+		self.assertEqual(check_tax_withholding_ledger("_Test Company"), [])
+
+
+def get_tds_deducted(supplier, rate):
+	pi = create_purchase_invoice(supplier=supplier, rate=rate)
+	pi.save()
+	return pi.taxes_and_charges_deducted
@@ -2,16 +2,42 @@
 # For license information, please see license.txt
 
 import frappe
+from frappe import _
 from frappe.model.document import Document
 from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
 
+from bharat_compliance.income_tax_bharat.doctype.tax_withholding_ledger.tax_withholding_ledger import (
+	enqueue_tax_withholding_ledger_rebuild,
+)
+from bharat_compliance.utils.lower_deduction_certificate import (
+	is_consumed_amount_tracked,
+	rebuild_consumed_amounts,
+)
+
 
 class TaxWithholdingSetting(Document):
 	def validate(self):
 		if self.item_wise_tds:
 			#creating custom fields in purchase invoice
 			create_tds_custom_fields()
+		if (
+			self.use_tax_withholding_ledger
+			and self.has_value_changed("use_tax_withholding_ledger")
+			and not self.tax_withholding_ledger_built_on
+		):
+			# submits and cancels keep the ledger up once it is built, it is not read until then
+			enqueue_tax_withholding_ledger_rebuild()
+			frappe.msgprint(
+				_("The Tax Withholding Ledger is being built in the background and is used once it is built")
+			)
 	
+def enable_item_wise_tds():
+	"""Turns on item-wise TDS, for the tests and the benchmark data"""
+	settings = frappe.get_single("Tax Withholding Setting")
+	if not settings.item_wise_tds:
+		settings.item_wise_tds = 1
+		settings.save()
+
 def create_tds_custom_fields():
 	custom_fields = {
 		"Purchase Invoice": [
@@ -31,6 +57,27 @@ def create_tds_custom_fields():
 				read_only=1,
 				print_hide=1,
 			),
+			dict(
+				fieldname="provisional_tds",
+				label="Provisional TDS (Upper Bound)",
+				fieldtype="Check",
+				insert_after="tax_withholding_details",
+				read_only=1,
+				no_copy=1,
+				print_hide=1,
+				depends_on="provisional_tds",
+				description="Estimated on save at the full rate of each category, without thresholds or advances, so the final amount can be lower. Being finalised in the background.",
+			),
+			dict(
+				fieldname="tds_fingerprint",
+				label="TDS Fingerprint",
+				fieldtype="Small Text",
+				insert_after="provisional_tds",
+				hidden=1,
+				read_only=1,
+				no_copy=1,
+				print_hide=1,
+			),
 		],
 		"Purchase Invoice Item": [
 			dict(
@@ -52,7 +99,43 @@ def create_tds_custom_fields():
 				print_hide=1,
 				options="Tax Withholding Category"
 			),
+		],
+		# the category the row was computed for, so that item-wise TDS can keep the rows of unchanged categories
+		"Advance Tax": [
+			dict(
+				fieldname="tax_withholding_category",
+				label="Tax Withholding Category",
+				fieldtype="Link",
+				insert_after="allocated_amount",
+				read_only=1,
+				options="Tax Withholding Category"
+			),
+		],
+		"Tax Withheld Vouchers": [
+			dict(
+				fieldname="tax_withholding_category",
+				label="Tax Withholding Category",
+				fieldtype="Link",
+				insert_after="taxable_amount",
+				read_only=1,
+				options="Tax Withholding Category"
+			),
+		],
+		"Lower Deduction Certificate": [
+			dict(
+				fieldname="consumed_amount",
+				label="Consumed Amount",
+				fieldtype="Currency",
+				insert_after="certificate_limit",
+				read_only=1,
+				no_copy=1,
+				description="Maintained on submit and cancel of Purchase Invoices",
+			),
 		]
 	}
 
+	consumed_amount_tracked = is_consumed_amount_tracked()
 	create_custom_fields(custom_fields)
+	if not consumed_amount_tracked:
+		# counted from the invoices submitted so far, then kept up on submit and cancel
+		rebuild_consumed_amounts()
@@ -1,9 +1,25 @@
 # Copyright (c) 2024, pwctech technologies private limited and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
 
 class TestTaxWithholdingSetting(FrappeTestCase):
-	pass
+	def test_item_wise_tds_creates_custom_fields(self):
+		settings = frappe.get_single("Tax Withholding Setting")
+		settings.item_wise_tds = 1
+		settings.save()
+
+		for doctype, fieldname in (
+			("Purchase Invoice", "item_wise_tds"),
+			("Purchase Invoice", "tax_withholding_details"),
+			("Purchase Invoice", "provisional_tds"),
+			("Purchase Invoice Item", "tax_withholding_category"),
+			("Item Supplier", "tax_withholding_category"),
+			("Advance Tax", "tax_withholding_category"),
+			("Tax Withheld Vouchers", "tax_withholding_category"),
+			("Lower Deduction Certificate", "consumed_amount"),
+		):
+			frappe.clear_cache(doctype=doctype)
+			self.assertTrue(frappe.get_meta(doctype).has_field(fieldname), f"{doctype}.{fieldname}")
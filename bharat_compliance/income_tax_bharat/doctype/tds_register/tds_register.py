@@ -0,0 +1,230 @@
+# Copyright (c) 2025, pwctech technologies private limited and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import add_to_date, cint, format_datetime, get_datetime, get_link_to_form, now_datetime
+
+from bharat_compliance.bharat_compliance.report.tds_report_for_bharat.tds_report_for_bharat import (
+	add_tds_docs_conditions,
+	get_bank_accounts,
+	get_category_account_map,
+	get_tax_rate_index,
+	get_tds_accounts,
+	get_voucher_rows,
+	iter_tds_docs,
+)
+
+PARTY_TYPES = ("Supplier", "Customer")
+# report columns stored as they are, the PAN column is stored as `pan` whatever its fieldname in the report
+REGISTER_FIELDS = (
+	"party",
+	"party_name",
+	"entity_type",
+	"transaction_type",
+	"ref_no",
+	"transaction_date",
+	"supplier_invoice_no",
+	"supplier_invoice_date",
+	"section_code",
+	"rate",
+	"total_amount",
+	"tax_amount",
+	"address",
+	"city",
+	"state",
+	"pincode",
+)
+# GL Entries committed after a refresh started can carry an older modified timestamp,
+# so every refresh looks back this far again. Refreshing a voucher twice is harmless.
+REFRESH_OVERLAP_MINUTES = 5
+CHUNK_SIZE = 500
+REBUILD_TIMEOUT = 4 * 60 * 60
+
+
+class TDSRegister(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("TDS Register", ["company", "party_type", "transaction_date"])
+
+
+def is_tds_register_enabled():
+	return cint(frappe.db.get_single_value("Tax Withholding Setting", "enable_tds_register"))
+
+
+def refresh_tds_register():
+	"""Scheduled job, updates the rows of the vouchers whose GL Entries changed since the last refresh"""
+	if not is_tds_register_enabled():
+		return
+
+	refreshed_upto = frappe.db.get_single_value("Tax Withholding Setting", "tds_register_refreshed_upto")
+	if not refreshed_upto:
+		# too long for the default queue on a large site, and the refresh would start it again every time
+		frappe.enqueue(
+			"bharat_compliance.income_tax_bharat.doctype.tds_register.tds_register.rebuild_tds_register",
+			queue="long",
+			timeout=REBUILD_TIMEOUT,
+			job_id="tds_register_rebuild",
+			deduplicate=True,
+		)
+		frappe.logger("bharat_compliance").info(
+			"TDS Register is not built yet, queued its rebuild. Run bench rebuild-tds-register on large sites."
+		)
+		return
+
+	upto = now_datetime()
+	since = add_to_date(get_datetime(refreshed_upto), minutes=-REFRESH_OVERLAP_MINUTES)
+	for (company, voucher_type), vouchers in get_changed_vouchers(since).items():
+		for i in range(0, len(vouchers), CHUNK_SIZE):
+			update_register_vouchers(company, voucher_type, vouchers[i : i + CHUNK_SIZE])
+
+	set_refreshed_upto(upto)
+
+
+def rebuild_tds_register(company=None):
+	"""Recreates the register from the GL Entries of `company`, or of all companies"""
+	upto = now_datetime()
+	count = 0
+	for _company in [company] if company else frappe.get_all("Company", pluck="name"):
+		frappe.db.delete("TDS Register", {"company": _company})
+		for party_type in PARTY_TYPES:
+			filters = get_register_filters(_company, party_type)
+			tds_accounts = get_tds_accounts(filters)
+			if not tds_accounts:
+				continue
+
+			for tds_docs in iter_tds_docs(filters, get_bank_accounts(), list(tds_accounts), CHUNK_SIZE):
+				count += insert_register_rows(
+					filters, get_register_rows(filters, [d.voucher_no for d in tds_docs])
+				)
+
+	if not company:
+		set_refreshed_upto(upto)
+
+	return count
+
+
+def get_changed_vouchers(since):
+	"""Returns {(company, voucher_type): [voucher_no, ...]} of the GL Entries modified after `since`,
+	cancelled ones included"""
+	gle = frappe.qb.DocType("GL Entry")
+	changed = {}
+	for d in (
+		frappe.qb.from_(gle)
+		.select(gle.company, gle.voucher_type, gle.voucher_no)
+		.distinct()
+		.where(gle.modified > since)
+		.run(as_dict=True)
+	):
+		changed.setdefault((d.company, d.voucher_type), []).append(d.voucher_no)
+
+	return changed
+
+
+def update_register_vouchers(company, voucher_type, vouchers):
+	"""Replaces the rows of `vouchers` of `voucher_type`, cancelled vouchers only lose theirs.
+	Vouchers of different types can share a name, so the rows are matched on both."""
+	frappe.db.delete(
+		"TDS Register",
+		{"company": company, "transaction_type": voucher_type, "ref_no": ("in", vouchers)},
+	)
+
+	count = 0
+	for party_type in PARTY_TYPES:
+		filters = get_register_filters(company, party_type)
+		count += insert_register_rows(filters, get_register_rows(filters, vouchers, voucher_type))
+
+	return count
+
+
+def get_register_filters(company, party_type):
+	# party name is stored in any case, the report shows it depending on the naming series
+	return frappe._dict({"company": company, "party_type": party_type, "naming_series": "Naming Series"})
+
+
+def get_register_rows(filters, vouchers, voucher_type=None):
+	"""Returns the report rows of those of `vouchers` that the report would include"""
+	tds_accounts = get_tds_accounts(filters)
+	if not (tds_accounts and vouchers):
+		return []
+
+	gle = frappe.qb.DocType("GL Entry")
+	query = (
+		add_tds_docs_conditions(
+			frappe.qb.from_(gle).select(gle.voucher_type, gle.voucher_no).distinct(),
+			gle,
+			filters,
+			get_bank_accounts(),
+			list(tds_accounts),
+		)
+		.where(gle.company == filters.company)
+		.where(gle.voucher_no.isin(vouchers))
+	)
+	if voucher_type:
+		query = query.where(gle.voucher_type == voucher_type)
+
+	tds_docs = query.run(as_dict=True)
+	if not tds_docs:
+		return []
+
+	return get_voucher_rows(
+		filters, tds_docs, tds_accounts, get_tax_rate_index(), get_category_account_map(filters)
+	)
+
+
+def insert_register_rows(filters, rows):
+	if not rows:
+		return 0
+
+	now = now_datetime()
+	user = frappe.session.user
+	fields = ["name", "creation", "modified", "modified_by", "owner", "company", "party_type", "pan"]
+	values = [
+		[frappe.generate_hash(length=10), now, now, user, user, filters.company, filters.party_type]
+		+ [row.get("pan", row.get("tax_id"))]
+		+ [row.get(field) for field in REGISTER_FIELDS]
+		for row in rows
+	]
+	frappe.db.bulk_insert("TDS Register", fields + list(REGISTER_FIELDS), values)
+
+	return len(rows)
+
+
+def set_refreshed_upto(upto):
+	frappe.db.set_single_value("Tax Withholding Setting", "tds_register_refreshed_upto", upto)
+
+
+def get_snapshot_result(filters):
+	"""Returns the rows of the report from the register and a message with the time of the last refresh"""
+	if not is_tds_register_enabled():
+		frappe.throw(
+			_("Enable the TDS Register in {0} to use the snapshot").format(
+				get_link_to_form("Tax Withholding Setting", "Tax Withholding Setting")
+			)
+		)
+
+	register_filters = {
+		"party_type": filters.get("party_type"),
+		"transaction_date": ("between", [filters.get("from_date"), filters.get("to_date")]),
+	}
+	for field in ("company", "party"):
+		if filters.get(field):
+			register_filters[field] = filters.get(field)
+
+	pan_field = "pan" if frappe.db.has_column(filters.get("party_type"), "pan") else "tax_id"
+	data = frappe.get_all(
+		"TDS Register",
+		filters=register_filters,
+		fields=[f"pan as {pan_field}", *REGISTER_FIELDS],
+		order_by="section_code asc, transaction_date asc, ref_no asc",
+	)
+
+	refreshed_upto = frappe.db.get_single_value("Tax Withholding Setting", "tds_register_refreshed_upto")
+	message = _("Showing the TDS Register as refreshed upto {0}").format(
+		format_datetime(refreshed_upto) if refreshed_upto else _("never")
+	)
+
+	return data, message
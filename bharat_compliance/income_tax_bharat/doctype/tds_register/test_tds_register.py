@@ -0,0 +1,52 @@
+# Copyright (c) 2025, pwctech technologies private limited and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase, change_settings
+from frappe.utils import add_days, today
+from erpnext.accounts.doctype.tax_withholding_category.test_tax_withholding_category import (
+	create_purchase_invoice,
+	create_records,
+	create_tax_withholding_category_records,
+)
+
+from bharat_compliance.bharat_compliance.report.tds_report_for_bharat.tds_report_for_bharat import execute
+from bharat_compliance.income_tax_bharat.doctype.tds_register.tds_register import update_register_vouchers
+
+
+class TestTDSRegister(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		create_records()
+		create_tax_withholding_category_records()
+
+	@change_settings("Tax Withholding Setting", {"enable_tds_register": 1})
+	def test_snapshot_matches_report(self):
+		supplier = "Test TDS Supplier"
+		frappe.db.set_value("Supplier", supplier, "tax_withholding_category", "Cumulative Threshold TDS")
+		pi = create_purchase_invoice(supplier=supplier, rate=50000)
+		pi.submit()
+
+		update_register_vouchers(pi.company, pi.doctype, [pi.name])
+		filters = {
+			"company": pi.company,
+			"party_type": "Supplier",
+			"from_date": add_days(today(), -1),
+			"to_date": today(),
+		}
+
+		def get_rows(use_snapshot):
+			data = execute(frappe._dict(filters, use_snapshot=use_snapshot))[1]
+			return [frappe._dict(d) for d in data if d.get("ref_no") == pi.name]
+
+		live, snapshot = get_rows(0), get_rows(1)
+		self.assertTrue(live)
+		self.assertEqual(
+			[(d.section_code, d.total_amount, d.tax_amount) for d in snapshot],
+			[(d.section_code, d.total_amount, d.tax_amount) for d in live],
+		)
+
+		pi.cancel()
+		update_register_vouchers(pi.company, pi.doctype, [pi.name])
+		self.assertFalse(get_rows(1))
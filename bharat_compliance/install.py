@@ -0,0 +1,18 @@
+import frappe
+
+from bharat_compliance.utils.indexes import create_indexes
+
+
+def after_install():
+	create_indexes()
+
+
+def after_migrate():
+	create_indexes()
+	if frappe.db.get_single_value("Tax Withholding Setting", "item_wise_tds"):
+		# custom fields added by later versions of the app
+		from bharat_compliance.income_tax_bharat.doctype.tax_withholding_setting.tax_withholding_setting import (
+			create_tds_custom_fields,
+		)
+
+		create_tds_custom_fields()
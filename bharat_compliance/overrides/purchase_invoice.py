@@ -1,7 +1,11 @@
+import hashlib
+import json
+
 import frappe
 from frappe import _
-from frappe.query_builder.functions import Sum
-from frappe.utils import cint, flt
+from frappe.query_builder import Case
+from frappe.query_builder.functions import Max, Sum
+from frappe.utils import cint, flt, getdate
 from erpnext.accounts.doctype.purchase_invoice.purchase_invoice import PurchaseInvoice
 from erpnext.accounts.doctype.tax_withholding_category.tax_withholding_category import (
     get_party_details,
@@ -11,103 +15,274 @@ from erpnext.accounts.doctype.tax_withholding_category.tax_withholding_category
     get_advance_vouchers,
     get_taxes_deducted_on_advances_allocated,
     get_deducted_tax,
-    get_lower_deduction_certificate,
     is_valid_certificate,
     get_lower_deduction_amount,
     normal_round
     )
+from bharat_compliance.income_tax_bharat.doctype.tax_withholding_ledger.tax_withholding_ledger import (
+    get_ledger_totals,
+    use_tax_withholding_ledger,
+)
+from bharat_compliance.utils.cache import get_cached_value
+from bharat_compliance.utils.instrumentation import instrument, tds_trace
+from bharat_compliance.utils.lower_deduction_certificate import (
+    get_consumed_amount,
+    get_lower_deduction_certificate,
+)
+from bharat_compliance.utils.parallel import partition_by_pan, run_in_parallel
+
+# a finalisation job waits this long for the jobs of other invoices of the same PAN
+FINALISE_LOCK_WAIT = 10 * 60
+FINALISE_LOCK_TIMEOUT = 30 * 60
 
 class CustomPurchaseInvoice(PurchaseInvoice):
     def validate(self):
-        super().validate()
-        self.set("tax_withholding_details", [])
-        if self.apply_tds and self.item_wise_tds:
-            frappe.throw("Please select either 'Apply Tax Withholding Amount' or 'Apply Item wise Tax Withholding Amount'")
-        elif self.item_wise_tds:
-            self.set_item_wise_tax_witholding_category()
-            self.custom_set_tax_withholding()
-        else:
-             return
+        with tds_trace(self):
+            # the standard validate clears these, they are kept if item-wise TDS is not recomputed
+            advance_tax = list(self.get("advance_tax") or [])
+            tax_withheld_vouchers = list(self.get("tax_withheld_vouchers") or [])
+            super().validate()
+            if self.apply_tds and self.item_wise_tds:
+                frappe.throw("Please select either 'Apply Tax Withholding Amount' or 'Apply Item wise Tax Withholding Amount'")
+            elif self.item_wise_tds:
+                self.set_item_wise_tax_witholding_category()
+                if self.docstatus == 0 and frappe.flags.in_import and is_item_wise_tds_computed_after_import():
+                    # computed for all the imported invoices together by bharat_compliance.utils.bulk_tds
+                    self.set("tax_withholding_details", [])
+                    self.tds_fingerprint = None
+                    return
+                # results computed by bharat_compliance.utils.bulk_tds, the same as the per-document path, so
+                # the fingerprint is stored with them and marks the invoice as computed after import
+                precomputed = self.flags.precomputed_item_wise_tds is not None
+                # the party lookups of the fingerprint are reused by the computation
+                tds_context = get_tds_context(self)
+                tds_fingerprint = get_tds_fingerprint(self, tds_context)
+                if not (precomputed or self.flags.recompute_tds) and tds_fingerprint == self.get("tds_fingerprint"):
+                    self.set("advance_tax", advance_tax)
+                    self.set("tax_withheld_vouchers", tax_withheld_vouchers)
+                    return
+                if not (precomputed or self.flags.recompute_tds) and is_item_wise_tds_finalised_in_background(self):
+                    if self.docstatus == 1:
+                        # provisional, or its inputs changed since it was finalised
+                        frappe.throw(
+                            _("Tax Withholding of this invoice is finalised in the background, please use Finalise and Submit"),
+                            title=_("Tax Withholding not final"),
+                        )
+                    self.set_provisional_tax_withholding()
+                    return
+                unchanged_categories = (
+                    [] if precomputed or self.flags.recompute_tds
+                    else get_unchanged_categories(self.get("tds_fingerprint"), tds_fingerprint)
+                )
+                self.custom_set_tax_withholding(
+                    unchanged_categories, advance_tax, tax_withheld_vouchers, tds_context=tds_context
+                )
+                # with the TDS rows as computed, so that a later manual edit of them is recomputed
+                self.tds_fingerprint = set_fingerprint_taxes(tds_fingerprint, self)
+                self.provisional_tds = 0
+            else:
+                self.set("tax_withholding_details", [])
+                self.tds_fingerprint = None
+                self.provisional_tds = 0
     
+    @instrument("category_resolution")
     def set_item_wise_tax_witholding_category(self):
+        item_wise_categories = get_item_wise_tax_withholding_categories(
+            [i.item_code for i in self.items], self.supplier
+        )
+        skipped_items = []
         for i in self.items:
-            tax_withholding_category = frappe.db.get_value("Item Supplier", filters={"parent": i.item_code, "supplier": self.supplier}, fieldname="tax_withholding_category")
+            tax_withholding_category = item_wise_categories.get(i.item_code)
             if tax_withholding_category:
                 i.tax_withholding_category = tax_withholding_category
-            else:
-                item_link = frappe.utils.get_link_to_form("Item", i.item_code)
-                frappe.msgprint(
-                    _(
-                        "Skipping Item {0} as no Tax Withholding Category is set in the 'Supplier Items' table against the Supplier {1}."
-                    ).format(item_link, self.supplier)
-                )
+            elif i.item_code not in skipped_items:
+                skipped_items.append(i.item_code)
 
-    def custom_set_tax_withholding(self):
-        self.tax_withholding_category = None
+        if skipped_items:
+            item_links = ", ".join(frappe.utils.get_link_to_form("Item", d) for d in skipped_items)
+            frappe.msgprint(
+                _(
+                    "Skipping Items {0} as no Tax Withholding Category is set in the 'Supplier Items' table against the Supplier {1}."
+                ).format(item_links, self.supplier)
+            )
+
+    def get_tax_withholding_net_amounts(self):
         tax_withholding_categories = {}
         for i in self.items:
             if i.tax_withholding_category:
                 tax_withholding_categories.setdefault(i.tax_withholding_category, 0)
                 tax_withholding_categories[i.tax_withholding_category] += i.base_net_amount
-        if not tax_withholding_categories:
-            return super().calculate_taxes_and_totals()
-        accounts = set()
-        tax_withholding_details = {}
-        for tax_withholding_category, net_amount in tax_withholding_categories.items():
-            tax_withholding_detail, advance_taxes, voucher_wise_amount = get_item_tax_withholding_details(
-                self, tax_withholding_category, net_amount
+
+        return tax_withholding_categories
+
+    def set_provisional_tax_withholding(self):
+        """Estimates the item-wise TDS of a draft as the rate of each category on its net amount, and
+        queues the job that finalises it. Thresholds, certificates and advances are not applied, so the
+        estimate is an upper bound of the final amount, which can be lower or nil."""
+        self.tax_withholding_category = None
+        previous_accounts = {d.account_head for d in self.get("tax_withholding_details") or [] if d.account_head}
+        self.set("tax_withholding_details", [])
+        self.set("advance_tax", [])
+        self.set("tax_withheld_vouchers", [])
+        tax_rows = {}
+        for tax_withholding_category, net_amount in self.get_tax_withholding_net_amounts().items():
+            tax_details = get_cached_tax_withholding_details(tax_withholding_category, self.posting_date, self.company)
+            if not tax_details:
+                continue
+            if tax_details.account_head not in tax_rows:
+                tax_rows[tax_details.account_head] = get_tax_row_for_tds(tax_details, 0)
+                tax_rows[tax_details.account_head].update({"cost_center": get_cost_center(self)})
+            self.append(
+                "tax_withholding_details",
+                {
+                    "tax_withholding_category": tax_withholding_category,
+                    "net_amount": net_amount,
+                    "tax_withheld": flt(net_amount * tax_details.rate / 100),
+                    "account_head": tax_details.account_head,
+                    "advance_allocated": 0,
+                },
             )
+
+        self.set_tds_taxes(tax_rows, previous_accounts)
+        self.provisional_tds = 1
+        self.tds_fingerprint = None
+        enqueue_item_wise_tds_finalisation(self.name)
+
+    @instrument("custom_set_tax_withholding")
+    def custom_set_tax_withholding(
+        self, unchanged_categories=None, advance_tax=None, tax_withheld_vouchers=None, tds_context=None
+    ):
+        """Sets the item-wise TDS rows. The rows of `unchanged_categories`, whose lines and context are
+        the same as when they were computed, are kept and only the other categories are recomputed."""
+        self.tax_withholding_category = None
+        tax_withholding_categories = self.get_tax_withholding_net_amounts()
+
+        previous_accounts = {d.account_head for d in self.get("tax_withholding_details") or [] if d.account_head}
+        # rows computed before the account was stored on them are recomputed
+        kept_details = [
+            d
+            for d in self.get("tax_withholding_details") or []
+            if d.tax_withholding_category in (unchanged_categories or [])
+            and d.tax_withholding_category in tax_withholding_categories
+            and d.account_head
+        ]
+        kept_categories = {d.tax_withholding_category for d in kept_details}
+        self.set("tax_withholding_details", kept_details)
+        self.set("advance_tax", [d for d in advance_tax or [] if d.get("tax_withholding_category") in kept_categories])
+        self.set(
+            "tax_withheld_vouchers",
+            [d for d in tax_withheld_vouchers or [] if d.get("tax_withholding_category") in kept_categories],
+        )
+
+        changed_categories = [d for d in tax_withholding_categories if d not in kept_categories]
+        tax_rows = {}
+        # advance tax allocated on this invoice so far, by Advance Taxes and Charges row
+        allocated_advance_taxes = {}
+        for d in self.advance_tax:
+            allocated_advance_taxes.setdefault(d.reference_detail, 0)
+            allocated_advance_taxes[d.reference_detail] += flt(d.allocated_amount)
+        precomputed = self.flags.precomputed_item_wise_tds or {}
+        if any(d not in precomputed for d in changed_categories):
+            tds_context = get_tds_context(self, changed_categories, tds_context=tds_context)
+        for tax_withholding_category in changed_categories:
+            if tax_withholding_category in precomputed:
+                tax_withholding_detail, advance_taxes, voucher_wise_amount = precomputed[tax_withholding_category]
+            else:
+                tax_withholding_detail, advance_taxes, voucher_wise_amount = get_item_tax_withholding_details(
+                    self, tax_withholding_category, tax_withholding_categories[tax_withholding_category], tds_context=tds_context
+                )
             if not tax_withholding_detail:
                 continue
-            tax_withholding_data = {
-                "tax_withholding_category": tax_withholding_category,
-                "net_amount": net_amount,
-                "tax_withheld": tax_withholding_detail.get("tax_amount")
-            }
-            self.append("tax_withholding_details", tax_withholding_data)
-            self.allocate_advance_tds(tax_withholding_detail, advance_taxes)
-            tax_withholding_details.setdefault(tax_withholding_detail.get("account_head"), {"amount":0, "tax_rows": []})
-            tax_withholding_details[tax_withholding_detail.get("account_head")]["amount"] += tax_withholding_detail.get("tax_amount")
-            tax_withholding_details[tax_withholding_detail.get("account_head")]["tax_rows"].append(tax_withholding_detail)
-            
-        for d in self.taxes:
-            for account, details in tax_withholding_details.items():
-                if d.account_head == account:
-                    d.update(details["tax_rows"][0])
-                    d.tax_amount = details["amount"]
-            accounts.add(d.account_head)
-        for account, details in tax_withholding_details.items():
-            if account not in list(accounts):
-                tax_row = details["tax_rows"][0]
-                tax_row["tax_amount"] = details["amount"]
-                self.append("taxes", tax_row)
-        ## Add pending vouchers on which tax was withheld
-        for voucher_no, voucher_details in voucher_wise_amount.items():
+            tax_withheld = tax_withholding_detail.get("tax_amount")
+            advance_allocated = self.allocate_advance_tds(
+                tax_withholding_detail, advance_taxes, tax_withholding_category, allocated_advance_taxes
+            )
             self.append(
-                "tax_withheld_vouchers",
+                "tax_withholding_details",
                 {
-                    "voucher_name": voucher_no,
-                    "voucher_type": voucher_details.get("voucher_type"),
-                    "taxable_amount": voucher_details.get("amount"),
+                    "tax_withholding_category": tax_withholding_category,
+                    "net_amount": tax_withholding_categories[tax_withholding_category],
+                    "tax_withheld": tax_withheld,
+                    "account_head": tax_withholding_detail.get("account_head"),
+                    "advance_allocated": advance_allocated,
                 },
             )
+            tax_rows.setdefault(tax_withholding_detail.get("account_head"), tax_withholding_detail)
+            ## Add pending vouchers on which tax was withheld
+            for voucher_no, voucher_details in voucher_wise_amount.items():
+                self.append(
+                    "tax_withheld_vouchers",
+                    {
+                        "voucher_name": voucher_no,
+                        "voucher_type": voucher_details.get("voucher_type"),
+                        "taxable_amount": voucher_details.get("amount"),
+                        "tax_withholding_category": tax_withholding_category,
+                    },
+                )
+
+        self.set_tds_taxes(tax_rows, previous_accounts)
 
+    def set_tds_taxes(self, tax_rows, previous_accounts):
+        """Sets the TDS rows of `taxes` to the total of the tax withholding details of each account, and
+        removes the rows of `previous_accounts` no category uses any more. `tax_rows` are the rows of the
+        recomputed accounts, the rows of the other accounts only have their amount updated."""
+        account_wise_amount = {}
+        for d in self.tax_withholding_details:
+            account_wise_amount.setdefault(d.account_head, 0)
+            account_wise_amount[d.account_head] += flt(d.tax_withheld) - flt(d.advance_allocated)
+
+        # patch the TDS rows in place, rows of accounts with only unchanged categories keep their amount
+        accounts = set()
+        for d in self.taxes:
+            if d.account_head in account_wise_amount:
+                if d.account_head in tax_rows:
+                    d.update(tax_rows[d.account_head])
+                d.tax_amount = account_wise_amount[d.account_head]
+            accounts.add(d.account_head)
+        for account, amount in account_wise_amount.items():
+            if account not in accounts:
+                tax_row = tax_rows.get(account) or self.get_tds_tax_row(account)
+                tax_row["tax_amount"] = amount
+                self.append("taxes", tax_row)
+
+        # TDS rows of the accounts of categories no longer on the invoice
         to_remove = [
             d
             for d in self.taxes
-            if not d.tax_amount and d.account_head not in list(accounts)
+            if d.account_head in previous_accounts and d.account_head not in account_wise_amount
         ]
 
         for d in to_remove:
             self.remove(d)
         # calculate totals again after applying TDS
         super().calculate_taxes_and_totals()
-            
-    
-    def allocate_advance_tds(self, tax_withholding_details, advance_taxes):
+
+    def get_tds_tax_row(self, account):
+        """Returns a TDS row for `account` from the first kept category that uses it"""
+        tax_withholding_category = next(
+            d.tax_withholding_category for d in self.tax_withholding_details if d.account_head == account
+        )
+        tax_details = get_tax_withholding_details(tax_withholding_category, self.posting_date, self.company)
+        tax_row = get_tax_row_for_tds(tax_details, 0)
+        tax_row.update({"cost_center": get_cost_center(self)})
+        return tax_row
+
+    @instrument("allocate_advance_tds")
+    def allocate_advance_tds(
+        self, tax_withholding_details, advance_taxes, tax_withholding_category=None, allocated_advance_taxes=None
+    ):
+        """Allocates the pending TDS of advances against the tax amount and returns the total allocated.
+
+        `allocated_advance_taxes` has the amounts already allocated on this invoice by advance tax row,
+        and is updated, so that an advance is not allocated twice across categories."""
+        if allocated_advance_taxes is None:
+            allocated_advance_taxes = {}
+        total_allocated = 0
         for tax in advance_taxes:
             allocated_amount = 0
-            pending_amount = flt(tax.tax_amount - tax.allocated_amount)
+            pending_amount = flt(tax.tax_amount - tax.allocated_amount - allocated_advance_taxes.get(tax.name, 0))
+            if pending_amount <= 0:
+                continue
             if flt(tax_withholding_details.get("tax_amount")) >= pending_amount:
                 tax_withholding_details["tax_amount"] -= pending_amount
                 allocated_amount = pending_amount
@@ -118,6 +293,10 @@ class CustomPurchaseInvoice(PurchaseInvoice):
                 allocated_amount = tax_withholding_details["tax_amount"]
                 tax_withholding_details["tax_amount"] = 0
 
+            if not allocated_amount:
+                continue
+
+            allocated_advance_taxes[tax.name] = allocated_advance_taxes.get(tax.name, 0) + allocated_amount
             self.append(
                 "advance_tax",
                 {
@@ -126,24 +305,327 @@ class CustomPurchaseInvoice(PurchaseInvoice):
                     "reference_detail": tax.name,
                     "account_head": tax.account_head,
                     "allocated_amount": allocated_amount,
+                    "tax_withholding_category": tax_withholding_category,
                 },
             )
+            total_allocated += allocated_amount
+
+        return total_allocated
+
+
+def is_item_wise_tds_finalised_in_background(inv):
+    settings = frappe.get_cached_doc("Tax Withholding Setting")
+    return cint(settings.get("finalise_item_wise_tds_in_background")) and len(inv.items) >= cint(
+        settings.get("background_finalisation_min_lines")
+    )
+
+def get_cached_tax_withholding_details(tax_withholding_category, posting_date, company):
+    return get_cached_value(
+        f"tax_details:{tax_withholding_category}:{getdate(posting_date)}",
+        ["Tax Withholding Category", "Account"],
+        lambda: get_tax_withholding_details(tax_withholding_category, posting_date, company),
+        company=company,
+    )
+
+def is_item_wise_tds_computed_after_import():
+    return cint(frappe.get_cached_doc("Tax Withholding Setting").get("compute_item_wise_tds_after_import"))
+
+def get_item_wise_tax_withholding_categories(item_codes, supplier):
+    """Returns {item_code: tax_withholding_category} from the Item Supplier rows of `supplier`"""
+    item_codes = list(set(filter(None, item_codes)))
+    if not item_codes or not supplier:
+        return {}
+
+    # prefetched for the whole batch by bulk_recompute_item_wise_tds, None for items without a category
+    batch_categories = get_batch_cache().get(("item_categories", supplier))
+    if batch_categories is not None and all(d in batch_categories for d in item_codes):
+        return {d: batch_categories[d] for d in item_codes if batch_categories[d]}
+
+    item_wise_categories = {}
+    for d in frappe.get_all(
+        "Item Supplier",
+        filters={
+            "parenttype": "Item",
+            "parent": ("in", item_codes),
+            "supplier": supplier,
+            "tax_withholding_category": ("is", "set"),
+        },
+        fields=["parent", "tax_withholding_category"],
+        order_by="idx asc",
+    ):
+        item_wise_categories.setdefault(d.parent, d.tax_withholding_category)
+
+    return item_wise_categories
+
+def get_tds_fingerprint(inv, tds_context=None):
+    """Returns a fingerprint of everything the item-wise TDS of the invoice is computed from.
+
+    The context part covers the invoice header and the submitted vouchers, certificates
+    and categories of the PAN, the categories part the lines of each category and the
+    taxes part the TDS rows of taxes, so that a manual edit of them is recomputed."""
+    if not tds_context:
+        tds_context = get_tds_context(inv)
+
+    category_lines = {}
+    for d in inv.items:
+        if d.tax_withholding_category:
+            category_lines.setdefault(d.tax_withholding_category, []).append(
+                (d.item_code, flt(d.base_net_amount, d.precision("base_net_amount")))
+            )
+
+    context = (
+        inv.company,
+        tds_context.party_type,
+        tds_context.party,
+        str(getdate(inv.posting_date)),
+        inv.get("cost_center"),
+        sorted((d.reference_name, flt(d.allocated_amount)) for d in inv.get("advances") or []),
+        get_tds_inputs_version(
+            inv.company, tds_context.party_type, tds_context.parties, tds_context.pan_no, list(category_lines)
+        ),
+    )
+    return json.dumps(
+        {
+            "context": get_hash(context),
+            "categories": {category: get_hash(sorted(lines)) for category, lines in category_lines.items()},
+            "taxes": get_tds_taxes_hash(inv),
+        },
+        sort_keys=True,
+    )
+
+def get_tds_taxes_hash(inv):
+    """Hash of the rows of taxes on the accounts of the tax withholding details"""
+    accounts = {d.account_head for d in inv.get("tax_withholding_details") or [] if d.account_head}
+    return get_hash(
+        sorted(
+            (d.account_head, d.add_deduct_tax, flt(d.tax_amount, d.precision("tax_amount")))
+            for d in inv.get("taxes") or []
+            if d.account_head in accounts
+        )
+    )
+
+def set_fingerprint_taxes(tds_fingerprint, inv):
+    tds_fingerprint = json.loads(tds_fingerprint)
+    tds_fingerprint["taxes"] = get_tds_taxes_hash(inv)
+    return json.dumps(tds_fingerprint, sort_keys=True)
+
+def get_unchanged_categories(previous_fingerprint, tds_fingerprint):
+    """Returns the categories whose lines are the same in both fingerprints, none if the context changed"""
+    try:
+        previous_fingerprint = json.loads(previous_fingerprint or "{}")
+    except ValueError:
+        return []
+    tds_fingerprint = json.loads(tds_fingerprint)
+    if previous_fingerprint.get("context") != tds_fingerprint["context"]:
+        return []
+
+    previous_categories = previous_fingerprint.get("categories") or {}
+    return [
+        category
+        for category, lines_hash in tds_fingerprint["categories"].items()
+        if previous_categories.get(category) == lines_hash
+    ]
+
+def get_tds_inputs_version(company, party_type, parties, pan_no, tax_withholding_categories):
+    """Returns the last modified timestamps of the records that TDS of the parties is computed
+    from, which change when any of them is submitted, cancelled or edited, in one query"""
+    queries = []
+
+    def add_version(query, table):
+        queries.append(query.select(Max(table.modified)))
+
+    if use_tax_withholding_ledger():
+        twl = frappe.qb.DocType("Tax Withholding Ledger")
+        add_version(
+            frappe.qb.from_(twl)
+            .where(twl.company == company)
+            .where((twl.pan == pan_no) if pan_no else twl.party.isin(parties)),
+            twl,
+        )
+    else:
+        pi = frappe.qb.DocType("Purchase Invoice")
+        add_version(
+            frappe.qb.from_(pi)
+            .where(pi.company == company)
+            .where(pi.supplier.isin(parties))
+            .where(pi.docstatus > 0),
+            pi,
+        )
+        je = frappe.qb.DocType("Journal Entry")
+        jea = frappe.qb.DocType("Journal Entry Account")
+        add_version(
+            frappe.qb.from_(je)
+            .inner_join(jea)
+            .on(je.name == jea.parent)
+            .where(je.company == company)
+            .where(jea.party.isin(parties))
+            .where(je.docstatus > 0),
+            je,
+        )
+
+    # not in the ledger, as their unallocated amount changes on reconciliation
+    pe = frappe.qb.DocType("Payment Entry")
+    add_version(
+        frappe.qb.from_(pe)
+        .where(pe.company == company)
+        .where(pe.party_type == party_type)
+        .where(pe.party.isin(parties))
+        .where(pe.docstatus > 0),
+        pe,
+    )
+    ldc = frappe.qb.DocType("Lower Deduction Certificate")
+    add_version(
+        frappe.qb.from_(ldc)
+        .where(ldc.company == company)
+        .where((ldc.pan_no == pan_no) if pan_no else ldc.supplier.isin(parties)),
+        ldc,
+    )
+    if tax_withholding_categories:
+        twc = frappe.qb.DocType("Tax Withholding Category")
+        add_version(frappe.qb.from_(twc).where(twc.name.isin(tax_withholding_categories)), twc)
+
+    return [str(d or "") for d in frappe.qb.select(*queries).run()[0]]
+
+def get_hash(value):
+    return hashlib.sha256(json.dumps(value, default=str).encode()).hexdigest()[:20]
+
+@instrument("get_tds_context")
+def get_tds_context(inv, tax_withholding_categories=None, tds_context=None):
+    """Returns the party, PAN, PAN-linked parties and cost center of the invoice,
+    which are the same for every tax withholding category on it.
+
+    If `tax_withholding_categories` are given, their tax details, invoice vouchers and the
+    tax deducted on the advances of the invoice are also fetched together, so that each
+    category does not scan the fiscal year again. A `tds_context` of the same invoice, such as
+    the one of its fingerprint, is extended instead of looking up the party again."""
+    if tds_context:
+        tds_context = frappe._dict(tds_context)
+    else:
+        party_type, party = get_party_details(inv)
+        pan_no, parties = batch_cached(
+            ("parties", party_type, party), lambda: get_pan_and_parties(party_type, party)
+        )
+        tds_context = frappe._dict(
+            {
+                "party_type": party_type,
+                "party": party,
+                "pan_no": pan_no,
+                "parties": parties,
+                "posting_date": inv.get("posting_date") or inv.get("transaction_date"),
+                "cost_center": get_cost_center(inv),
+            }
+        )
+    parties = tds_context.parties
+    party_type = tds_context.party_type
+
+    if tax_withholding_categories:
+        tds_context.tax_details_map = {
+            category: batch_cached(
+                ("tax_details", category, getdate(tds_context.posting_date), inv.company),
+                lambda: get_tax_withholding_details(category, tds_context.posting_date, inv.company),
+            )
+            for category in tax_withholding_categories
+        }
+        tds_context.invoice_vouchers = get_batch_invoice_vouchers(
+            parties,
+            [d for d in tds_context.tax_details_map.values() if d],
+            inv,
+            party_type=party_type,
+        )
+        if inv.doctype == "Purchase Invoice":
+            tds_context.advance_taxes = get_category_wise_advance_taxes(inv, tds_context.tax_details_map)
+
+    return tds_context
 
+def get_category_wise_advance_taxes(inv, tax_details_map):
+    """get_taxes_deducted_on_advances_allocated for all the categories in one query,
+    returns {tax_withholding_category: [advance tax rows]}"""
+    category_wise_advance_taxes = {category: [] for category in tax_details_map}
+    advance_names = [d.reference_name for d in inv.get("advances") or []]
+    if not advance_names:
+        return category_wise_advance_taxes
 
-def get_item_tax_withholding_details(inv, tax_withholding_category, net_amount):
+    pe = frappe.qb.DocType("Payment Entry")
+    at = frappe.qb.DocType("Advance Taxes and Charges")
+    for d in (
+        frappe.qb.from_(at)
+        .inner_join(pe)
+        .on(pe.name == at.parent)
+        .select(
+            at.parent, at.name, at.tax_amount, at.allocated_amount, at.account_head, pe.tax_withholding_category
+        )
+        .where(pe.tax_withholding_category.isin(list(tax_details_map)))
+        .where(at.parent.isin(advance_names))
+        .orderby(at.parent)
+        .orderby(at.idx)
+    ).run(as_dict=True):
+        # only the rows of the TDS account of the category, as in erpnext, not the other taxes of the advance
+        tax_details = tax_details_map.get(d.tax_withholding_category)
+        if tax_details and d.account_head == tax_details.account_head:
+            category_wise_advance_taxes[d.tax_withholding_category].append(d)
+
+    return category_wise_advance_taxes
+
+def get_pan_and_parties(party_type, party):
+    """Returns the PAN of the party and all the parties sharing it"""
     pan_no = ""
     parties = []
-    party_type, party = get_party_details(inv)
-    has_pan_field = frappe.get_meta(party_type).has_field("pan")
-    voucher_wise_amount = {}
-    if has_pan_field:
+    if frappe.get_meta(party_type).has_field("pan"):
         pan_no = frappe.db.get_value(party_type, party, "pan")
     if pan_no:
         parties = frappe.get_all(party_type, filters={"pan": pan_no}, pluck="name")
     if not parties:
         parties.append(party)
-    posting_date = inv.get("posting_date") or inv.get("transaction_date")
-    tax_details = get_tax_withholding_details(tax_withholding_category, posting_date, inv.company)
+
+    return pan_no, parties
+
+def get_batch_invoice_vouchers(parties, tax_details_list, inv, party_type="Supplier"):
+    """get_category_wise_invoice_vouchers, reusing the vouchers already fetched for the same
+    parties and period by earlier invoices of a bulk recompute"""
+    batch_cache = frappe.flags.item_wise_tds_batch_cache
+    if batch_cache is None:
+        return get_category_wise_invoice_vouchers(parties, tax_details_list, inv, party_type=party_type)
+
+    def get_key(tax_details):
+        return (
+            "invoice_vouchers",
+            inv.company,
+            party_type,
+            tuple(sorted(parties)),
+            tax_details.get("tax_withholding_category"),
+            getdate(tax_details.from_date),
+            getdate(tax_details.to_date),
+        )
+
+    missing = [d for d in tax_details_list if get_key(d) not in batch_cache]
+    if missing:
+        category_wise_vouchers = get_category_wise_invoice_vouchers(parties, missing, inv, party_type=party_type)
+        for tax_details in missing:
+            batch_cache[get_key(tax_details)] = category_wise_vouchers[tax_details.get("tax_withholding_category")]
+
+    return {d.get("tax_withholding_category"): batch_cache[get_key(d)] for d in tax_details_list}
+
+def get_batch_cache():
+    """Lookups shared by the invoices of a bulk recompute, empty outside of one"""
+    return frappe.flags.item_wise_tds_batch_cache or {}
+
+def batch_cached(key, builder):
+    batch_cache = frappe.flags.item_wise_tds_batch_cache
+    if batch_cache is None:
+        return builder()
+    if key not in batch_cache:
+        batch_cache[key] = builder()
+    return batch_cache[key]
+
+@instrument("get_item_tax_withholding_details")
+def get_item_tax_withholding_details(inv, tax_withholding_category, net_amount, tds_context=None):
+    if not tds_context:
+        tds_context = get_tds_context(inv)
+
+    if tds_context.tax_details_map and tax_withholding_category in tds_context.tax_details_map:
+        tax_details = tds_context.tax_details_map[tax_withholding_category]
+    else:
+        tax_details = get_tax_withholding_details(tax_withholding_category, tds_context.posting_date, inv.company)
     if not tax_details:
         frappe.msgprint(
             _(
@@ -153,18 +635,36 @@ def get_item_tax_withholding_details(inv, tax_withholding_category, net_amount):
         return {}, [], {}
     
     tax_amount, tax_deducted_on_advances, voucher_wise_amount = get_tax_amount(
-        party_type, parties, inv, tax_details, posting_date, pan_no, net_amount
+        tds_context.party_type,
+        tds_context.parties,
+        inv,
+        tax_details,
+        tds_context.posting_date,
+        tds_context.pan_no,
+        net_amount,
+        invoice_vouchers=(tds_context.invoice_vouchers or {}).get(tax_withholding_category),
+        advance_taxes=(
+            tds_context.advance_taxes.get(tax_withholding_category)
+            if tds_context.advance_taxes is not None
+            else None
+        ),
     )
     tax_row = get_tax_row_for_tds(tax_details, tax_amount)
-    cost_center = get_cost_center(inv)
-    tax_row.update({"cost_center": cost_center})
+    tax_row.update({"cost_center": tds_context.cost_center})
         
     return tax_row, tax_deducted_on_advances, voucher_wise_amount
 
-def get_tax_amount(party_type, parties, inv, tax_details, posting_date, pan_no=None, net_amount=0):
-    vouchers, voucher_wise_amount = get_invoice_vouchers(
-        parties, tax_details, inv, party_type=party_type
-    )
+@instrument("get_tax_amount")
+def get_tax_amount(
+    party_type, parties, inv, tax_details, posting_date, pan_no=None, net_amount=0, invoice_vouchers=None,
+    advance_taxes=None
+):
+    if invoice_vouchers is not None:
+        vouchers, voucher_wise_amount = invoice_vouchers
+    else:
+        vouchers, voucher_wise_amount = get_invoice_vouchers(
+            parties, tax_details, inv, party_type=party_type
+        )
     advance_vouchers = get_advance_vouchers(
         parties,
         company=inv.company,
@@ -175,7 +675,9 @@ def get_tax_amount(party_type, parties, inv, tax_details, posting_date, pan_no=N
     taxable_vouchers = vouchers + advance_vouchers
     tax_deducted_on_advances = 0
 
-    if inv.doctype == "Purchase Invoice":
+    if advance_taxes is not None:
+        tax_deducted_on_advances = advance_taxes
+    elif inv.doctype == "Purchase Invoice":
         tax_deducted_on_advances = get_taxes_deducted_on_advances_allocated(inv, tax_details)
 
     tax_deducted = 0
@@ -184,7 +686,9 @@ def get_tax_amount(party_type, parties, inv, tax_details, posting_date, pan_no=N
 
     tax_amount = 0
     if party_type == "Supplier":
-        ldc = get_lower_deduction_certificate(inv.company, posting_date, tax_details, pan_no)
+        ldc = get_lower_deduction_certificate(
+            inv.company, posting_date, tax_details.get("tax_withholding_category"), pan_no
+        )
         if tax_deducted:
             if inv.item_wise_tds:
                 net_total = net_amount
@@ -204,7 +708,7 @@ def get_tax_amount(party_type, parties, inv, tax_details, posting_date, pan_no=N
             # once tds is deducted, not need to add vouchers in the invoice
             voucher_wise_amount = {}
         else:
-            tax_amount = get_tds_amount(ldc, parties, inv, tax_details, vouchers, net_amount)
+            tax_amount = get_tds_amount(ldc, parties, inv, tax_details, vouchers, net_amount, pan_no=pan_no)
 
     if cint(tax_details.round_off_tax_amount):
         tax_amount = normal_round(tax_amount)
@@ -212,30 +716,53 @@ def get_tax_amount(party_type, parties, inv, tax_details, posting_date, pan_no=N
     return tax_amount, tax_deducted_on_advances, voucher_wise_amount
 
 
+@instrument("get_invoice_vouchers")
 def get_invoice_vouchers(parties, tax_details, inv, party_type="Supplier"):
-    doctype = "Purchase Invoice" if party_type == "Supplier" else "Sales Invoice"
-    field = (
-        "base_tax_withholding_net_total as base_net_total"
-        if party_type == "Supplier"
-        else "base_net_total"
-    )
-    voucher_wise_amount = {}
-    vouchers = []
-
-    filters = [
-        [doctype, "company", "=", inv.company],
-        [doctype, frappe.scrub(party_type), "in", parties],
-        [doctype, "posting_date", "between", (tax_details.from_date, tax_details.to_date)],
-        [doctype, "is_opening", "=", "No"],
-        [doctype, "docstatus", "=", 1],
+    return get_category_wise_invoice_vouchers(parties, [tax_details], inv, party_type=party_type)[
+        tax_details.get("tax_withholding_category")
     ]
 
+@instrument("get_category_wise_invoice_vouchers")
+def get_category_wise_invoice_vouchers(parties, tax_details_list, inv, party_type="Supplier"):
+    """Returns {tax_withholding_category: (vouchers, voucher_wise_amount)} for all the given
+    tax details, with one grouped query per source table instead of three queries per category"""
+    doctype = "Purchase Invoice" if party_type == "Supplier" else "Sales Invoice"
+    periods = {
+        d.get("tax_withholding_category"): (getdate(d.from_date), getdate(d.to_date))
+        for d in tax_details_list
+    }
+    category_wise_vouchers = {category: ([], {}) for category in periods}
+    if not periods:
+        return category_wise_vouchers
+
+    categories = list(periods)
+    from_date = min(d[0] for d in periods.values())
+    to_date = max(d[1] for d in periods.values())
+
+    invoice = frappe.qb.DocType(doctype).as_("invoice")
+    query = (
+        frappe.qb.from_(invoice)
+        .select(invoice.name, invoice.posting_date)
+        .where(invoice.company == inv.company)
+        .where(invoice[frappe.scrub(party_type)].isin(parties))
+        .where(invoice.posting_date.between(from_date, to_date))
+        .where(invoice.is_opening == "No")
+        .where(invoice.docstatus == 1)
+    )
     if doctype != "Sales Invoice":
-        filters.extend(
-            [[doctype, "apply_tds", "=", 1],
-            [doctype, "tax_withholding_category", "=", tax_details.get("tax_withholding_category")]]
+        query = (
+            query.select(
+                invoice.tax_withholding_category,
+                Sum(invoice.base_tax_withholding_net_total).as_("base_net_total"),
+            )
+            .where(invoice.apply_tds == 1)
+            .where(invoice.tax_withholding_category.isin(categories))
+            .groupby(invoice.tax_withholding_category, invoice.name, invoice.posting_date)
         )
-    invoices_details = frappe.get_all(doctype, filters=filters, fields=["name", field])
+    else:
+        query = query.select(invoice.base_net_total)
+    invoices_details = query.run(as_dict=True)
+
     if doctype != "Sales Invoice":
         pi = frappe.qb.DocType("Purchase Invoice").as_("pi")
         td = frappe.qb.DocType("Tax Withholding Detail").as_("td")
@@ -243,159 +770,85 @@ def get_invoice_vouchers(parties, tax_details, inv, party_type="Supplier"):
             frappe.qb.from_(td)
             .inner_join(pi)
             .on(pi.name == td.parent)
-            .select(pi.name)
-            .select(td.net_amount.as_("base_net_total"))
-            .where(td.tax_withholding_category == tax_details.get("tax_withholding_category"))
+            .select(td.tax_withholding_category, pi.name, pi.posting_date)
+            .select(Sum(td.net_amount).as_("base_net_total"))
+            .where(td.tax_withholding_category.isin(categories))
             .where(pi.company == inv.company)
             .where(pi.supplier.isin(parties))
             .where(pi.is_opening == "No")
             .where(pi.docstatus == 1)
-            .where(pi.posting_date.between(tax_details.from_date, tax_details.to_date))
+            .where(pi.posting_date.between(from_date, to_date))
+            .groupby(td.tax_withholding_category, pi.name, pi.posting_date)
             .run(as_dict=True)
         )
         invoices_details += additional_invoices_details
-    
-    for d in invoices_details:
-        vouchers.append(d.name)
-        voucher_wise_amount.update({d.name: {"amount": d.base_net_total, "voucher_type": doctype}})
-
-    journal_entries_details = frappe.db.sql(
-        """
-        SELECT j.name, ja.credit - ja.debit AS amount
-            FROM `tabJournal Entry` j, `tabJournal Entry Account` ja
-        WHERE
-            j.name = ja.parent
-            AND j.docstatus = 1
-            AND j.is_opening = 'No'
-            AND j.posting_date between %s and %s
-            AND ja.party in %s
-            AND j.apply_tds = 1
-            AND j.tax_withholding_category = %s
-    """,
-        (
-            tax_details.from_date,
-            tax_details.to_date,
-            tuple(parties),
-            tax_details.get("tax_withholding_category"),
-        ),
-        as_dict=1,
-    )
-
-    if journal_entries_details:
-        for d in journal_entries_details:
-            vouchers.append(d.name)
-            voucher_wise_amount.update({d.name: {"amount": d.amount, "voucher_type": "Journal Entry"}})
 
-    return vouchers, voucher_wise_amount
+    for d in invoices_details:
+        # sales invoices are not filtered by category, they count towards every category
+        for category in [d.tax_withholding_category] if doctype != "Sales Invoice" else categories:
+            add_category_wise_voucher(
+                category_wise_vouchers, periods, category, d, d.base_net_total, doctype
+            )
 
-def get_limit_consumed(ldc, parties):
-    limit_consumed = frappe.db.get_value(
-        "Purchase Invoice",
-        {
-            "supplier": ("in", parties),
-            "apply_tds": 1,
-            "docstatus": 1,
-            "tax_withholding_category": ldc.tax_withholding_category,
-            "posting_date": ("between", (ldc.valid_from, ldc.valid_upto)),
-            "company": ldc.company,
-        },
-        "sum(tax_withholding_net_total)",
+    je = frappe.qb.DocType("Journal Entry").as_("j")
+    jea = frappe.qb.DocType("Journal Entry Account").as_("ja")
+    # one row per party row, a Journal Entry with several takes the amount of its last one
+    journal_entries_details = (
+        frappe.qb.from_(je)
+        .inner_join(jea)
+        .on(je.name == jea.parent)
+        .select(je.tax_withholding_category, je.name, je.posting_date)
+        .select((jea.credit - jea.debit).as_("amount"))
+        .where(je.docstatus == 1)
+        .where(je.is_opening == "No")
+        .where(je.posting_date.between(from_date, to_date))
+        .where(jea.party.isin(parties))
+        .where(je.apply_tds == 1)
+        .where(je.tax_withholding_category.isin(categories))
+        .orderby(je.name)
+        .orderby(jea.idx)
+        .run(as_dict=True)
     )
-    pi = frappe.qb.DocType("Purchase Invoice").as_("pi")
-    td = frappe.qb.DocType("Tax Withholding Detail").as_("td")
-    item_wise_limit_consumed = (
-        frappe.qb.from_(td)
-        .inner_join(pi)
-        .on(pi.name == td.parent)
-        .select(Sum(td.net_amount).as_("amt"))
-        .where(td.tax_withholding_category == ldc.tax_withholding_category)
-        .where(pi.company == ldc.company)
-        .where(pi.supplier.isin(parties))
-        .where(pi.is_opening == "No")
-        .where(pi.docstatus == 1)
-        .where(pi.posting_date.between(ldc.valid_from, ldc.valid_upto))
-    ).run(as_dict=True)
-    limit_consumed += item_wise_limit_consumed[0].amt or 0
-
-    return limit_consumed
-
-def get_tds_amount(ldc, parties, inv, tax_details, vouchers, net_amount=0):
-    tds_amount = 0
-    invoice_filters = {"name": ("in", vouchers), "docstatus": 1, "apply_tds": 1, "tax_withholding_category": tax_details.get("tax_withholding_category")}
 
-    ## for TDS to be deducted on advances
-    payment_entry_filters = {
-        "party_type": "Supplier",
-        "party": ("in", parties),
-        "docstatus": 1,
-        "apply_tax_withholding_amount": 1,
-        "unallocated_amount": (">", 0),
-        "posting_date": ["between", (tax_details.from_date, tax_details.to_date)],
-        "tax_withholding_category": tax_details.get("tax_withholding_category"),
-    }
+    for d in journal_entries_details:
+        add_category_wise_voucher(
+            category_wise_vouchers, periods, d.tax_withholding_category, d, d.amount, "Journal Entry"
+        )
 
-    field = "sum(tax_withholding_net_total)"
+    return category_wise_vouchers
 
-    if cint(tax_details.consider_party_ledger_amount):
-        invoice_filters.pop("apply_tds", None)
-        invoice_filters.pop("tax_withholding_category", None)
-        field = "sum(grand_total)"
+def add_category_wise_voucher(category_wise_vouchers, periods, category, voucher, amount, voucher_type):
+    # all categories are fetched over the widest period, keep only the category's own period
+    from_date, to_date = periods[category]
+    if not from_date <= getdate(voucher.posting_date) <= to_date:
+        return
 
-        payment_entry_filters.pop("apply_tax_withholding_amount", None)
-        payment_entry_filters.pop("tax_withholding_category", None)
+    vouchers, voucher_wise_amount = category_wise_vouchers[category]
+    vouchers.append(voucher.name)
+    voucher_wise_amount.update({voucher.name: {"amount": amount, "voucher_type": voucher_type}})
 
-    supp_credit_amt = frappe.db.get_value("Purchase Invoice", invoice_filters, field) or 0.0
-    if not cint(tax_details.consider_party_ledger_amount):
-        pi = frappe.qb.DocType("Purchase Invoice")
-        td = frappe.qb.DocType("Tax Withholding Detail")
-        item_wise_supp_credit_amt = (
-            frappe.qb.from_(pi)
-            .inner_join(td)
-            .on(pi.name == td.parent)
-            .select(Sum(td.net_amount).as_("amt"))
-            .where(
-                (pi.name.isin(vouchers or [""]))
-                & (td.tax_withholding_category == tax_details.get("tax_withholding_category"))
-                & (pi.apply_tds == 1)
-                & (pi.docstatus == 1)
-            )
-        ).run(as_dict=True)
-        
-        supp_credit_amt += item_wise_supp_credit_amt[0].amt or 0
+@instrument("get_limit_consumed")
+def get_limit_consumed(ldc, parties):
+    # maintained on submit and cancel of the invoices once the field exists
+    if ldc.get("consumed_amount") is not None:
+        return flt(ldc.consumed_amount)
 
-    supp_jv_credit_amt = (
-        frappe.db.get_value(
-            "Journal Entry Account",
-            {
-                "parent": ("in", vouchers),
-                "docstatus": 1,
-                "party": ("in", parties),
-                "reference_type": ("!=", "Purchase Invoice"),
-            },
-            "sum(credit_in_account_currency - debit_in_account_currency)",
-        )
-        or 0.0
-    )
+    return get_consumed_amount(ldc, parties)
 
-    # Get Amount via payment entry
-    payment_entry_amounts = frappe.db.get_all(
-        "Payment Entry",
-        filters=payment_entry_filters,
-        fields=["sum(unallocated_amount) as amount", "payment_type"],
-        group_by="payment_type",
-    )
+@instrument("get_tds_amount")
+def get_tds_amount(ldc, parties, inv, tax_details, vouchers, net_amount=0, pan_no=None):
+    tds_amount = 0
 
-    supp_credit_amt += supp_jv_credit_amt
+    credit_totals = get_supplier_credit_totals(parties, inv, tax_details, vouchers, pan_no=pan_no)
+    consider_party_ledger_amount = cint(tax_details.consider_party_ledger_amount)
+    supp_credit_amt = credit_totals.supp_credit_amt
     if inv.item_wise_tds:
         supp_credit_amt += net_amount
     else:
         supp_credit_amt += inv.tax_withholding_net_total
 
-    for type in payment_entry_amounts:
-        if type.payment_type == "Pay":
-            supp_credit_amt += type.amount
-        else:
-            supp_credit_amt -= type.amount
+    for amount in credit_totals.payment_entry_amounts:
+        supp_credit_amt += amount
     threshold = tax_details.get("threshold", 0)
     cumulative_threshold = tax_details.get("cumulative_threshold", 0)
 
@@ -413,28 +866,11 @@ def get_tds_amount(ldc, parties, inv, tax_details, vouchers, net_amount=0):
         if (cumulative_threshold and supp_credit_amt >= cumulative_threshold) and cint(
             tax_details.tax_on_excess_amount
         ):
-            # Get net total again as TDS is calculated on net total
-            # Grand is used to just check for threshold breach
-            net_total = (
-                frappe.db.get_value("Purchase Invoice", invoice_filters, "sum(tax_withholding_net_total)")
-                or 0.0
-            )
-            if not cint(tax_details.consider_party_ledger_amount):
-                pi = frappe.qb.DocType("Purchase Invoice").as_("pi")
-                td = frappe.qb.DocType("Tax Withholding Detail").as_("td")
-                item_wise_net_total = (
-                    frappe.qb.from_(pi)
-                    .inner_join(td)
-                    .on(pi.name == td.parent)
-                    .select(Sum(td.net_amount).as_("amt"))
-                    .where(
-                        (pi.name.isin(vouchers or [""]))
-                        & (pi.docstatus == 1)
-                        & (pi.apply_tds == 1)
-                        & (td.tax_withholding_category == tax_details.get("tax_withholding_category"))
-                    )
-                ).run(as_dict=True)
-                net_total += item_wise_net_total[0].amt or 0
+            # TDS is calculated on net total, grand total is only used to check for threshold breach
+            if consider_party_ledger_amount:
+                net_total = credit_totals.voucher_net_total
+            else:
+                net_total = credit_totals.net_total
             if inv.item_wise_tds:
                 net_total += net_amount
             else:
@@ -450,3 +886,410 @@ def get_tds_amount(ldc, parties, inv, tax_details, vouchers, net_amount=0):
 
     return tds_amount
 
+
+def get_supplier_credit_totals(parties, inv, tax_details, vouchers, pan_no=None):
+    """Returns the credit totals of the parties in the category period, other than the invoice,
+    with `supp_credit_amt` and the signed unallocated `payment_entry_amounts` that get_tds_amount
+    adds to it, in that order"""
+    ## for TDS to be deducted on advances
+    payment_entry_filters = {
+        "party_type": "Supplier",
+        "party": ("in", parties),
+        "docstatus": 1,
+        "apply_tax_withholding_amount": 1,
+        "unallocated_amount": (">", 0),
+        "posting_date": ["between", (tax_details.from_date, tax_details.to_date)],
+        "tax_withholding_category": tax_details.get("tax_withholding_category"),
+    }
+
+    consider_party_ledger_amount = cint(tax_details.consider_party_ledger_amount)
+    if consider_party_ledger_amount:
+        payment_entry_filters.pop("apply_tax_withholding_amount", None)
+        payment_entry_filters.pop("tax_withholding_category", None)
+
+    if use_tax_withholding_ledger():
+        credit_totals = get_ledger_totals(inv.company, "Supplier", pan_no, parties[0], tax_details)
+    else:
+        credit_totals = get_invoice_credit_totals(
+            tax_details, vouchers, item_wise=not consider_party_ledger_amount
+        )
+        credit_totals.journal_credit_total = (
+            frappe.db.get_value(
+                "Journal Entry Account",
+                {
+                    "parent": ("in", vouchers),
+                    "docstatus": 1,
+                    "party": ("in", parties),
+                    "reference_type": ("!=", "Purchase Invoice"),
+                },
+                "sum(credit_in_account_currency - debit_in_account_currency)",
+            )
+            or 0.0
+        )
+
+    if consider_party_ledger_amount:
+        supp_credit_amt = credit_totals.voucher_grand_total
+    else:
+        supp_credit_amt = credit_totals.net_total
+    credit_totals.supp_credit_amt = supp_credit_amt + credit_totals.journal_credit_total
+
+    # Get Amount via payment entry
+    credit_totals.payment_entry_amounts = [
+        d.amount if d.payment_type == "Pay" else -d.amount
+        for d in frappe.db.get_all(
+            "Payment Entry",
+            filters=payment_entry_filters,
+            fields=["sum(unallocated_amount) as amount", "payment_type"],
+            group_by="payment_type",
+        )
+    ]
+
+    return credit_totals
+
+
+def get_invoice_credit_totals(tax_details, vouchers, item_wise=True):
+    """Sums the Purchase Invoice `vouchers` with one aggregate query, and one more for the item-wise rows.
+
+    `net_total` only counts invoices with 'Apply Tax Withholding Amount' in the category
+    and, if `item_wise` is set, their item-wise rows of the category. `voucher_net_total`
+    and `voucher_grand_total` count all the vouchers."""
+    tax_withholding_category = tax_details.get("tax_withholding_category")
+    pi = frappe.qb.DocType("Purchase Invoice").as_("pi")
+    in_category = (pi.apply_tds == 1) & (pi.tax_withholding_category == tax_withholding_category)
+    totals = (
+        frappe.qb.from_(pi)
+        .select(
+            Sum(Case().when(in_category, pi.tax_withholding_net_total).else_(0)).as_("net_total"),
+            Sum(pi.tax_withholding_net_total).as_("voucher_net_total"),
+            Sum(pi.grand_total).as_("voucher_grand_total"),
+        )
+        .where(pi.name.isin(vouchers or [""]))
+        .where(pi.docstatus == 1)
+    ).run(as_dict=True)[0]
+    totals = frappe._dict({key: flt(value) for key, value in totals.items()})
+
+    if item_wise:
+        td = frappe.qb.DocType("Tax Withholding Detail").as_("td")
+        item_wise_net_total = (
+            frappe.qb.from_(pi)
+            .inner_join(td)
+            .on(pi.name == td.parent)
+            .select(Sum(td.net_amount).as_("amt"))
+            .where(
+                (pi.name.isin(vouchers or [""]))
+                & (td.tax_withholding_category == tax_withholding_category)
+                & (pi.apply_tds == 1)
+                & (pi.docstatus == 1)
+            )
+        ).run(as_dict=True)
+        totals.net_total += flt(item_wise_net_total[0].amt)
+
+    return totals
+
+
+@frappe.whitelist()
+def recompute_item_wise_tds(invoices=None, filters=None):
+    """Recomputes item-wise TDS of the given draft Purchase Invoices, or of those matching
+    `filters`, in background jobs"""
+    frappe.has_permission("Purchase Invoice", "write", throw=True)
+
+    invoices = get_draft_item_wise_invoices(frappe.parse_json(invoices), frappe.parse_json(filters))
+    if not invoices:
+        frappe.msgprint(_("No draft Purchase Invoices with item wise Tax Withholding found"))
+        return 0
+
+    enqueue_item_wise_tds_recompute(invoices)
+    frappe.msgprint(
+        _("Recomputing Tax Withholding of {0} Purchase Invoices in the background").format(len(invoices))
+    )
+    return len(invoices)
+
+def enqueue_item_wise_tds_recompute(invoices, local=False, partitions=None):
+    """Splits the invoices by supplier PAN and recomputes every part in its own worker.
+    Returns the merged result with `local`, where the parts run in a process pool."""
+    supplier_invoices = {}
+    for d in invoices:
+        supplier_invoices.setdefault(d.supplier, []).append(d.name)
+
+    return run_in_parallel(
+        "bharat_compliance.overrides.purchase_invoice.bulk_recompute_item_wise_tds",
+        partition_by_pan(supplier_invoices, "Supplier", partitions),
+        "bharat_compliance.overrides.purchase_invoice.notify_item_wise_tds_recompute",
+        local=local,
+    )
+
+def get_draft_item_wise_invoices(invoices=None, filters=None):
+    """Returns the name and supplier of the draft item-wise invoices, ordered by supplier and posting date"""
+    filters = filters or {}
+    if isinstance(filters, dict):
+        filters = [["Purchase Invoice", key, "=", value] for key, value in filters.items()]
+    filters += [["Purchase Invoice", "docstatus", "=", 0], ["Purchase Invoice", "item_wise_tds", "=", 1]]
+    if invoices:
+        filters.append(["Purchase Invoice", "name", "in", invoices])
+
+    return frappe.get_list(
+        "Purchase Invoice",
+        filters=filters,
+        fields=["name", "supplier"],
+        order_by="supplier asc, posting_date asc, name asc",
+    )
+
+def bulk_recompute_item_wise_tds(invoices, chunk_size=100):
+    """Re-saves the draft invoices, committing every `chunk_size` invoices.
+
+    Invoices of a supplier are saved together and share the party, category and voucher
+    lookups of the chunk. Drafts do not count towards cumulative thresholds, so every
+    invoice is computed against the same submitted vouchers whatever the order."""
+    updated, failed = 0, []
+    batch_cache = frappe.flags.item_wise_tds_batch_cache
+    mute_messages = frappe.flags.mute_messages
+    frappe.flags.mute_messages = True
+    try:
+        for start in range(0, len(invoices), chunk_size):
+            chunk = invoices[start : start + chunk_size]
+            # vouchers submitted by others since the last commit are seen by the next chunk
+            frappe.flags.item_wise_tds_batch_cache = get_item_categories_batch_cache(chunk)
+            for name in chunk:
+                frappe.db.savepoint("item_wise_tds")
+                try:
+                    doc = frappe.get_doc("Purchase Invoice", name)
+                    if doc.docstatus != 0 or not doc.item_wise_tds:
+                        continue
+                    doc.flags.recompute_tds = True
+                    doc.save()
+                    updated += 1
+                except Exception:
+                    frappe.db.rollback(save_point="item_wise_tds")
+                    frappe.log_error(title=_("Item wise TDS recompute failed for {0}").format(name))
+                    failed.append(name)
+
+            frappe.db.commit()
+            frappe.publish_progress(
+                (start + len(chunk)) * 100 / len(invoices),
+                title=_("Recomputing Tax Withholding"),
+                description=_("{0} of {1} Purchase Invoices").format(start + len(chunk), len(invoices)),
+            )
+    finally:
+        frappe.flags.item_wise_tds_batch_cache = batch_cache
+        frappe.flags.mute_messages = mute_messages
+
+    return frappe._dict({"updated": updated, "failed": failed})
+
+def notify_item_wise_tds_recompute(results):
+    """Merges the results of the parts of a recompute and tells the user"""
+    updated, failed = 0, []
+    for result in results:
+        if not result or result.get("error"):
+            failed.append(_("a part of the invoices"))
+            continue
+        updated += result.get("updated") or 0
+        failed += sorted(result.get("failed") or [])
+
+    message = _("Tax Withholding recomputed for {0} Purchase Invoices").format(updated)
+    if failed:
+        message += "<br>" + _("Failed for {0}, see Error Log").format(", ".join(failed))
+    frappe.publish_realtime("msgprint", message, user=frappe.session.user)
+
+    return frappe._dict({"updated": updated, "failed": failed})
+
+def get_item_categories_batch_cache(invoices):
+    """Returns a batch cache with the item-wise categories of all the items of `invoices`"""
+    items_by_supplier = {}
+    pi = frappe.qb.DocType("Purchase Invoice")
+    pii = frappe.qb.DocType("Purchase Invoice Item")
+    for supplier, item_code in (
+        frappe.qb.from_(pii)
+        .inner_join(pi)
+        .on(pi.name == pii.parent)
+        .select(pi.supplier, pii.item_code)
+        .distinct()
+        .where(pi.name.isin(invoices))
+    ).run():
+        if item_code:
+            items_by_supplier.setdefault(supplier, set()).add(item_code)
+
+    return get_supplier_item_categories_cache(items_by_supplier)
+
+def get_supplier_item_categories_cache(items_by_supplier):
+    """Returns a batch cache with the item-wise categories of the item codes of each supplier"""
+    batch_cache = {}
+    for supplier, item_codes in items_by_supplier.items():
+        item_wise_categories = get_item_wise_tax_withholding_categories(list(item_codes), supplier)
+        batch_cache[("item_categories", supplier)] = {d: item_wise_categories.get(d) for d in item_codes}
+
+    return batch_cache
+
+@frappe.whitelist()
+def simulate_item_wise_tds(company=None, supplier=None, posting_date=None, items=None, scenarios=None):
+    """Returns the item-wise TDS that a Purchase Invoice of `supplier` with `items` would have,
+    without saving anything. `items` are [item_code, amount] pairs or dicts with those keys.
+
+    If `scenarios` is given, a list of dicts with the same keys, each of them is evaluated,
+    with the missing keys taken from the arguments, and a list of results is returned. The
+    scenarios share the party, category and voucher lookups."""
+    frappe.has_permission("Purchase Invoice", "read", throw=True)
+
+    defaults = {"company": company, "supplier": supplier, "posting_date": posting_date, "items": items}
+    scenarios = frappe.parse_json(scenarios)
+    batch = scenarios is not None
+    scenarios = [
+        frappe._dict({key: d.get(key) or value for key, value in defaults.items()})
+        for d in (scenarios if batch else [{}])
+    ]
+    for d in scenarios:
+        d.company = d.company or frappe.defaults.get_user_default("Company")
+        d.posting_date = getdate(d.posting_date)
+        d["items"] = get_simulation_items(frappe.parse_json(d["items"]))
+        if not (d.supplier and d.company):
+            frappe.throw(_("Supplier and Company are required to simulate Tax Withholding"))
+
+    batch_cache = frappe.flags.item_wise_tds_batch_cache
+    mute_messages = frappe.flags.mute_messages
+    frappe.flags.item_wise_tds_batch_cache = get_simulation_batch_cache(scenarios)
+    frappe.flags.mute_messages = True
+    try:
+        results = [simulate_scenario(d) for d in scenarios]
+    finally:
+        frappe.flags.item_wise_tds_batch_cache = batch_cache
+        frappe.flags.mute_messages = mute_messages
+
+    return results if batch else results[0]
+
+def get_simulation_items(items):
+    return [
+        frappe._dict(
+            {"item_code": d.get("item_code"), "amount": flt(d.get("amount"))}
+            if isinstance(d, dict)
+            else {"item_code": d[0], "amount": flt(d[1])}
+        )
+        for d in items or []
+    ]
+
+def get_simulation_batch_cache(scenarios):
+    """A batch cache with the item-wise categories of all the items of the scenarios"""
+    items_by_supplier = {}
+    for d in scenarios:
+        items_by_supplier.setdefault(d.supplier, set()).update(i.item_code for i in d["items"] if i.item_code)
+
+    return get_supplier_item_categories_cache(items_by_supplier)
+
+def simulate_scenario(scenario):
+    inv = frappe.new_doc("Purchase Invoice")
+    inv.update(
+        {
+            "company": scenario.company,
+            "supplier": scenario.supplier,
+            "posting_date": scenario.posting_date,
+            "item_wise_tds": 1,
+        }
+    )
+    item_wise_categories = get_item_wise_tax_withholding_categories(
+        [d.item_code for d in scenario["items"]], scenario.supplier
+    )
+    tax_withholding_categories = {}
+    skipped_items = []
+    for d in scenario["items"]:
+        tax_withholding_category = item_wise_categories.get(d.item_code)
+        if not tax_withholding_category:
+            skipped_items.append(d.item_code)
+            continue
+        tax_withholding_categories.setdefault(tax_withholding_category, 0)
+        tax_withholding_categories[tax_withholding_category] += d.amount
+
+    categories = []
+    if tax_withholding_categories:
+        tds_context = get_tds_context(inv, list(tax_withholding_categories))
+        for tax_withholding_category, net_amount in tax_withholding_categories.items():
+            tax_row, advance_taxes, voucher_wise_amount = get_item_tax_withholding_details(
+                inv, tax_withholding_category, net_amount, tds_context=tds_context
+            )
+            tax_details = tds_context.tax_details_map.get(tax_withholding_category) or {}
+            categories.append(
+                {
+                    "tax_withholding_category": tax_withholding_category,
+                    "net_amount": net_amount,
+                    "rate": tax_details.get("rate"),
+                    "account_head": tax_row.get("account_head"),
+                    "tax_amount": flt(tax_row.get("tax_amount")),
+                }
+            )
+
+    return frappe._dict(
+        {
+            "company": scenario.company,
+            "supplier": scenario.supplier,
+            "posting_date": scenario.posting_date,
+            "categories": categories,
+            "total_tax_amount": sum(d["tax_amount"] for d in categories),
+            "skipped_items": skipped_items,
+        }
+    )
+
+@frappe.whitelist()
+def finalise_item_wise_tds(invoice, submit=0):
+    """Queues the finalisation of the provisional TDS of `invoice`, and its submission with `submit`"""
+    doc = frappe.get_doc("Purchase Invoice", invoice)
+    doc.check_permission("submit" if cint(submit) else "write")
+    if doc.docstatus != 0:
+        frappe.throw(_("Only draft invoices can be finalised"))
+    if not (doc.item_wise_tds and is_item_wise_tds_finalised_in_background(doc)):
+        frappe.throw(_("Tax Withholding of {0} is not finalised in the background").format(doc.name))
+
+    enqueue_item_wise_tds_finalisation(doc.name, submit=cint(submit), after_commit=False)
+    frappe.msgprint(_("Tax Withholding of {0} is being finalised in the background").format(doc.name), alert=True)
+
+def enqueue_item_wise_tds_finalisation(invoice, submit=0, after_commit=True):
+    frappe.enqueue(
+        finalise_item_wise_tds_job,
+        queue="long",
+        # a later save only needs the job that is already queued, unless it has to submit
+        job_id=f"item_wise_tds_finalisation::{invoice}::{submit}",
+        deduplicate=True,
+        enqueue_after_commit=after_commit,
+        invoice=invoice,
+        submit=submit,
+    )
+
+def finalise_item_wise_tds_job(invoice, submit=0):
+    """Recomputes the item-wise TDS of the draft, and submits it with `submit`. Jobs of invoices of
+    the same PAN run one at a time, so that each sees the invoices submitted by the others."""
+    supplier, company, owner = frappe.db.get_value("Purchase Invoice", invoice, ["supplier", "company", "owner"])
+    pan_no = get_pan_and_parties("Supplier", supplier)[0]
+    lock = frappe.cache().lock(
+        frappe.cache().make_key(f"item_wise_tds_finalisation:{company}:{pan_no or supplier}"),
+        timeout=FINALISE_LOCK_TIMEOUT,
+        blocking_timeout=FINALISE_LOCK_WAIT,
+    )
+    if not lock.acquire():
+        notify_item_wise_tds_finalisation_failed(
+            invoice,
+            owner,
+            _("Tax Withholding of {0} could not be finalised, another invoice of the PAN is still being finalised").format(
+                invoice
+            ),
+        )
+        return
+
+    try:
+        doc = frappe.get_doc("Purchase Invoice", invoice)
+        if doc.docstatus != 0:
+            return
+        doc.flags.recompute_tds = True
+        if cint(submit):
+            doc.submit()
+        else:
+            doc.save()
+        frappe.db.commit()
+    except Exception:
+        frappe.db.rollback()
+        frappe.log_error(title=_("Item wise TDS finalisation failed for {0}").format(invoice))
+        notify_item_wise_tds_finalisation_failed(
+            invoice, owner, _("Tax Withholding of {0} could not be finalised, see the Error Log").format(invoice)
+        )
+    finally:
+        # expired after FINALISE_LOCK_TIMEOUT, releasing it then would raise over the result of the job
+        if lock.owned():
+            lock.release()
+
+def notify_item_wise_tds_finalisation_failed(invoice, owner, message):
+    frappe.publish_realtime("msgprint", message, user=owner)
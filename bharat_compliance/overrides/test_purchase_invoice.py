@@ -0,0 +1,488 @@
+# Copyright (c) 2025, pwctech technologies private limited and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase, change_settings
+from frappe.utils import now_datetime, today
+from erpnext.accounts.doctype.tax_withholding_category.tax_withholding_category import (
+    get_tax_withholding_details,
+)
+from erpnext.accounts.doctype.tax_withholding_category.test_tax_withholding_category import (
+    create_purchase_invoice,
+    create_records,
+    create_tax_withholding_category_records,
+)
+from erpnext.accounts.utils import get_fiscal_year
+
+from bharat_compliance.income_tax_bharat.doctype.tax_withholding_setting.tax_withholding_setting import (
+    enable_item_wise_tds,
+)
+from bharat_compliance.overrides.purchase_invoice import (
+    bulk_recompute_item_wise_tds,
+    finalise_item_wise_tds_job,
+    get_category_wise_invoice_vouchers,
+    get_item_tax_withholding_details,
+    get_item_wise_tax_withholding_categories,
+    get_tds_context,
+    simulate_item_wise_tds,
+)
+
+SUPPLIER = "Test TDS Supplier"
+# the ledger is kept up by the submits of the tests, so it counts as built
+LEDGER_SETTINGS = {"use_tax_withholding_ledger": 1, "tax_withholding_ledger_built_on": now_datetime()}
+
+
+class TestCustomPurchaseInvoice(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        create_records()
+        create_tax_withholding_category_records()
+        enable_item_wise_tds()
+
+    def test_item_wise_category_resolution(self):
+        create_item_with_category("_Test Item Wise TDS Item", SUPPLIER, "Cumulative Threshold TDS")
+        create_item_with_category("_Test Item Wise TDS Item No Category", SUPPLIER, None)
+
+        pi = make_item_wise_purchase_invoice(
+            SUPPLIER,
+            [("_Test Item Wise TDS Item", 1000), ("_Test Item Wise TDS Item No Category", 1000)],
+        )
+        pi.set_item_wise_tax_witholding_category()
+
+        self.assertEqual(pi.items[0].tax_withholding_category, "Cumulative Threshold TDS")
+        self.assertFalse(pi.items[1].tax_withholding_category)
+
+    def test_item_wise_category_resolution_query_count(self):
+        item_codes = []
+        for i in range(50):
+            item_code = f"_Test Item Wise TDS Item {i}"
+            create_item_with_category(item_code, SUPPLIER, "Cumulative Threshold TDS")
+            item_codes.append(item_code)
+
+        pi = make_item_wise_purchase_invoice(SUPPLIER, [(d, 100) for d in item_codes * 4])
+
+        with self.assertQueryCount(1):
+            pi.set_item_wise_tax_witholding_category()
+
+        self.assertTrue(all(d.tax_withholding_category for d in pi.items))
+        self.assertEqual(
+            len(get_item_wise_tax_withholding_categories(item_codes, SUPPLIER)), len(item_codes)
+        )
+
+    def test_validate_query_count_does_not_grow_with_lines(self):
+        item_codes = []
+        for i in range(50):
+            item_code = f"_Test Item Wise TDS Item {i}"
+            create_item_with_category(item_code, SUPPLIER, "Cumulative Threshold TDS")
+            item_codes.append(item_code)
+
+        small = get_item_wise_tds_query_overhead([(d, 100) for d in item_codes[:5]])
+        large = get_item_wise_tds_query_overhead([(d, 100) for d in item_codes * 4])
+
+        self.assertLessEqual(large, small)
+
+    def test_tds_on_excess_amount(self):
+        category = "_Test Item Wise Excess TDS"
+        supplier = "_Test Item Wise Excess TDS Supplier"
+        create_tax_withholding_category(category, rate=10, cumulative_threshold=30000, tax_on_excess_amount=1)
+        create_supplier(supplier, category)
+        create_item_with_category("_Test Item Wise Excess TDS Item", supplier, category)
+
+        # 20000 below the cumulative threshold, so no tax is deducted on these
+        for rate in (10000, 10000):
+            create_purchase_invoice(supplier=supplier, rate=rate).submit()
+
+        # 35000 crosses 30000, tax on the excess 5000
+        self.assertEqual(get_item_wise_tax_amount(supplier, "_Test Item Wise Excess TDS Item", 15000), 500)
+        with change_settings("Tax Withholding Setting", LEDGER_SETTINGS):
+            self.assertEqual(get_item_wise_tax_amount(supplier, "_Test Item Wise Excess TDS Item", 15000), 500)
+
+    def test_tds_on_party_ledger_amount(self):
+        category = "_Test Item Wise Party Ledger TDS"
+        supplier = "_Test Item Wise Party Ledger TDS Supplier"
+        create_tax_withholding_category(
+            category, rate=10, cumulative_threshold=30000, consider_party_ledger_amount=1
+        )
+        create_supplier(supplier, category)
+        create_item_with_category("_Test Item Wise Party Ledger TDS Item", supplier, category)
+
+        create_purchase_invoice(supplier=supplier, rate=10000).submit()
+
+        # 10000 + 15000 is below the cumulative threshold
+        self.assertEqual(get_item_wise_tax_amount(supplier, "_Test Item Wise Party Ledger TDS Item", 15000), 0)
+        # 10000 + 25000 crosses it, tax on all of it
+        self.assertEqual(
+            get_item_wise_tax_amount(supplier, "_Test Item Wise Party Ledger TDS Item", 25000), 3500
+        )
+        with change_settings("Tax Withholding Setting", LEDGER_SETTINGS):
+            self.assertEqual(
+                get_item_wise_tax_amount(supplier, "_Test Item Wise Party Ledger TDS Item", 25000), 3500
+            )
+
+    def test_journal_entry_amount_is_its_last_party_row(self):
+        supplier = create_supplier("_Test Item Wise Journal TDS Supplier").name
+        je = frappe.get_doc(
+            {
+                "doctype": "Journal Entry",
+                "company": "_Test Company",
+                "posting_date": today(),
+                "accounts": [
+                    {
+                        "account": "_Test Account Cost for Goods Sold - _TC",
+                        "debit_in_account_currency": 3000,
+                        "cost_center": "Main - _TC",
+                    },
+                ]
+                + [
+                    {
+                        "account": "Creditors - _TC",
+                        "party_type": "Supplier",
+                        "party": supplier,
+                        "credit_in_account_currency": amount,
+                    }
+                    for amount in (1000, 2000)
+                ],
+            }
+        )
+        je.submit()
+        # without erpnext adding its own TDS row on submit
+        je.db_set({"apply_tds": 1, "tax_withholding_category": "Cumulative Threshold TDS"})
+
+        tax_details = get_tax_withholding_details("Cumulative Threshold TDS", today(), "_Test Company")
+        vouchers, voucher_wise_amount = get_category_wise_invoice_vouchers(
+            [supplier], [tax_details], frappe._dict({"company": "_Test Company"})
+        )["Cumulative Threshold TDS"]
+        self.assertIn(je.name, vouchers)
+        self.assertEqual(voucher_wise_amount[je.name]["amount"], 2000)
+
+    def test_unchanged_invoice_is_not_recomputed(self):
+        create_item_with_category("_Test Item Wise TDS Item", SUPPLIER, "Cumulative Threshold TDS")
+        pi = make_item_wise_purchase_invoice(SUPPLIER, [("_Test Item Wise TDS Item", 1000)])
+        details = [d.name for d in pi.tax_withholding_details]
+        self.assertTrue(details)
+
+        pi.remarks = "Only the remarks changed"
+        pi.save()
+        self.assertEqual([d.name for d in pi.tax_withholding_details], details)
+
+        pi.items[0].rate = 2000
+        pi.save()
+        self.assertNotEqual([d.name for d in pi.tax_withholding_details], details)
+        self.assertEqual(pi.tax_withholding_details[0].net_amount, 2000)
+
+    def test_manual_edit_of_tds_rows_is_recomputed(self):
+        create_item_with_category("_Test Item Wise TDS Item", SUPPLIER, "Cumulative Threshold TDS")
+        pi = make_item_wise_purchase_invoice(SUPPLIER, [("_Test Item Wise TDS Item", 1000)])
+        tds_row = next(d for d in pi.taxes if d.account_head == pi.tax_withholding_details[0].account_head)
+        tax_amount = tds_row.tax_amount
+
+        tds_row.tax_amount = tax_amount + 1
+        pi.save()
+        self.assertEqual(tds_row.tax_amount, tax_amount)
+
+    def test_only_changed_categories_are_recomputed(self):
+        supplier = "_Test Item Wise Delta TDS Supplier"
+        create_tax_withholding_category("_Test Item Wise Delta TDS 10", rate=10, single_threshold=1000)
+        create_tax_withholding_category("_Test Item Wise Delta TDS 5", rate=5, single_threshold=1000)
+        create_supplier(supplier)
+        create_item_with_category("_Test Item Wise Delta TDS Item 10", supplier, "_Test Item Wise Delta TDS 10")
+        create_item_with_category("_Test Item Wise Delta TDS Item 5", supplier, "_Test Item Wise Delta TDS 5")
+
+        pi = make_item_wise_purchase_invoice(
+            supplier, [("_Test Item Wise Delta TDS Item 10", 5000), ("_Test Item Wise Delta TDS Item 5", 5000)]
+        )
+        details = {d.tax_withholding_category: d.name for d in pi.tax_withholding_details}
+        self.assertEqual(sum(d.tax_amount for d in pi.taxes if d.account_head == "TDS - _TC"), 750)
+
+        pi.items[1].rate = 6000
+        pi.save()
+
+        new_details = {d.tax_withholding_category: d for d in pi.tax_withholding_details}
+        self.assertEqual(
+            new_details["_Test Item Wise Delta TDS 10"].name, details["_Test Item Wise Delta TDS 10"]
+        )
+        self.assertNotEqual(
+            new_details["_Test Item Wise Delta TDS 5"].name, details["_Test Item Wise Delta TDS 5"]
+        )
+        self.assertEqual(new_details["_Test Item Wise Delta TDS 5"].tax_withheld, 300)
+        self.assertEqual(sum(d.tax_amount for d in pi.taxes if d.account_head == "TDS - _TC"), 800)
+
+    def test_advance_tds_allocation_across_categories(self):
+        pi = make_item_wise_purchase_invoice(SUPPLIER, [("_Test Item Wise TDS Item", 1000)], do_not_save=True)
+        advance_taxes = [
+            frappe._dict(
+                {"parent": "PE-1", "name": "AT-1", "tax_amount": 100, "allocated_amount": 20, "account_head": "TDS - _TC"}
+            ),
+            frappe._dict(
+                {"parent": "PE-2", "name": "AT-2", "tax_amount": 50, "allocated_amount": 50, "account_head": "TDS - _TC"}
+            ),
+        ]
+        allocated_advance_taxes = {}
+
+        first = {"tax_amount": 60}
+        self.assertEqual(pi.allocate_advance_tds(first, advance_taxes, "First", allocated_advance_taxes), 60)
+        second = {"tax_amount": 60}
+        self.assertEqual(pi.allocate_advance_tds(second, advance_taxes, "Second", allocated_advance_taxes), 20)
+
+        self.assertEqual((first["tax_amount"], second["tax_amount"]), (0, 40))
+        # fully allocated advances add no rows
+        self.assertEqual(
+            [(d.reference_detail, d.allocated_amount, d.tax_withholding_category) for d in pi.advance_tax],
+            [("AT-1", 60, "First"), ("AT-1", 20, "Second")],
+        )
+
+    def test_advance_tds_excludes_other_taxes(self):
+        pe = make_advance_with_taxes(
+            SUPPLIER, "Cumulative Threshold TDS", [("TDS - _TC", 100), ("_Test Account Service Tax - _TC", 180)]
+        )
+        pi = make_item_wise_purchase_invoice(SUPPLIER, [("_Test Item Wise TDS Item", 1000)], do_not_save=True)
+        pi.append("advances", {"reference_type": "Payment Entry", "reference_name": pe.name})
+
+        tds_context = get_tds_context(pi, ["Cumulative Threshold TDS"])
+        # the service tax of the advance is not allocated against TDS
+        self.assertEqual(
+            [(d.account_head, d.tax_amount) for d in tds_context.advance_taxes["Cumulative Threshold TDS"]],
+            [("TDS - _TC", 100)],
+        )
+
+    def test_background_finalisation(self):
+        category = "_Test Item Wise Background TDS"
+        supplier = "_Test Item Wise Background TDS Supplier"
+        item_code = "_Test Item Wise Background TDS Item"
+        create_tax_withholding_category(category, rate=10, single_threshold=1000)
+        create_supplier(supplier)
+        create_item_with_category(item_code, supplier, category)
+
+        with change_settings(
+            "Tax Withholding Setting",
+            {"finalise_item_wise_tds_in_background": 1, "background_finalisation_min_lines": 1},
+        ):
+            pi = make_item_wise_purchase_invoice(supplier, [(item_code, 500)])
+            # an upper bound at the full rate, the threshold is only applied when it is finalised
+            self.assertTrue(pi.provisional_tds)
+            self.assertEqual(pi.tax_withholding_details[0].tax_withheld, 50)
+            self.assertEqual(sum(d.tax_amount for d in pi.taxes if d.account_head == "TDS - _TC"), 50)
+            self.assertRaises(frappe.ValidationError, pi.submit)
+
+            with patch.object(frappe.db, "commit"):
+                finalise_item_wise_tds_job(pi.name, submit=1)
+            pi.reload()
+            self.assertEqual(pi.docstatus, 1)
+            self.assertFalse(pi.provisional_tds)
+            self.assertEqual(pi.tax_withholding_details[0].tax_withheld, 0)
+
+    def test_simulation_matches_saved_invoice(self):
+        category = "_Test Item Wise Simulated TDS"
+        supplier = "_Test Item Wise Simulated TDS Supplier"
+        item_code = "_Test Item Wise Simulated TDS Item"
+        create_tax_withholding_category(category, rate=10, single_threshold=1000)
+        create_supplier(supplier)
+        create_item_with_category(item_code, supplier, category)
+
+        invoice_count = frappe.db.count("Purchase Invoice")
+        results = simulate_item_wise_tds(
+            company="_Test Company",
+            supplier=supplier,
+            scenarios=[{"items": [[item_code, 500]]}, {"items": [{"item_code": item_code, "amount": 5000}]}],
+        )
+        self.assertEqual(frappe.db.count("Purchase Invoice"), invoice_count)
+        self.assertEqual([d.total_tax_amount for d in results], [0, 500])
+
+        pi = make_item_wise_purchase_invoice(supplier, [(item_code, 5000)])
+        self.assertEqual(
+            results[1].categories[0]["tax_amount"],
+            sum(d.tax_withheld - d.advance_allocated for d in pi.tax_withholding_details),
+        )
+
+    def test_bulk_recompute_item_wise_tds(self):
+        category = "_Test Item Wise Bulk TDS"
+        supplier = "_Test Item Wise Bulk TDS Supplier"
+        item_code = "_Test Item Wise Bulk TDS Item"
+        create_tax_withholding_category(category, rate=10, single_threshold=1000)
+        create_supplier(supplier, category)
+        create_item_with_category(item_code, supplier, None)
+
+        # saved before the item has a category, so no tax is withheld yet
+        invoices = [make_item_wise_purchase_invoice(supplier, [(item_code, 5000)]) for i in range(3)]
+        self.assertFalse(any(pi.tax_withholding_details for pi in invoices))
+
+        create_item_with_category(item_code, supplier, category)
+        # the job commits every chunk, which would outlive the rollback of the test
+        with patch.object(frappe.db, "commit"):
+            result = bulk_recompute_item_wise_tds([pi.name for pi in invoices], chunk_size=2)
+
+        self.assertEqual(result.updated, 3)
+        self.assertEqual(result.failed, [])
+        for pi in invoices:
+            pi.reload()
+            self.assertEqual([d.tax_withheld for d in pi.tax_withholding_details], [500])
+
+
+def create_item_with_category(item_code, supplier, tax_withholding_category):
+    if frappe.db.exists("Item", item_code):
+        item = frappe.get_doc("Item", item_code)
+    else:
+        item = frappe.get_doc(
+            {
+                "doctype": "Item",
+                "item_code": item_code,
+                "item_name": item_code,
+                "item_group": "All Item Groups",
+                "stock_uom": "Nos",
+                "is_stock_item": 0,
+            }
+        )
+
+    item.set(
+        "supplier_items",
+        [{"supplier": supplier, "tax_withholding_category": tax_withholding_category}],
+    )
+    item.save()
+    return item
+
+
+def make_item_wise_purchase_invoice(supplier, items, **args):
+    args = frappe._dict(args)
+    pi = frappe.get_doc(
+        {
+            "doctype": "Purchase Invoice",
+            "posting_date": args.posting_date or today(),
+            "supplier": supplier,
+            "company": "_Test Company",
+            "currency": "INR",
+            "credit_to": "Creditors - _TC",
+            "item_wise_tds": 0 if args.do_not_apply_tds else 1,
+            "taxes": [],
+            "items": [
+                {
+                    "item_code": item_code,
+                    "qty": 1,
+                    "rate": rate,
+                    "cost_center": "Main - _TC",
+                    "expense_account": "Stock Received But Not Billed - _TC",
+                }
+                for item_code, rate in items
+            ],
+        }
+    )
+
+    if args.do_not_save:
+        return pi
+
+    pi.insert()
+    if args.submit:
+        pi.submit()
+    return pi
+
+
+def make_advance_with_taxes(supplier, tax_withholding_category, taxes):
+    """A Payment Entry to the supplier with `taxes` as (account, amount), saved as is"""
+    pe = frappe.get_doc(
+        {
+            "doctype": "Payment Entry",
+            "payment_type": "Pay",
+            "posting_date": today(),
+            "company": "_Test Company",
+            "party_type": "Supplier",
+            "party": supplier,
+            "paid_from": "Cash - _TC",
+            "paid_to": "Creditors - _TC",
+            "paid_amount": 10000,
+            "received_amount": 10000,
+            "reference_no": "_TEST-ADVANCE",
+            "reference_date": today(),
+            "tax_withholding_category": tax_withholding_category,
+            "taxes": [
+                {
+                    "charge_type": "Actual",
+                    "add_deduct_tax": "Deduct",
+                    "account_head": account,
+                    "description": account,
+                    "tax_amount": amount,
+                    "cost_center": "Main - _TC",
+                }
+                for account, amount in taxes
+            ],
+        }
+    )
+    # the taxes are kept as given, not set from the category
+    pe.flags.ignore_validate = True
+    pe.insert()
+    return pe
+
+
+def create_supplier(supplier_name, tax_withholding_category=None):
+    if frappe.db.exists("Supplier", supplier_name):
+        return frappe.get_doc("Supplier", supplier_name)
+
+    return frappe.get_doc(
+        {
+            "doctype": "Supplier",
+            "supplier_name": supplier_name,
+            "supplier_group": "_Test Supplier Group",
+            "tax_withholding_category": tax_withholding_category,
+        }
+    ).insert()
+
+
+def create_tax_withholding_category(category_name, rate, cumulative_threshold=0, single_threshold=0, **args):
+    if frappe.db.exists("Tax Withholding Category", category_name):
+        return frappe.get_doc("Tax Withholding Category", category_name)
+
+    fiscal_year = get_fiscal_year(today(), company="_Test Company")
+    return frappe.get_doc(
+        {
+            "doctype": "Tax Withholding Category",
+            "name": category_name,
+            "category_name": category_name,
+            "round_off_tax_amount": args.get("round_off_tax_amount", 0),
+            "consider_party_ledger_amount": args.get("consider_party_ledger_amount", 0),
+            "tax_on_excess_amount": args.get("tax_on_excess_amount", 0),
+            "rates": [
+                {
+                    "from_date": fiscal_year[1],
+                    "to_date": fiscal_year[2],
+                    "tax_withholding_rate": rate,
+                    "single_threshold": single_threshold,
+                    "cumulative_threshold": cumulative_threshold,
+                }
+            ],
+            "accounts": [{"company": "_Test Company", "account": "TDS - _TC"}],
+        }
+    ).insert()
+
+
+def get_item_wise_tax_amount(supplier, item_code, amount):
+    pi = make_item_wise_purchase_invoice(supplier, [(item_code, amount)], do_not_save=True)
+    pi.set_item_wise_tax_witholding_category()
+    pi.calculate_taxes_and_totals()
+    tax_row = get_item_tax_withholding_details(pi, pi.items[0].tax_withholding_category, amount)[0]
+    return tax_row.get("tax_amount")
+
+
+def get_query_count(fn):
+    queries = []
+    orig_sql = frappe.db.__class__.sql
+
+    def _sql_with_count(*args, **kwargs):
+        queries.append(args[1])
+        return orig_sql(*args, **kwargs)
+
+    try:
+        frappe.db.__class__.sql = _sql_with_count
+        fn()
+    finally:
+        frappe.db.__class__.sql = orig_sql
+
+    return len(queries)
+
+
+def get_item_wise_tds_query_overhead(items):
+    """Queries issued by validate for an item-wise invoice over the same invoice without item-wise TDS"""
+    item_wise = make_item_wise_purchase_invoice(SUPPLIER, items, do_not_save=True)
+    plain = make_item_wise_purchase_invoice(SUPPLIER, items, do_not_save=True, do_not_apply_tds=True)
+
+    return get_query_count(item_wise.validate) - get_query_count(plain.validate)
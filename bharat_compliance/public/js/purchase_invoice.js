@@ -0,0 +1,22 @@
+// Copyright (c) 2025, pwctech technologies private limited and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("Purchase Invoice", {
+	refresh(frm) {
+		// only set on the drafts whose Tax Withholding is finalised in the background
+		if (frm.doc.docstatus !== 0 || !frm.doc.provisional_tds || frm.is_new() || frm.is_dirty()) {
+			return;
+		}
+
+		frm.dashboard.set_headline_alert(
+			__("Tax Withholding is an upper bound estimated at the full rate, the final amount can be lower. It is being finalised in the background."),
+			"orange"
+		);
+		frm.add_custom_button(__("Finalise and Submit"), () => {
+			frappe.call({
+				method: "bharat_compliance.overrides.purchase_invoice.finalise_item_wise_tds",
+				args: { invoice: frm.doc.name, submit: 1 },
+			});
+		});
+	},
+});
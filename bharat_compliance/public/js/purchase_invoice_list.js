@@ -0,0 +1,18 @@
+// Copyright (c) 2025, pwctech technologies private limited and contributors
+// For license information, please see license.txt
+
+const bharat_compliance_pi_onload = frappe.listview_settings["Purchase Invoice"].onload;
+
+frappe.listview_settings["Purchase Invoice"].onload = function (listview) {
+	if (bharat_compliance_pi_onload) {
+		bharat_compliance_pi_onload(listview);
+	}
+
+	listview.page.add_action_item(__("Recompute Item wise TDS"), () => {
+		const invoices = listview.get_checked_items(true);
+		frappe.call({
+			method: "bharat_compliance.overrides.purchase_invoice.recompute_item_wise_tds",
+			args: invoices.length ? { invoices: invoices } : { filters: listview.get_filters_for_args() },
+		});
+	});
+};
@@ -0,0 +1,335 @@
+"""Item-wise TDS of imported Purchase Invoices, computed for all of them at once.
+
+With 'Compute Item wise TDS after Data Import' set in Tax Withholding Setting, Data Import
+only sets the categories of the items of the draft invoices it creates. `apply_item_wise_tds`
+then loads the invoices into columns, groups them by company, PAN and fiscal year, reads
+the submitted vouchers of each group once and computes the tax of every category of every
+invoice of the group in one pass, with NumPy if it is installed. The results are handed to
+the invoices through `flags.precomputed_item_wise_tds`, so that saving them builds the same
+rows as the per-document path without its queries.
+
+The results are those of saving the invoices one by one, or with `submit` of submitting them
+one by one in the order of posting date and name. Item-wise amounts do not add to the
+cumulative credit of the supplier, the same as in get_tds_amount, so the only state carried
+from one invoice to the next is whether tax was already deducted in the category. Groups with
+returns, advances, Lower Deduction Certificates or categories that consider the party ledger
+amount go through the per-document path, in the same order.
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import cint, getdate
+from erpnext.accounts.doctype.tax_withholding_category.tax_withholding_category import (
+	get_advance_vouchers,
+	get_cost_center,
+	get_deducted_tax,
+	get_tax_row_for_tds,
+	normal_round,
+)
+from erpnext.accounts.utils import get_fiscal_year
+
+from bharat_compliance.overrides.purchase_invoice import (
+	get_pan_and_parties,
+	get_supplier_credit_totals,
+	get_tds_context,
+)
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+
+@frappe.whitelist()
+def enqueue_item_wise_tds_after_import(invoices=None, filters=None, submit=0):
+	"""Computes item-wise TDS of the imported draft Purchase Invoices in a background job"""
+	frappe.has_permission("Purchase Invoice", "submit" if cint(submit) else "write", throw=True)
+
+	invoices = get_imported_invoices(frappe.parse_json(invoices), frappe.parse_json(filters))
+	if not invoices:
+		frappe.msgprint(_("No imported Purchase Invoices without item wise Tax Withholding found"))
+		return 0
+
+	frappe.enqueue(
+		apply_item_wise_tds,
+		queue="long",
+		timeout=6 * 60 * 60,
+		invoices=invoices,
+		submit=cint(submit),
+	)
+	return len(invoices)
+
+
+def get_imported_invoices(invoices=None, filters=None):
+	"""Draft item-wise invoices, by default those never computed, which have no fingerprint, in the
+	order they are applied in"""
+	filters = dict(filters or {})
+	filters.update({"docstatus": 0, "item_wise_tds": 1})
+	if invoices:
+		filters["name"] = ("in", invoices)
+	else:
+		filters["tds_fingerprint"] = ("is", "not set")
+
+	return frappe.get_all("Purchase Invoice", filters=filters, pluck="name", order_by="posting_date asc, name asc")
+
+
+def apply_item_wise_tds(invoices=None, filters=None, submit=False, chunk_size=500):
+	"""Computes the item-wise TDS of the draft `invoices`, or of the imported ones matching
+	`filters`, and saves them, or submits them with `submit`, committing every `chunk_size`"""
+	invoices = load_invoices(invoices or get_imported_invoices(filters=filters))
+	results = {}
+	for group in get_groups(invoices):
+		results.update(compute_group(group, submit) or {})
+
+	updated, failed, broken_groups = 0, [], set()
+	mute_messages = frappe.flags.mute_messages
+	frappe.flags.mute_messages = True
+	try:
+		for i, d in enumerate(invoices, 1):
+			frappe.db.savepoint("item_wise_tds_import")
+			try:
+				doc = frappe.get_doc("Purchase Invoice", d.name)
+				doc.flags.recompute_tds = True
+				if d.name in results and d.group_key not in broken_groups:
+					doc.flags.precomputed_item_wise_tds = get_precomputed_details(doc, results[d.name])
+				doc.submit() if submit else doc.save()
+				updated += 1
+			except Exception:
+				frappe.db.rollback(save_point="item_wise_tds_import")
+				frappe.log_error(title=_("Item wise TDS after import failed for {0}").format(d.name))
+				failed.append(d.name)
+				if submit:
+					# the results of the later invoices of the group count this one as submitted
+					broken_groups.add(d.group_key)
+
+			if i % chunk_size == 0 or i == len(invoices):
+				frappe.db.commit()
+				frappe.publish_progress(
+					i * 100 / len(invoices),
+					title=_("Computing Tax Withholding"),
+					description=_("{0} of {1} Purchase Invoices").format(i, len(invoices)),
+				)
+	finally:
+		frappe.flags.mute_messages = mute_messages
+
+	return frappe._dict({"updated": updated, "failed": failed})
+
+
+def load_invoices(names):
+	"""Returns the invoices in the order of posting date and name, with their net amount by category
+	summed in the order of their items, as custom_set_tax_withholding does"""
+	if not names:
+		return []
+
+	invoices = frappe.get_all(
+		"Purchase Invoice",
+		filters={"name": ("in", names)},
+		fields=["name", "company", "supplier", "posting_date", "is_return"],
+		order_by="posting_date asc, name asc",
+	)
+	with_advances = set(
+		frappe.get_all(
+			"Purchase Invoice Advance",
+			filters={"parenttype": "Purchase Invoice", "parent": ("in", names)},
+			pluck="parent",
+		)
+	)
+	invoice_map = {}
+	for d in invoices:
+		d.has_advances = d.name in with_advances
+		d.categories = {}
+		invoice_map[d.name] = d
+
+	for d in frappe.get_all(
+		"Purchase Invoice Item",
+		filters={
+			"parenttype": "Purchase Invoice",
+			"parent": ("in", names),
+			"tax_withholding_category": ("is", "set"),
+		},
+		fields=["parent", "tax_withholding_category", "base_net_amount"],
+		order_by="parent asc, idx asc",
+	):
+		categories = invoice_map[d.parent].categories
+		categories.setdefault(d.tax_withholding_category, 0)
+		categories[d.tax_withholding_category] += d.base_net_amount
+
+	return invoices
+
+
+def get_groups(invoices):
+	"""Splits the invoices by company, PAN, or supplier without one, and fiscal year"""
+	parties, groups = {}, {}
+	for d in invoices:
+		if d.supplier not in parties:
+			parties[d.supplier] = get_pan_and_parties("Supplier", d.supplier)
+		pan_no = parties[d.supplier][0]
+		d.group_key = (d.company, pan_no or d.supplier, get_fiscal_year(d.posting_date, company=d.company)[0])
+		groups.setdefault(d.group_key, []).append(d)
+
+	return list(groups.values())
+
+
+def compute_group(group, submit=False):
+	"""Returns {invoice: {category: (tax_details, tax_amount, voucher_wise_amount)}} for the invoices
+	of the group, or None if the group is left to the per-document path"""
+	if any(d.is_return or d.has_advances for d in group):
+		return None
+
+	categories = sorted({category for d in group for category in d.categories})
+	if not categories:
+		return None
+
+	first = frappe.get_doc("Purchase Invoice", group[0].name)
+	tds_context = get_tds_context(first, categories)
+	states = {}
+	for category in categories:
+		tax_details = tds_context.tax_details_map.get(category)
+		# skipped with a message by the per-document path
+		if not tax_details:
+			continue
+		rows = [i for i, d in enumerate(group) if category in d.categories]
+		if not is_supported(group, rows, category, tax_details, tds_context):
+			return None
+
+		vouchers, voucher_wise_amount = tds_context.invoice_vouchers[category]
+		taxable_vouchers = vouchers + get_advance_vouchers(
+			tds_context.parties,
+			company=first.company,
+			from_date=tax_details.from_date,
+			to_date=tax_details.to_date,
+			party_type=tds_context.party_type,
+		)
+		credit_totals = get_supplier_credit_totals(
+			tds_context.parties, first, tax_details, vouchers, pan_no=tds_context.pan_no
+		)
+		candidate_taxes, deducted_taxes = get_category_taxes(
+			[group[i].categories[category] for i in rows], credit_totals, tax_details
+		)
+		states[category] = frappe._dict(
+			{
+				"tax_details": tax_details,
+				"deducted": bool(taxable_vouchers and get_deducted_tax(taxable_vouchers, tax_details)),
+				"voucher_wise_amount": dict(voucher_wise_amount),
+				"positions": {i: k for k, i in enumerate(rows)},
+				"candidate_taxes": candidate_taxes,
+				"deducted_taxes": deducted_taxes,
+			}
+		)
+
+	results = {}
+	for i, d in enumerate(group):
+		results[d.name] = {}
+		account_totals = {}
+		for category, state in states.items():
+			if i not in state.positions:
+				continue
+			k = state.positions[i]
+			if state.deducted:
+				# once tds is deducted, not need to add vouchers in the invoice
+				tax_amount, voucher_wise_amount = state.deducted_taxes[k], {}
+			else:
+				tax_amount, voucher_wise_amount = state.candidate_taxes[k], dict(state.voucher_wise_amount)
+			results[d.name][category] = (state.tax_details, tax_amount, voucher_wise_amount)
+			account_head = state.tax_details.account_head
+			account_totals[account_head] = account_totals.get(account_head, 0) + tax_amount
+
+		if not submit:
+			continue
+
+		# as if the invoice was submitted, for the next invoices of the group
+		for category, state in states.items():
+			if i not in state.positions:
+				continue
+			state.voucher_wise_amount[d.name] = {
+				"amount": d.categories[category],
+				"voucher_type": "Purchase Invoice",
+			}
+			if account_totals[state.tax_details.account_head] > 0:
+				state.deducted = True
+
+	return results
+
+
+def is_supported(group, rows, category, tax_details, tds_context):
+	if cint(tax_details.consider_party_ledger_amount):
+		return False
+
+	posting_dates = [getdate(group[i].posting_date) for i in rows]
+	# the rate of the period of the first invoice applies to all of them
+	if min(posting_dates) < getdate(tax_details.from_date) or max(posting_dates) > getdate(tax_details.to_date):
+		return False
+
+	return not (
+		tds_context.pan_no
+		and frappe.db.exists(
+			"Lower Deduction Certificate",
+			{
+				"company": group[0].company,
+				"pan_no": tds_context.pan_no,
+				"tax_withholding_category": category,
+				"valid_from": ("<=", max(posting_dates)),
+				"valid_upto": (">=", min(posting_dates)),
+			},
+		)
+	)
+
+
+def get_category_taxes(net_amounts, credit_totals, tax_details):
+	"""Returns the tax on each of `net_amounts` before and after tax is deducted in the category,
+	with the arithmetic of get_tds_amount and get_tax_amount, in that order"""
+	rate = tax_details.rate
+	threshold = tax_details.get("threshold", 0)
+	cumulative_threshold = tax_details.get("cumulative_threshold", 0)
+	tax_on_excess_amount = cint(tax_details.tax_on_excess_amount)
+
+	if numpy is not None:
+		net = numpy.asarray(net_amounts, dtype=float)
+		supp_credit_amt = credit_totals.supp_credit_amt + net
+		for amount in credit_totals.payment_entry_amounts:
+			supp_credit_amt = supp_credit_amt + amount
+
+		no_rows = numpy.zeros(len(net), dtype=bool)
+		crossed_cumulative = (supp_credit_amt >= cumulative_threshold) if cumulative_threshold else no_rows
+		crossed = crossed_cumulative | ((net >= threshold) if threshold else no_rows)
+		if tax_on_excess_amount:
+			supp_credit_amt = numpy.where(
+				crossed_cumulative, (credit_totals.net_total + net) - cumulative_threshold, supp_credit_amt
+			)
+
+		candidate_taxes = numpy.where(crossed & (supp_credit_amt > 0), supp_credit_amt * rate / 100, 0.0).tolist()
+		deducted_taxes = (net * rate / 100).tolist()
+	else:
+		candidate_taxes, deducted_taxes = [], []
+		for net_amount in net_amounts:
+			supp_credit_amt = credit_totals.supp_credit_amt + net_amount
+			for amount in credit_totals.payment_entry_amounts:
+				supp_credit_amt += amount
+
+			crossed_cumulative = bool(cumulative_threshold and supp_credit_amt >= cumulative_threshold)
+			tax_amount = 0
+			if (threshold and net_amount >= threshold) or crossed_cumulative:
+				if crossed_cumulative and tax_on_excess_amount:
+					supp_credit_amt = (credit_totals.net_total + net_amount) - cumulative_threshold
+				tax_amount = supp_credit_amt * rate / 100 if supp_credit_amt > 0 else 0
+
+			candidate_taxes.append(tax_amount)
+			deducted_taxes.append(net_amount * rate / 100)
+
+	if cint(tax_details.round_off_tax_amount):
+		candidate_taxes = [normal_round(d) for d in candidate_taxes]
+		deducted_taxes = [normal_round(d) for d in deducted_taxes]
+
+	return candidate_taxes, deducted_taxes
+
+
+def get_precomputed_details(doc, category_results):
+	"""The results of the categories in the form custom_set_tax_withholding takes them"""
+	cost_center = get_cost_center(doc)
+	precomputed = {}
+	for category, (tax_details, tax_amount, voucher_wise_amount) in category_results.items():
+		tax_row = get_tax_row_for_tds(tax_details, tax_amount)
+		tax_row.update({"cost_center": cost_center})
+		precomputed[category] = (tax_row, [], voucher_wise_amount)
+
+	return precomputed
@@ -0,0 +1,77 @@
+"""Shared cache for the lookups of the TDS report and the tax withholding calculation.
+
+Values are cached in frappe.cache (Redis) under keys that carry a version of every
+doctype they are built from. Saving or deleting a document of one of those doctypes
+bumps its version through doc_events once the change is committed, so stale keys are
+never read again and expire on their own.
+"""
+
+import frappe
+
+CACHE_PREFIX = "bharat_compliance"
+DEFAULT_EXPIRY = 24 * 60 * 60
+
+_cache_backend = None
+
+
+class LocalCache:
+	"""In-process stand-in for frappe.cache(), for tests"""
+
+	def __init__(self):
+		self.data = {}
+
+	def get_value(self, key, *args, **kwargs):
+		return self.data.get(key)
+
+	def set_value(self, key, value, *args, **kwargs):
+		self.data[key] = value
+
+	def delete_value(self, keys, *args, **kwargs):
+		if not isinstance(keys, list | tuple):
+			keys = [keys]
+		for key in keys:
+			self.data.pop(key, None)
+
+
+def get_cache():
+	return _cache_backend or frappe.cache()
+
+
+def set_cache_backend(backend=None):
+	"""Use `backend` instead of frappe.cache(), or go back to it if None"""
+	global _cache_backend
+	_cache_backend = backend
+
+
+def get_version_key(doctype):
+	return f"{CACHE_PREFIX}:version:{frappe.scrub(doctype)}"
+
+
+def get_version(doctype):
+	return get_cache().get_value(get_version_key(doctype)) or "0"
+
+
+def bump_version(doctype):
+	get_cache().set_value(get_version_key(doctype), frappe.generate_hash(length=10))
+
+
+def get_cached_value(name, depends_on, builder, company=None, expires_in_sec=DEFAULT_EXPIRY):
+	"""Returns the value of `builder()`, cached until a document of one of the
+	`depends_on` doctypes is saved or deleted"""
+	versions = ":".join(get_version(doctype) for doctype in depends_on)
+	key = f"{CACHE_PREFIX}:{name}:{company or ''}:{versions}"
+
+	cache = get_cache()
+	value = cache.get_value(key)
+	if value is None:
+		value = builder()
+		cache.set_value(key, value, expires_in_sec=expires_in_sec)
+
+	return value
+
+
+def invalidate_cache(doc, method=None):
+	"""doc_events hook, invalidates every cached value built from the doctype of `doc`"""
+	doctype = doc.doctype
+	# not before the commit, or a concurrent request could cache the old rows under the new version
+	frappe.db.after_commit.add(lambda: bump_version(doctype))
@@ -0,0 +1,132 @@
+"""Composite indexes for the tax withholding aggregations and the TDS report, created by
+the app after install and migrate, and a diagnostic of their use.
+"""
+
+import re
+
+import frappe
+from frappe.utils import add_months, getdate, today
+
+from bharat_compliance.utils.instrumentation import capture_sql
+
+# (doctype, columns, index name), equality columns first, then the range column
+INDEXES = (
+	(
+		"Purchase Invoice",
+		["supplier", "company", "docstatus", "apply_tds", "tax_withholding_category", "posting_date"],
+		"bc_tds_supplier_index",
+	),
+	("Tax Withholding Detail", ["parent", "tax_withholding_category"], "bc_tds_parent_category_index"),
+	("Journal Entry Account", ["party", "parent"], "bc_tds_party_parent_index"),
+	("GL Entry", ["voucher_no", "is_cancelled"], "bc_tds_voucher_index"),
+	("GL Entry", ["account", "posting_date"], "bc_tds_account_date_index"),
+	# looked up by the delta refresh of the TDS Register
+	("GL Entry", ["modified"], "bc_tds_modified_index"),
+)
+
+
+def create_indexes():
+	"""Adds the indexes that do not exist yet"""
+	for doctype, columns, index_name in INDEXES:
+		if not frappe.db.table_exists(doctype) or not all(frappe.db.has_column(doctype, d) for d in columns):
+			continue
+		frappe.db.add_index(doctype, columns, index_name)
+
+
+def get_missing_indexes():
+	return [
+		frappe._dict({"doctype": doctype, "columns": columns, "index_name": index_name})
+		for doctype, columns, index_name in INDEXES
+		if not frappe.db.has_index(f"tab{doctype}", index_name)
+	]
+
+
+def get_index_report(company=None, supplier=None):
+	"""Returns the missing indexes and the EXPLAIN plan of every distinct query issued by
+	validate of a Purchase Invoice of `supplier` and by the TDS report of the last month.
+
+	Validate runs on unsaved copies of the latest submitted invoice of the supplier,
+	and everything is rolled back."""
+	company = company or frappe.defaults.get_user_default("Company")
+	queries = []
+
+	frappe.db.savepoint("tds_index_report")
+	try:
+		invoice = get_sample_invoice(company, supplier)
+		if invoice:
+			for item_wise in (0, 1):
+				if item_wise and not frappe.get_meta("Purchase Invoice").has_field("item_wise_tds"):
+					continue
+				draft = frappe.copy_doc(invoice)
+				draft.apply_tds = 0 if item_wise else 1
+				draft.item_wise_tds = item_wise
+				queries += capture_queries(draft.validate, "item_wise_validate" if item_wise else "validate")
+
+		from bharat_compliance.bharat_compliance.report.tds_report_for_bharat.tds_report_for_bharat import (
+			execute,
+		)
+
+		filters = frappe._dict(
+			{
+				"company": company,
+				"party_type": "Supplier",
+				"from_date": getdate(add_months(today(), -1)),
+				"to_date": getdate(today()),
+			}
+		)
+		queries += capture_queries(lambda: execute(filters), "tds_report")
+	finally:
+		frappe.db.rollback(save_point="tds_index_report")
+
+	return frappe._dict(
+		{
+			"missing_indexes": get_missing_indexes(),
+			"queries": [dict(d, **explain(d.query, d.values)) for d in queries],
+		}
+	)
+
+
+def get_sample_invoice(company, supplier=None):
+	filters = {"company": company, "docstatus": 1}
+	if supplier:
+		filters["supplier"] = supplier
+
+	name = frappe.db.get_value("Purchase Invoice", filters, "name", order_by="posting_date desc")
+	return frappe.get_doc("Purchase Invoice", name) if name else None
+
+
+def capture_queries(fn, source):
+	"""Runs `fn` and returns its distinct select queries, ignoring differences in literal values"""
+	queries = {}
+
+	def add_query(query, values):
+		query_text = str(query).strip()
+		if query_text.lower().startswith("select"):
+			queries.setdefault(
+				normalize_query(query_text),
+				frappe._dict({"source": source, "query": query_text, "values": values}),
+			)
+
+	try:
+		with capture_sql(add_query):
+			fn()
+	except Exception:
+		# the plans of the queries issued up to the error are still of use
+		frappe.log_error(title=f"TDS index report: {source} failed")
+
+	return list(queries.values())
+
+
+def normalize_query(query):
+	query = re.sub(r"'(?:[^'\\]|\\.)*'", "?", query)
+	query = re.sub(r"\b\d+(\.\d+)?\b", "?", query)
+	return re.sub(r"\s+", " ", query)
+
+
+def explain(query, values=()):
+	plan = frappe.db.sql(f"EXPLAIN {query}", values or (), as_dict=True)
+	return {
+		"plan": plan,
+		# tables read without any index
+		"full_scans": sorted({d.table for d in plan if (d.get("type") or "").upper() == "ALL"}),
+	}
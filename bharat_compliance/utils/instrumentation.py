@@ -0,0 +1,113 @@
+"""Query counts and timings of the steps of the item-wise TDS calculation.
+
+When enabled in Tax Withholding Setting, `tds_trace` wraps the validate of an invoice and
+every function decorated with `instrument` adds its queries and time to the trace. The
+trace is written as one TDS Performance Log per step through deferred insert, so that
+saving the invoice does not wait for it.
+"""
+
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import frappe
+from frappe.deferred_insert import deferred_insert
+from frappe.utils import cint, flt
+
+
+class TDSTrace:
+	def __init__(self):
+		self.query_count = 0
+		self.steps = {}
+
+	def add(self, step, query_count, duration):
+		stats = self.steps.setdefault(step, {"calls": 0, "query_count": 0, "duration": 0})
+		stats["calls"] += 1
+		stats["query_count"] += query_count
+		stats["duration"] += duration
+
+	def count_query(self, query, values):
+		self.query_count += 1
+
+
+def is_instrumentation_enabled():
+	return cint(frappe.get_cached_doc("Tax Withholding Setting").get("enable_tds_instrumentation"))
+
+
+def get_active_trace():
+	return getattr(frappe.local, "tds_trace", None)
+
+
+@contextmanager
+def capture_sql(on_query):
+	"""Calls `on_query(query, values)` for every query run through frappe.db.sql inside the block"""
+	sql = frappe.db.sql
+
+	def capturing_sql(query, values=(), *args, **kwargs):
+		on_query(query, values)
+		return sql(query, values, *args, **kwargs)
+
+	frappe.db.sql = capturing_sql
+	try:
+		yield
+	finally:
+		frappe.db.sql = sql
+
+
+@contextmanager
+def tds_trace(doc):
+	"""Traces the steps run inside the block and logs them against `doc`"""
+	if get_active_trace() or not is_instrumentation_enabled():
+		yield
+		return
+
+	trace = TDSTrace()
+	frappe.local.tds_trace = trace
+	start = time.perf_counter()
+	try:
+		with capture_sql(trace.count_query):
+			yield
+	finally:
+		trace.add("validate", trace.query_count, time.perf_counter() - start)
+		frappe.local.tds_trace = None
+		log_trace(doc, trace)
+
+
+def instrument(step):
+	"""Adds the queries and time of the decorated function to the active trace, if any"""
+
+	def decorator(fn):
+		@wraps(fn)
+		def wrapper(*args, **kwargs):
+			trace = get_active_trace()
+			if not trace:
+				return fn(*args, **kwargs)
+
+			query_count = trace.query_count
+			start = time.perf_counter()
+			try:
+				return fn(*args, **kwargs)
+			finally:
+				trace.add(step, trace.query_count - query_count, time.perf_counter() - start)
+
+		return wrapper
+
+	return decorator
+
+
+def log_trace(doc, trace):
+	deferred_insert(
+		"TDS Performance Log",
+		[
+			{
+				"reference_doctype": doc.doctype,
+				"reference_name": doc.name,
+				"step": step,
+				"calls": stats["calls"],
+				"query_count": stats["query_count"],
+				"duration": flt(stats["duration"] * 1000, 3),
+				"item_count": len(doc.get("items") or []),
+			}
+			for step, stats in trace.steps.items()
+		],
+	)
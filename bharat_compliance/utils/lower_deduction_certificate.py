@@ -0,0 +1,220 @@
+"""Lower Deduction Certificates of the item-wise TDS calculation.
+
+The limit consumed of a certificate is kept in its `consumed_amount` field, which
+Purchase Invoices add to on submit and take back on cancel, instead of being summed
+from the invoices of the certificate window on every validate. Certificates are looked
+up through the shared cache, which is invalidated once the counter change is committed.
+"""
+
+import frappe
+from frappe.query_builder.functions import Sum
+from frappe.utils import flt, getdate
+
+from bharat_compliance.utils.cache import bump_version, get_cached_value
+
+LDC_FIELDS = [
+	"name",
+	"company",
+	"supplier",
+	"pan_no",
+	"tax_withholding_category",
+	"valid_from",
+	"valid_upto",
+	"rate",
+	"certificate_limit",
+]
+
+
+def is_consumed_amount_tracked():
+	return frappe.get_meta("Lower Deduction Certificate").has_field("consumed_amount")
+
+
+def get_lower_deduction_certificate(company, posting_date, tax_withholding_category, pan_no):
+	"""Cached equivalent of erpnext's get_lower_deduction_certificate, with the consumed
+	amount of the certificate if it is tracked"""
+	if not pan_no:
+		return None
+
+	posting_date = getdate(posting_date)
+
+	def build():
+		fields = LDC_FIELDS + (["consumed_amount"] if is_consumed_amount_tracked() else [])
+		certificates = frappe.get_all(
+			"Lower Deduction Certificate",
+			filters={
+				"company": company,
+				"pan_no": pan_no,
+				"tax_withholding_category": tax_withholding_category,
+				"valid_from": ("<=", posting_date),
+				"valid_upto": (">=", posting_date),
+			},
+			fields=fields,
+			limit=1,
+		)
+		# cached as an empty dict, as None is not cached
+		return certificates[0] if certificates else {}
+
+	return (
+		get_cached_value(
+			f"ldc:{pan_no}:{tax_withholding_category}:{posting_date}",
+			["Lower Deduction Certificate"],
+			build,
+			company=company,
+		)
+		or None
+	)
+
+
+# the fields that decide which invoices count towards the limit of a certificate
+CERTIFICATE_KEY_FIELDS = ["company", "supplier", "pan_no", "tax_withholding_category", "valid_from", "valid_upto"]
+
+
+def set_consumed_amount(doc, method=None):
+	"""doc_events hook of Lower Deduction Certificate, counts the consumed amount of a new certificate,
+	which can be backdated, or of one whose window, PAN or category changed"""
+	if not is_consumed_amount_tracked():
+		return
+
+	if doc.is_new() or any(doc.has_value_changed(field) for field in CERTIFICATE_KEY_FIELDS):
+		doc.consumed_amount = get_consumed_amount(doc, get_certificate_parties(doc))
+
+
+def update_consumed_amount(doc, method=None):
+	"""doc_events hook of Purchase Invoice, adds the amounts of the invoice to the consumed
+	amount of its certificates on submit and takes them back on cancel"""
+	if not is_consumed_amount_tracked():
+		return
+
+	pan_no = get_pan(doc.supplier)
+	category_wise_amount = get_category_wise_amount(doc)
+	if not (pan_no and category_wise_amount):
+		return
+
+	sign = -1 if doc.docstatus == 2 else 1
+	ldc = frappe.qb.DocType("Lower Deduction Certificate")
+	updated = False
+	for tax_withholding_category, amount in category_wise_amount.items():
+		certificate = get_lower_deduction_certificate(doc.company, doc.posting_date, tax_withholding_category, pan_no)
+		if not certificate or not amount:
+			continue
+
+		(
+			frappe.qb.update(ldc)
+			.set(ldc.consumed_amount, ldc.consumed_amount + sign * flt(amount))
+			.where(ldc.name == certificate.name)
+		).run()
+		updated = True
+
+	if updated:
+		# not before the commit, or a validate in between could cache the old amount again
+		frappe.db.after_commit.add(lambda: bump_version("Lower Deduction Certificate"))
+
+
+def get_category_wise_amount(doc):
+	"""The amounts of the invoice that count towards the limit of a certificate, as summed by get_limit_consumed"""
+	category_wise_amount = {}
+	if doc.get("apply_tds") and doc.get("tax_withholding_category"):
+		category_wise_amount[doc.tax_withholding_category] = flt(doc.get("tax_withholding_net_total"))
+
+	if doc.get("is_opening") == "No":
+		for d in doc.get("tax_withholding_details") or []:
+			category_wise_amount.setdefault(d.tax_withholding_category, 0)
+			category_wise_amount[d.tax_withholding_category] += flt(d.net_amount)
+
+	return category_wise_amount
+
+
+def get_pan(supplier):
+	if not frappe.get_meta("Supplier").has_field("pan"):
+		return None
+	return frappe.db.get_value("Supplier", supplier, "pan")
+
+
+def rebuild_consumed_amounts(company=None):
+	"""Sets the consumed amount of every certificate from its submitted invoices"""
+	if not is_consumed_amount_tracked():
+		return 0
+
+	filters = {"company": company} if company else {}
+	certificates = frappe.get_all("Lower Deduction Certificate", filters=filters, fields=LDC_FIELDS)
+	for certificate in certificates:
+		frappe.db.set_value(
+			"Lower Deduction Certificate",
+			certificate.name,
+			"consumed_amount",
+			get_consumed_amount(certificate, get_certificate_parties(certificate)),
+			update_modified=False,
+		)
+
+	bump_version("Lower Deduction Certificate")
+	return len(certificates)
+
+
+def get_certificate_parties(ldc):
+	"""The suppliers sharing the PAN of the certificate"""
+	parties = []
+	if ldc.pan_no and frappe.get_meta("Supplier").has_field("pan"):
+		parties = frappe.get_all("Supplier", filters={"pan": ldc.pan_no}, pluck="name")
+	return parties or [ldc.supplier]
+
+
+def get_consumed_amount(ldc, parties):
+	"""Sums the limit consumed by the submitted invoices of `parties` within the certificate window"""
+	limit_consumed = flt(
+		frappe.db.get_value(
+			"Purchase Invoice",
+			{
+				"supplier": ("in", parties),
+				"apply_tds": 1,
+				"docstatus": 1,
+				"tax_withholding_category": ldc.tax_withholding_category,
+				"posting_date": ("between", (ldc.valid_from, ldc.valid_upto)),
+				"company": ldc.company,
+			},
+			"sum(tax_withholding_net_total)",
+		)
+	)
+	pi = frappe.qb.DocType("Purchase Invoice").as_("pi")
+	td = frappe.qb.DocType("Tax Withholding Detail").as_("td")
+	item_wise_limit_consumed = (
+		frappe.qb.from_(td)
+		.inner_join(pi)
+		.on(pi.name == td.parent)
+		.select(Sum(td.net_amount).as_("amt"))
+		.where(td.tax_withholding_category == ldc.tax_withholding_category)
+		.where(pi.company == ldc.company)
+		.where(pi.supplier.isin(parties))
+		.where(pi.is_opening == "No")
+		.where(pi.docstatus == 1)
+		.where(pi.posting_date.between(ldc.valid_from, ldc.valid_upto))
+	).run(as_dict=True)
+	limit_consumed += item_wise_limit_consumed[0].amt or 0
+
+	return limit_consumed
+
+
+def get_headroom(filters=None):
+	"""Returns the certificates with their limit, consumed and remaining amounts"""
+	filters = frappe._dict(filters or {})
+	ldc_filters = {}
+	for field in ("company", "supplier", "tax_withholding_category"):
+		if filters.get(field):
+			ldc_filters[field] = filters.get(field)
+	if filters.get("active_on"):
+		ldc_filters["valid_from"] = ("<=", getdate(filters.active_on))
+		ldc_filters["valid_upto"] = (">=", getdate(filters.active_on))
+
+	tracked = is_consumed_amount_tracked()
+	certificates = frappe.get_all(
+		"Lower Deduction Certificate",
+		filters=ldc_filters,
+		fields=LDC_FIELDS + (["consumed_amount"] if tracked else []),
+		order_by="valid_upto asc, name asc",
+	)
+	for d in certificates:
+		if not tracked:
+			d.consumed_amount = get_consumed_amount(d, get_certificate_parties(d))
+		d.remaining_amount = flt(d.certificate_limit) - flt(d.consumed_amount)
+		d.utilisation = flt(d.consumed_amount) * 100 / flt(d.certificate_limit) if flt(d.certificate_limit) else 0
+
+	return certificates
@@ -0,0 +1,146 @@
+"""Fans work out over background workers, one job per partition, and merges the results
+in partition order once the last partition is done, whatever order the jobs finish in.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import frappe
+from frappe.utils import add_days, cint, date_diff, getdate
+
+RESULT_EXPIRY = 6 * 60 * 60
+
+
+def get_worker_count():
+	"""Partitions to split work into, `tds_workers` in site config or the number of cores"""
+	return cint(frappe.conf.get("tds_workers")) or os.cpu_count() or 1
+
+
+def partition_by_pan(party_items, party_type="Supplier", partitions=None):
+	"""Splits {party: [item, ...]} into at most `partitions` lists of items.
+
+	Parties sharing a PAN always land in the same list, as cumulative thresholds are
+	computed over all of them together. Items keep their order within a party, and the
+	same input always gives the same partitions."""
+	partitions = partitions or get_worker_count()
+	parties = sorted(party for party in party_items if party)
+
+	pan_map = {}
+	if parties and frappe.get_meta(party_type).has_field("pan"):
+		pan_map = dict(
+			frappe.get_all(party_type, filters={"name": ("in", parties)}, fields=["name", "pan"], as_list=1)
+		)
+
+	groups = {}
+	for party in parties:
+		groups.setdefault(pan_map.get(party) or party, []).extend(party_items[party])
+
+	# largest groups first, each to the least loaded partition
+	bins = [[] for i in range(min(partitions, len(groups)))]
+	for key in sorted(groups, key=lambda key: (-len(groups[key]), key)):
+		min(bins, key=len).extend(groups[key])
+
+	return bins
+
+
+def get_date_windows(from_date, to_date, partitions=None):
+	"""Splits the date range into at most `partitions` contiguous windows of about equal length"""
+	from_date, to_date = getdate(from_date), getdate(to_date)
+	days = date_diff(to_date, from_date) + 1
+	partitions = max(1, min(partitions or get_worker_count(), days))
+
+	windows = []
+	start = from_date
+	for i in range(partitions):
+		end = add_days(from_date, (i + 1) * days // partitions - 1)
+		windows.append(frappe._dict({"index": i, "from_date": start, "to_date": getdate(end)}))
+		start = add_days(end, 1)
+
+	return windows
+
+
+def run_in_parallel(partition_method, partitions, completion_method=None, local=False, queue="long", **kwargs):
+	"""Calls `partition_method(partition, **kwargs)` for every partition and then
+	`completion_method(results=[...], **kwargs)` with the results in partition order.
+
+	Partitions run as background jobs on `queue`. With `local`, they run in a pool of
+	processes instead and what `completion_method` returns, or else the results, is
+	returned. Changes not yet committed by the caller are not seen by these processes."""
+	if local:
+		return run_in_process_pool(partition_method, partitions, completion_method, **kwargs)
+
+	batch = frappe.generate_hash(length=12)
+	for index, partition in enumerate(partitions):
+		frappe.enqueue(
+			"bharat_compliance.utils.parallel.run_partition",
+			queue=queue,
+			timeout=6000,
+			enqueue_after_commit=True,
+			batch=batch,
+			index=index,
+			total=len(partitions),
+			partition_method=partition_method,
+			partition=partition,
+			completion_method=completion_method,
+			method_kwargs=kwargs,
+		)
+
+	return batch
+
+
+def run_partition(batch, index, total, partition_method, partition, completion_method=None, method_kwargs=None):
+	"""Background job of one partition. The job that finishes last merges the results."""
+	method_kwargs = method_kwargs or {}
+	try:
+		result = frappe.get_attr(partition_method)(partition, **method_kwargs)
+		frappe.db.commit()
+	except Exception:
+		frappe.db.rollback()
+		frappe.log_error(title=f"Partition {index + 1} of {total} failed: {partition_method}")
+		result = frappe._dict({"error": True})
+
+	cache = frappe.cache()
+	key = f"bharat_compliance:parallel:{batch}"
+	cache.set_value(f"{key}:{index}", result, expires_in_sec=RESULT_EXPIRY)
+
+	done_key = cache.make_key(f"{key}:done")
+	done = cache.incr(done_key)
+	cache.expire(done_key, RESULT_EXPIRY)
+	if done != total:
+		return
+
+	results = [cache.get_value(f"{key}:{i}") for i in range(total)]
+	cache.delete_value([f"{key}:{i}" for i in range(total)])
+	if completion_method:
+		frappe.get_attr(completion_method)(results=results, **method_kwargs)
+
+
+def run_in_process_pool(partition_method, partitions, completion_method=None, **kwargs):
+	args = [
+		(frappe.local.site, frappe.local.sites_path, partition_method, partition, kwargs)
+		for partition in partitions
+	]
+	# spawn, so that no process shares the database connection of this one
+	with ProcessPoolExecutor(
+		max_workers=min(len(partitions), get_worker_count()) or 1,
+		mp_context=multiprocessing.get_context("spawn"),
+	) as pool:
+		results = list(pool.map(run_partition_in_process, args))
+
+	if completion_method:
+		return frappe.get_attr(completion_method)(results=results, **kwargs)
+
+	return results
+
+
+def run_partition_in_process(args):
+	site, sites_path, partition_method, partition, kwargs = args
+	frappe.init(site=site, sites_path=sites_path)
+	frappe.connect()
+	try:
+		result = frappe.get_attr(partition_method)(partition, **kwargs)
+		frappe.db.commit()
+		return result
+	finally:
+		frappe.destroy()
@@ -0,0 +1,111 @@
+# Copyright (c) 2025, pwctech technologies private limited and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase, change_settings
+from erpnext.accounts.doctype.tax_withholding_category.test_tax_withholding_category import create_records
+
+from bharat_compliance.income_tax_bharat.doctype.tax_withholding_setting.tax_withholding_setting import (
+	enable_item_wise_tds,
+)
+from bharat_compliance.overrides.test_purchase_invoice import (
+	create_item_with_category,
+	create_supplier,
+	create_tax_withholding_category,
+	make_item_wise_purchase_invoice,
+)
+from bharat_compliance.utils import bulk_tds
+
+CATEGORY = "_Test Item Wise Import TDS"
+
+
+class TestBulkTDS(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		create_records()
+		enable_item_wise_tds()
+		create_tax_withholding_category(CATEGORY, rate=10, single_threshold=5000)
+
+	def test_results_match_submitting_one_by_one(self):
+		amounts = [4000, 7000, 3000]
+		expected = get_tax_withheld(
+			[
+				make_item_wise_purchase_invoice(supplier, [(item_code, amount)], submit=True)
+				for supplier, item_code in [make_supplier("_Test Item Wise Import TDS Supplier 1")]
+				for amount in amounts
+			]
+		)
+		# below the threshold, then crossing it, then deducted already
+		self.assertEqual(expected, [0, 700, 300])
+
+		supplier, item_code = make_supplier("_Test Item Wise Import TDS Supplier 2")
+		with change_settings("Tax Withholding Setting", {"compute_item_wise_tds_after_import": 1}):
+			frappe.flags.in_import = True
+			try:
+				invoices = [make_item_wise_purchase_invoice(supplier, [(item_code, amount)]) for amount in amounts]
+			finally:
+				frappe.flags.in_import = False
+
+		self.assertFalse(any(pi.tax_withholding_details for pi in invoices))
+		with patch.object(frappe.db, "commit"):
+			result = bulk_tds.apply_item_wise_tds([pi.name for pi in invoices], submit=True)
+
+		self.assertEqual(result.failed, [])
+		for pi in invoices:
+			pi.reload()
+		self.assertEqual(get_tax_withheld(invoices), expected)
+
+	def test_saved_invoices_are_not_applied_again(self):
+		supplier, item_code = make_supplier("_Test Item Wise Import TDS Supplier 3")
+		with change_settings("Tax Withholding Setting", {"compute_item_wise_tds_after_import": 1}):
+			frappe.flags.in_import = True
+			try:
+				invoices = [make_item_wise_purchase_invoice(supplier, [(item_code, 7000)]) for i in range(2)]
+			finally:
+				frappe.flags.in_import = False
+
+		filters = {"supplier": supplier}
+		self.assertEqual(len(bulk_tds.get_imported_invoices(filters=filters)), 2)
+		with patch.object(frappe.db, "commit"):
+			result = bulk_tds.apply_item_wise_tds(filters=filters)
+
+		self.assertEqual(result.updated, 2)
+		self.assertEqual(bulk_tds.get_imported_invoices(filters=filters), [])
+		for pi in invoices:
+			pi.reload()
+		self.assertEqual(get_tax_withheld(invoices), [700, 700])
+
+	def test_numpy_and_python_taxes_are_the_same(self):
+		if bulk_tds.numpy is None:
+			self.skipTest("NumPy is not installed")
+
+		tax_details = frappe._dict(
+			{"rate": 10, "threshold": 5000, "cumulative_threshold": 30000, "tax_on_excess_amount": 1}
+		)
+		credit_totals = frappe._dict({"supp_credit_amt": 20000.5, "net_total": 18000, "payment_entry_amounts": [-250.25]})
+		net_amounts = [1000.1, 4999.99, 5000, 9999.3, 12000.7]
+
+		numpy_taxes = bulk_tds.get_category_taxes(net_amounts, credit_totals, tax_details)
+		bulk_tds.numpy = None
+		try:
+			python_taxes = bulk_tds.get_category_taxes(net_amounts, credit_totals, tax_details)
+		finally:
+			import numpy
+
+			bulk_tds.numpy = numpy
+
+		self.assertEqual(numpy_taxes, python_taxes)
+
+
+def make_supplier(supplier):
+	item_code = f"{supplier} Item"
+	create_supplier(supplier)
+	create_item_with_category(item_code, supplier, CATEGORY)
+	return supplier, item_code
+
+
+def get_tax_withheld(invoices):
+	return [sum(d.tax_withheld - d.advance_allocated for d in pi.tax_withholding_details) for pi in invoices]
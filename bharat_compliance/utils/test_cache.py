@@ -0,0 +1,50 @@
+# Copyright (c) 2025, pwctech technologies private limited and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from bharat_compliance.utils.cache import (
+	LocalCache,
+	get_cached_value,
+	invalidate_cache,
+	set_cache_backend,
+)
+
+
+class TestCache(FrappeTestCase):
+	def setUp(self):
+		set_cache_backend(LocalCache())
+		self.builds = 0
+
+	def tearDown(self):
+		set_cache_backend(None)
+
+	def build(self):
+		self.builds += 1
+		return {"value": self.builds}
+
+	def test_value_is_built_once(self):
+		self.assertEqual(get_cached_value("test", ["Supplier"], self.build, company="A"), {"value": 1})
+		self.assertEqual(get_cached_value("test", ["Supplier"], self.build, company="A"), {"value": 1})
+		self.assertEqual(self.builds, 1)
+
+		# cached per company
+		get_cached_value("test", ["Supplier"], self.build, company="B")
+		self.assertEqual(self.builds, 2)
+
+	def test_invalidated_by_dependency(self):
+		get_cached_value("test", ["Supplier", "Account"], self.build)
+
+		invalidate_cache(frappe._dict({"doctype": "Customer"}))
+		frappe.db.after_commit.run()
+		get_cached_value("test", ["Supplier", "Account"], self.build)
+		self.assertEqual(self.builds, 1)
+
+		invalidate_cache(frappe._dict({"doctype": "Account"}))
+		# only once the change is committed
+		get_cached_value("test", ["Supplier", "Account"], self.build)
+		self.assertEqual(self.builds, 1)
+
+		frappe.db.after_commit.run()
+		self.assertEqual(get_cached_value("test", ["Supplier", "Account"], self.build), {"value": 2})
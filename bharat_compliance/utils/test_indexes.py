@@ -0,0 +1,18 @@
+# Copyright (c) 2025, pwctech technologies private limited and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+
+from bharat_compliance.utils.indexes import create_indexes, get_missing_indexes, normalize_query
+
+
+class TestIndexes(FrappeTestCase):
+	def test_indexes_are_created(self):
+		create_indexes()
+		self.assertEqual(get_missing_indexes(), [])
+
+	def test_queries_differing_in_values_are_the_same(self):
+		self.assertEqual(
+			normalize_query("select name from `tabGL Entry` where voucher_no = 'ACC-PINV-1' and debit > 10"),
+			normalize_query("select name from `tabGL Entry`  where voucher_no = 'ACC-PINV-2' and debit > 2.5"),
+		)
@@ -0,0 +1,39 @@
+# Copyright (c) 2025, pwctech technologies private limited and Contributors
+# See license.txt
+
+import frappe
+from frappe.deferred_insert import save_to_db
+from frappe.tests.utils import FrappeTestCase, change_settings
+
+from bharat_compliance.utils.instrumentation import instrument, tds_trace
+
+
+@instrument("_test_step")
+def run_queries(count):
+	for i in range(count):
+		frappe.db.sql("select 1")
+
+
+class TestInstrumentation(FrappeTestCase):
+	@change_settings("Tax Withholding Setting", {"enable_tds_instrumentation": 1})
+	def test_steps_are_logged(self):
+		doc = frappe._dict({"doctype": "Purchase Invoice", "name": frappe.generate_hash(length=10), "items": []})
+		with tds_trace(doc):
+			run_queries(2)
+			run_queries(1)
+		save_to_db()
+
+		log = frappe.get_all(
+			"TDS Performance Log",
+			filters={"reference_name": doc.name, "step": "_test_step"},
+			fields=["calls", "query_count"],
+		)
+		self.assertEqual(log, [{"calls": 2, "query_count": 3}])
+
+	def test_nothing_is_traced_when_disabled(self):
+		doc = frappe._dict({"doctype": "Purchase Invoice", "name": frappe.generate_hash(length=10), "items": []})
+		with tds_trace(doc):
+			run_queries(1)
+		save_to_db()
+
+		self.assertFalse(frappe.db.exists("TDS Performance Log", {"reference_name": doc.name}))
@@ -0,0 +1,113 @@
+# Copyright (c) 2025, pwctech technologies private limited and Contributors
+# See license.txt
+
+import unittest
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import today
+from erpnext.accounts.doctype.tax_withholding_category.test_tax_withholding_category import create_records
+from erpnext.accounts.utils import get_fiscal_year
+
+from bharat_compliance.income_tax_bharat.doctype.tax_withholding_setting.tax_withholding_setting import (
+	enable_item_wise_tds,
+)
+from bharat_compliance.overrides.test_purchase_invoice import (
+	create_item_with_category,
+	create_supplier,
+	create_tax_withholding_category,
+	make_item_wise_purchase_invoice,
+)
+from bharat_compliance.utils.lower_deduction_certificate import get_headroom, rebuild_consumed_amounts
+
+CATEGORY = "_Test Item Wise LDC TDS"
+SUPPLIER = "_Test Item Wise LDC Supplier"
+ITEM = "_Test Item Wise LDC Item"
+
+
+class TestLowerDeductionCertificate(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		create_records()
+		enable_item_wise_tds()
+		if not frappe.get_meta("Supplier").has_field("pan"):
+			raise unittest.SkipTest("Supplier has no PAN field")
+
+		create_tax_withholding_category(CATEGORY, rate=10, single_threshold=1000)
+		supplier = create_supplier(SUPPLIER)
+		supplier.db_set("pan", "ABCTE1234L")
+		create_item_with_category(ITEM, SUPPLIER, CATEGORY)
+		cls.certificate = create_lower_deduction_certificate(SUPPLIER, "ABCTE1234L", CATEGORY, 100000)
+
+	def test_consumed_amount_follows_submit_and_cancel(self):
+		pi = make_item_wise_purchase_invoice(SUPPLIER, [(ITEM, 5000)], submit=True)
+		self.assertEqual(get_consumed_amount(self.certificate), 5000)
+
+		pi.cancel()
+		self.assertEqual(get_consumed_amount(self.certificate), 0)
+
+	def test_rebuild_matches_maintained_amount(self):
+		make_item_wise_purchase_invoice(SUPPLIER, [(ITEM, 3000)], submit=True)
+		maintained = get_consumed_amount(self.certificate)
+
+		rebuild_consumed_amounts("_Test Company")
+		self.assertEqual(get_consumed_amount(self.certificate), maintained)
+
+		headroom = next(d for d in get_headroom({"company": "_Test Company"}) if d.name == self.certificate)
+		self.assertEqual(headroom.remaining_amount, 100000 - maintained)
+
+	def test_backdated_certificate_counts_earlier_invoices(self):
+		supplier = create_supplier("_Test Item Wise Backdated LDC Supplier")
+		supplier.db_set("pan", "ABCTE5678L")
+		create_item_with_category("_Test Item Wise Backdated LDC Item", supplier.name, CATEGORY)
+		make_item_wise_purchase_invoice(supplier.name, [("_Test Item Wise Backdated LDC Item", 4000)], submit=True)
+
+		# created after the invoice, valid from the start of the fiscal year
+		certificate = create_lower_deduction_certificate(
+			supplier.name, "ABCTE5678L", CATEGORY, 100000, certificate_no="_TEST-LDC-0002"
+		)
+		self.assertEqual(get_consumed_amount(certificate), 4000)
+
+		frappe.db.set_value("Lower Deduction Certificate", certificate, "consumed_amount", 0)
+		ldc = frappe.get_doc("Lower Deduction Certificate", certificate)
+		ldc.save()
+		# unchanged key fields keep the counter
+		self.assertEqual(get_consumed_amount(certificate), 0)
+
+		ldc.valid_from = frappe.utils.add_days(ldc.valid_from, 1)
+		ldc.save()
+		self.assertEqual(get_consumed_amount(certificate), 4000)
+
+
+def get_consumed_amount(certificate):
+	return frappe.db.get_value("Lower Deduction Certificate", certificate, "consumed_amount")
+
+
+def create_lower_deduction_certificate(
+	supplier, pan_no, tax_withholding_category, limit, certificate_no="_TEST-LDC-0001"
+):
+	fiscal_year = get_fiscal_year(today(), company="_Test Company")
+	name = frappe.db.exists("Lower Deduction Certificate", {"supplier": supplier})
+	if name:
+		return name
+
+	return (
+		frappe.get_doc(
+			{
+				"doctype": "Lower Deduction Certificate",
+				"company": "_Test Company",
+				"supplier": supplier,
+				"pan_no": pan_no,
+				"certificate_no": certificate_no,
+				"tax_withholding_category": tax_withholding_category,
+				"fiscal_year": fiscal_year[0],
+				"valid_from": fiscal_year[1],
+				"valid_upto": fiscal_year[2],
+				"rate": 2,
+				"certificate_limit": limit,
+			}
+		)
+		.insert()
+		.name
+	)
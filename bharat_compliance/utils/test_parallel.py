@@ -0,0 +1,44 @@
+# Copyright (c) 2025, pwctech technologies private limited and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, getdate
+
+from bharat_compliance.utils.parallel import get_date_windows, partition_by_pan
+
+
+class TestParallel(FrappeTestCase):
+	def test_parties_sharing_a_pan_stay_together(self):
+		pan = "AAAPL1234C"
+		for supplier in ("_Test Parallel Supplier 1", "_Test Parallel Supplier 2"):
+			if not frappe.db.exists("Supplier", supplier):
+				frappe.get_doc(
+					{"doctype": "Supplier", "supplier_name": supplier, "supplier_group": "All Supplier Groups"}
+				).insert()
+			if frappe.get_meta("Supplier").has_field("pan"):
+				frappe.db.set_value("Supplier", supplier, "pan", pan)
+
+		party_items = {
+			"_Test Parallel Supplier 1": ["PI-1", "PI-2"],
+			"_Test Parallel Supplier 2": ["PI-3"],
+			"_Test Supplier": ["PI-4"],
+		}
+		partitions = partition_by_pan(party_items, "Supplier", partitions=2)
+
+		self.assertEqual(sorted(d for p in partitions for d in p), ["PI-1", "PI-2", "PI-3", "PI-4"])
+		self.assertEqual(partitions, partition_by_pan(party_items, "Supplier", partitions=2))
+		if frappe.get_meta("Supplier").has_field("pan"):
+			self.assertIn(["PI-1", "PI-2", "PI-3"], partitions)
+
+	def test_date_windows_cover_the_range(self):
+		from_date, to_date = getdate("2024-04-01"), getdate("2025-03-31")
+		windows = get_date_windows(from_date, to_date, partitions=5)
+
+		self.assertEqual(len(windows), 5)
+		self.assertEqual(windows[0].from_date, from_date)
+		self.assertEqual(windows[-1].to_date, to_date)
+		for previous, window in zip(windows, windows[1:]):
+			self.assertEqual(getdate(add_days(previous.to_date, 1)), getdate(window.from_date))
+
+		self.assertEqual(len(get_date_windows(from_date, from_date, partitions=5)), 1)